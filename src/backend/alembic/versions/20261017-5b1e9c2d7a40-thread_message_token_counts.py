@@ -0,0 +1,24 @@
+"""thread_message_token_counts
+
+Revision ID: 5b1e9c2d7a40
+Revises: 07fd1bcafad1
+Create Date: 2026-10-17 10:12:41.318402
+
+"""
+import sqlalchemy as sa
+from typing import Sequence, Union
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e9c2d7a40'
+down_revision: Union[str, None] = '07fd1bcafad1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('thread_message', sa.Column('token_counts', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('thread_message', 'token_counts')
@@ -0,0 +1,32 @@
+"""file_extraction
+
+Revision ID: 8d3f1a6c2e91
+Revises: 5b1e9c2d7a40
+Create Date: 2026-10-17 11:02:18.604127
+
+"""
+import sqlalchemy as sa
+import sqlmodel
+from typing import Sequence, Union
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f1a6c2e91'
+down_revision: Union[str, None] = '5b1e9c2d7a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('file_extraction',
+                    sa.Column('content_hash', sqlmodel.AutoString(length=64), nullable=False),
+                    sa.Column('processor', sqlmodel.AutoString(length=50), nullable=False),
+                    sa.Column('processor_version', sa.Integer(), nullable=False),
+                    sa.Column('processed_content', sqlmodel.AutoString(), nullable=False),
+                    sa.Column('timestamp', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('content_hash', 'processor', 'processor_version')
+                    )
+
+
+def downgrade() -> None:
+    op.drop_table('file_extraction')
@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 
@@ -18,4 +19,12 @@ if __name__ == "__main__":
     LOGGING_CONFIG["loggers"]["tero"] = {"handlers": ["default"], "level": "INFO"}
     LOGGING_CONFIG["loggers"]["openai"] = {"handlers": ["default"], "level": "INFO"}
     
-    uvicorn.run("tero.api:app", host="0.0.0.0", port=8000, reload=len(sys.argv) > 1)
+    reload = len(sys.argv) > 1
+    # imported here so env is only loaded when actually running the server
+    from tero.core.env import env
+    workers = 1 if reload else env.server_workers
+    if workers > 1 and env.stream_registry == 'memory':
+        logging.getLogger("tero").warning("Running multiple workers with memory stream registry. Stopping answers only works if the request reaches the worker streaming the answer. Set STREAM_REGISTRY=postgres to share streams among workers.")
+    if workers > 1 and env.metrics_enabled:
+        logging.getLogger("tero").warning("Metrics are not exposed when running multiple workers, since each worker keeps its own metrics. Run several instances with a single worker to get metrics.")
+    uvicorn.run("tero.api:app", host="0.0.0.0", port=8000, reload=reload, workers=workers, log_config=LOGGING_CONFIG)
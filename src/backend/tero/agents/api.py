@@ -15,8 +15,8 @@ from ..core.repos import get_db
 from ..files.api import build_file_download_response
 from ..files.domain import File, FileStatus, FileUpdate, FileMetadata, FileMetadataWithContent
 from ..files.file_quota import QuotaExceededError
-from ..files.parser import add_encoding_to_content_type
 from ..files.repos import FileRepository
+from ..files.upload import SpooledUpload, spool_upload
 from ..threads.domain import Thread, ThreadMessage
 from ..threads.repos import ThreadRepository, ThreadMessageRepository
 from ..tools.core import AgentTool
@@ -234,14 +234,14 @@ async def upload_agent_tool_file(agent_id: int, tool_id: str, file: UploadFile,
         user: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)], 
         background_tasks: BackgroundTasks) -> FileMetadata:
         tool = await _find_editable_configured_agent_tool(agent_id, tool_id, user, db)
-        f = File(
-            user_id=user.id,
-            name=file.filename or _DEFAULT_FILE_NAME,
-            content_type=file.content_type or "",
-            content=await file.read(),
-            status=FileStatus.PENDING
-        )
-        return await upload_tool_file(f, tool, agent_id, user, db, background_tasks)
+        async with spool_upload(file, _DEFAULT_FILE_NAME) as upload:
+            f = File(
+                user_id=user.id,
+                name=upload.name,
+                content_type=upload.content_type,
+                status=FileStatus.PENDING
+            )
+            return await upload_tool_file(f, tool, agent_id, user, db, background_tasks, upload)
 
 
 @router.get(AGENT_TOOL_FILES_PATH)
@@ -301,17 +301,21 @@ async def update_agent_tool_file(agent_id: int, tool_id: str, file_id: int, file
         background_tasks: BackgroundTasks) -> FileMetadata:
     tool = await _find_editable_configured_agent_tool(agent_id, tool_id, user, db)
     f = await _find_agent_tool_file(agent_id, tool_id, file_id, db)
-    file_content = await file.read()
-    update = FileUpdate(
-        content=file_content if len(file_content) > 0 else None,
-        content_type=add_encoding_to_content_type(file.content_type, file_content),
-        name=file.filename or _DEFAULT_FILE_NAME,
-        user_id=user.id,
-        status=FileStatus.PENDING
-    )
-    f.update_with(update)
-    await FileRepository(db).update(f)
-    background_tasks.add_task(_update_tool_file, f, tool, user, db)
+    async with spool_upload(file, _DEFAULT_FILE_NAME) as upload:
+        update = FileUpdate(
+            content_type=upload.content_type,
+            name=upload.name,
+            user_id=user.id,
+            status=FileStatus.PENDING
+        )
+        f.update_with(update)
+        if upload.size > 0:
+            await FileRepository(db).update_with_content_from(f, upload.path)
+            # the background task processes the file from the spool, and removes it once done
+            background_tasks.add_task(_update_tool_file, f, tool, user, db, upload.detach())
+        else:
+            await FileRepository(db).update(f)
+            background_tasks.add_task(_update_tool_file, f, tool, user, db)
     return FileMetadata.from_file(f)
 
 
@@ -322,9 +326,9 @@ async def _find_agent_tool_file(agent_id: int, tool_id: str, file_id: int, db: A
     return ret
 
 
-async def _update_tool_file(file: File, tool: AgentTool, user: User, db: AsyncSession):
+async def _update_tool_file(file: File, tool: AgentTool, user: User, db: AsyncSession, upload: Optional[SpooledUpload] = None):
     try:
-        await tool.update_file(file, user)
+        await tool.update_file(file, user, upload)
         file.status = FileStatus.PROCESSED
     except QuotaExceededError:
         file.status = FileStatus.QUOTA_EXCEEDED
@@ -334,6 +338,8 @@ async def _update_tool_file(file: File, tool: AgentTool, user: User, db: AsyncSe
         logger.error(f"Error updating tool file {file.id} {file.name} {e}", exc_info=True)
     finally:
         await FileRepository(db).update(file)
+        if upload:
+            await upload.remove()
 
 
 @router.delete(AGENT_TOOL_FILE_PATH, status_code=status.HTTP_204_NO_CONTENT)    
@@ -436,7 +442,8 @@ async def update_agent_from_distribution(agent_id: int, file: UploadFile, user:
         background_tasks: BackgroundTasks):
     agent = await find_editable_agent(agent_id, user, db)
     try:
-        await distribution.update_agent_from_zip(agent, await file.read(), user, db, background_tasks)
+        async with spool_upload(file, _DEFAULT_FILE_NAME) as upload:
+            await distribution.update_agent_from_zip(agent, upload.path, user, db, background_tasks)
     except (BadZipFile, ValueError):
         logger.error(f"Error updating agent {agent_id} from distribution", exc_info=True)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Error updating agent from distribution")
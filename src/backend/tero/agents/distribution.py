@@ -150,8 +150,9 @@ def _create_icon_with_background(icon_bytes: bytes, bg_color: str) -> bytes:
         return icon_bytes
 
 
-async def update_agent_from_zip(agent: Agent, zip_content: bytes, user: User, db: AsyncSession, background_tasks: BackgroundTasks) -> Agent:
-    with ZipFile(BytesIO(zip_content), metadata_encoding='utf-8') as zip_file:
+# the zip is read from a file so only the entries being processed are loaded in memory
+async def update_agent_from_zip(agent: Agent, zip_path: str, user: User, db: AsyncSession, background_tasks: BackgroundTasks) -> Agent:
+    with ZipFile(zip_path, metadata_encoding='utf-8') as zip_file:
         found_root_folder = [ name.rsplit('/', 1)[0] for name in zip_file.namelist() if name.endswith('/agent.md') ]
         # supporting zip without root folder in case users zip the folder contents and not the folder itself
         root_folder = f"{found_root_folder[0]}/" if found_root_folder else ""
@@ -7,7 +7,7 @@ from fastapi.responses import StreamingResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ...core.auth import get_current_user
-from ...core.repos import get_db
+from ...core.repos import get_db, get_db_factory, DbSessionFactory
 from ...users.domain import User
 from ...threads.repos import ThreadMessageRepository, ThreadRepository
 from ...threads.domain import Thread, ThreadMessage, ThreadMessagePublic
@@ -70,6 +70,7 @@ async def run_test_suite(
     request: RunTestSuiteRequest,
     user: Annotated[User, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
+    db_factory: Annotated[DbSessionFactory, Depends(get_db_factory)],
     background_tasks: BackgroundTasks
 ) -> StreamingResponse:
     agent = await find_editable_agent(agent_id, user, db)
@@ -103,7 +104,7 @@ async def run_test_suite(
     background_tasks.add_task(cleanup_orphaned_suite_run, suite_run.id, agent.id)
     
     return StreamingResponse(
-        TestCaseRunner(db).run_test_suite_stream(agent, all_test_cases, test_cases_to_run, user.id, suite_run),
+        TestCaseRunner(db, db_factory).run_test_suite_stream(agent, all_test_cases, test_cases_to_run, user.id, suite_run),
         media_type="text/event-stream",
     )
 
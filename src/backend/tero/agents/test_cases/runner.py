@@ -14,6 +14,7 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 from sse_starlette.event import ServerSentEvent
 
 from ...core.env import env
+from ...core.sse import ChunkCoalescer
 from ...ai_models import ai_factory
 from ...ai_models.repos import AiModelRepository
 from ...ai_models.domain import LlmModel
@@ -22,7 +23,7 @@ from ...threads.domain import ThreadMessage, Thread, ThreadMessageOrigin, AgentM
 from ...threads.repos import ThreadMessageRepository, ThreadRepository
 from ...threads.engine import AgentEngine
 from ...usage.repos import UsageRepository
-from ...core.repos import engine
+from ...core.repos import engine, DbSessionFactory
 from ..domain import Agent
 from .domain import TestCase, TestCaseResultStatus, TestCaseEventType, TestCaseResult, TestSuiteRun, TestSuiteEventType, TestSuiteRunStatus
 from .repos import TestCaseResultRepository, TestSuiteRunRepository
@@ -93,8 +94,9 @@ class EvaluatorUsageTrackingCallback(AsyncCallbackHandler):
 
 class TestCaseRunner:
 
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, db_factory: DbSessionFactory):
         self._db = db
+        self._db_factory = db_factory
     
     async def run_test_case_stream(self, test_case: TestCase, agent: Agent, user_id: int, result: TestCaseResult) -> AsyncIterator[Tuple[TestCaseEventType, Any]]:
         results_repo = TestCaseResultRepository(self._db)
@@ -181,12 +183,15 @@ class TestCaseRunner:
     
     async def _execute_agent_with_input_stream(self, agent: Agent, user_input: str, user_id: int, thread_id: int) -> AsyncIterator[Tuple[TestCaseEventType, Any]]:
         thread_message_repo = ThreadMessageRepository(self._db)
-        input_message = await thread_message_repo.add(ThreadMessage(
+        engine = AgentEngine(agent, user_id)
+        input_message = ThreadMessage(
             text=user_input,
             origin=ThreadMessageOrigin.USER,
             timestamp=datetime.now(timezone.utc),
             thread_id=thread_id
-        ))
+        )
+        engine.count_tokens(input_message)
+        input_message = await thread_message_repo.add(input_message)
         
         yield (TestCaseEventType.USER_MESSAGE, {
             "id": input_message.id,
@@ -194,7 +199,6 @@ class TestCaseRunner:
         })
         
         input_message_usage = MessageUsage(user_id=user_id, agent_id=agent.id, model_id=agent.model_id, message_id=input_message.id)
-        engine = AgentEngine(agent, user_id, self._db)
         
         response_message = await thread_message_repo.add(ThreadMessage(
             text="", 
@@ -209,18 +213,27 @@ class TestCaseRunner:
         })
         
         complete_response = ""
-        async for event in engine.answer([input_message], input_message_usage, asyncio.Event()):
-            if isinstance(event, AgentActionEvent):
-                yield (TestCaseEventType.EXECUTION_STATUS, event)
-            elif isinstance(event, AgentMessageEvent):
-                complete_response += event.content
-                yield (TestCaseEventType.AGENT_MESSAGE_CHUNK, {
-                    "id": response_message.id,
-                    "chunk": event.content
-                })
+        # chunks are coalesced to avoid sending an event per generated token
+        coalescer = ChunkCoalescer()
+        async with await engine.load_tools(self._db_factory, thread_id) as loaded_tools:
+            async for event in engine.answer([input_message], input_message_usage, asyncio.Event(), loaded_tools):
+                if isinstance(event, AgentActionEvent):
+                    pending_chunk = coalescer.flush()
+                    if pending_chunk:
+                        yield self._build_agent_message_chunk(response_message, pending_chunk)
+                    yield (TestCaseEventType.EXECUTION_STATUS, event)
+                elif isinstance(event, AgentMessageEvent):
+                    complete_response += event.content
+                    chunk = coalescer.add(event.content)
+                    if chunk:
+                        yield self._build_agent_message_chunk(response_message, chunk)
+        pending_chunk = coalescer.flush()
+        if pending_chunk:
+            yield self._build_agent_message_chunk(response_message, pending_chunk)
         
         response_message.text = complete_response
         response_message.timestamp = datetime.now(timezone.utc)
+        engine.count_tokens(response_message)
         await thread_message_repo.update(response_message)
         await UsageRepository(self._db).add(input_message_usage)
         
@@ -229,6 +242,12 @@ class TestCaseRunner:
             "text": complete_response,
         })
     
+    def _build_agent_message_chunk(self, response_message: ThreadMessage, chunk: str) -> Tuple[TestCaseEventType, Any]:
+        return (TestCaseEventType.AGENT_MESSAGE_CHUNK, {
+            "id": response_message.id,
+            "chunk": chunk
+        })
+
     async def _evaluate_test_case_result(
         self, 
         user_input: str, 
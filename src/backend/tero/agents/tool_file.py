@@ -1,4 +1,5 @@
 import logging
+from typing import Optional
 
 from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi.background import BackgroundTasks
@@ -7,6 +8,7 @@ from ..files.domain import File, FileStatus, FileMetadata
 from ..files.file_quota import QuotaExceededError
 from ..files.parser import add_encoding_to_content_type
 from ..files.repos import FileRepository
+from ..files.upload import SpooledUpload
 from ..tools.core import AgentTool
 from ..users.domain import User
 from .domain import AgentToolConfigFile
@@ -16,17 +18,23 @@ from .repos import AgentToolConfigFileRepository
 logger = logging.getLogger(__name__)
 
 
-async def upload_tool_file(file: File, tool: AgentTool, agent_id: int, user: User, db: AsyncSession, background_tasks: BackgroundTasks) -> FileMetadata:
-    file.content_type = add_encoding_to_content_type(file.content_type, file.content)
-    file = await FileRepository(db).add(file)
+# files of spooled uploads (which already have their encoding detected) are stored and processed from the spool, which the
+# background task removes once done
+async def upload_tool_file(file: File, tool: AgentTool, agent_id: int, user: User, db: AsyncSession, background_tasks: BackgroundTasks,
+                           upload: Optional[SpooledUpload] = None) -> FileMetadata:
+    if upload:
+        file = await FileRepository(db).add_with_content_from(file, upload.path)
+    else:
+        file.content_type = add_encoding_to_content_type(file.content_type, file.content)
+        file = await FileRepository(db).add(file)
     await AgentToolConfigFileRepository(db).add(AgentToolConfigFile(agent_id=agent_id, tool_id=tool.id, file_id=file.id))
-    background_tasks.add_task(_add_tool_file, file, user, tool, db)
+    background_tasks.add_task(_add_tool_file, file, user, tool, db, upload.detach() if upload else None)
     return FileMetadata.from_file(file)
 
 
-async def _add_tool_file(f: File, user: User, tool: AgentTool, db: AsyncSession):
+async def _add_tool_file(f: File, user: User, tool: AgentTool, db: AsyncSession, upload: Optional[SpooledUpload] = None):
     try:
-        await tool.add_file(f, user)
+        await tool.add_file(f, user, upload)
         f.status = FileStatus.PROCESSED
     except QuotaExceededError:
         f.status = FileStatus.QUOTA_EXCEEDED
@@ -36,3 +44,5 @@ async def _add_tool_file(f: File, user: User, tool: AgentTool, db: AsyncSession)
         logger.error(f"Error adding tool file {f.id} {f.name} {e}", exc_info=True)
     finally:
         await FileRepository(db).update(f)
+        if upload:
+            await upload.remove()
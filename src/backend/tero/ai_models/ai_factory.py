@@ -1,14 +1,20 @@
 from typing import Any, Optional
 
+from langchain_core.embeddings import Embeddings
+
 from ..core.env import env
 from .aws_provider import AWSProvider
 from .azure_provider import AzureProvider
-from .domain import AiModelProvider
+from .domain import AiModelProvider, MeteredEmbeddings
+from .fake_provider import FakeProvider, load_fake_responses
 from .google_provider import GoogleProvider
 from .openai_provider import OpenAIProvider
 
 
 providers: list[AiModelProvider] = []
+# fake models are registered first so they can replace models of other providers in load tests
+if env.fake_model_ids:
+    providers.append(FakeProvider(env.fake_model_ids, load_fake_responses(env.fake_model_responses_path)))
 if env.openai_api_key:
     providers.append(OpenAIProvider())
 if env.azure_endpoints and env.azure_api_keys:
@@ -36,4 +42,8 @@ def build_chat_model(model: str, temperature: Optional[float]=None, reasoning_ef
 def build_streaming_chat_model(model: str, temperature: Optional[float]=None, reasoning_effort: Optional[str]=None) -> Any:
     return get_provider(model).build_streaming_chat_model(model, temperature, reasoning_effort)
 
-    
\ No newline at end of file
+    
+
+
+def build_embedding(model: str) -> Embeddings:
+    return MeteredEmbeddings(get_provider(model).build_embedding(model), model)
@@ -1,5 +1,4 @@
 import io
-from typing import Optional
 
 
 import boto3
@@ -11,12 +10,13 @@ from .domain import AiModelProvider
 
 
 class AWSProvider(AiModelProvider):
+    name = "aws"
 
     def __init__(self):
         super().__init__()
         self.model_arn_map = {}
 
-    def _build_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+    def _build_chat_model(self, model: str) -> BaseChatModel:
         aws_model_id = env.aws_model_id_mapping.get(model)
         if not aws_model_id:
             raise ValueError(f"Model {model} not supported by AWS")
@@ -25,8 +25,7 @@ class AWSProvider(AiModelProvider):
             aws_secret_access_key=env.aws_secret_access_key,
             region_name=env.aws_region,
             model=self._get_model_arn(aws_model_id),
-            provider=self._get_model_provider(aws_model_id),
-            temperature=temperature)
+            provider=self._get_model_provider(aws_model_id))
     
     def supports_model(self, model: str) -> bool:
         return model in env.aws_model_id_mapping
@@ -1,5 +1,5 @@
 import io
-from typing import Optional, cast
+from typing import Any, Optional, cast
 
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
@@ -9,12 +9,13 @@ import tiktoken
 
 from ..core.env import env
 from .domain import AiModelProvider
-from .openai_provider import get_encoding_model
+from .openai_provider import build_temperature_settings, get_encoding_model
 
 
 class AzureProvider(AiModelProvider):
+    name = "azure"
 
-    def _build_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+    def _build_chat_model(self, model: str) -> BaseChatModel:
         deployment = env.azure_model_deployments[model]
         return ReasoningTokenCountingAzureChatOpenAI(
             azure_endpoint=env.azure_endpoints[deployment.endpoint_index],
@@ -22,11 +23,14 @@ class AzureProvider(AiModelProvider):
             api_version=env.azure_api_version,
             api_key=env.azure_api_keys[deployment.endpoint_index],
             model=model,
-            temperature=temperature,
-            reasoning_effort=reasoning_effort,
-            streaming=streaming,
             stream_usage=True)
 
+    def _get_endpoint(self, model: str) -> str:
+        return env.azure_endpoints[env.azure_model_deployments[model].endpoint_index]
+
+    def _build_chat_model_settings(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> dict[str, Any]:
+        return {**build_temperature_settings(model, temperature), "reasoning_effort": reasoning_effort, "streaming": streaming}
+
     def supports_model(self, model: str) -> bool:
         return model in env.azure_model_deployments
 
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
 from enum import Enum
 import io
-from typing import Any, Optional
+import time
+from typing import Any, Optional, cast
+from uuid import UUID
 
-from langchain_core.callbacks import StdOutCallbackHandler
+from langchain_core.callbacks import BaseCallbackHandler, StdOutCallbackHandler
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.tracers import ConsoleCallbackHandler
@@ -12,6 +14,7 @@ from sqlmodel import Field
 
 from ..core.env import env
 from ..core.domain import CamelCaseModel
+from ..core.metrics import Histogram
 
 
 class LlmModelType(Enum):
@@ -43,11 +46,82 @@ class LlmModel(CamelCaseModel, table=True):
         return self.id in env.agent_basic_models
 
 
+llm_time_to_first_token = Histogram("tero_llm_time_to_first_token_seconds", "Time until streamed LLM calls generate the first token",
+                                    ["model", "provider"])
+llm_duration = Histogram("tero_llm_duration_seconds", "Time of LLM calls, until the whole response is generated",
+                         ["model", "provider", "status"])
+embedding_batch_size = Histogram("tero_embedding_batch_size", "Number of texts embedded in each call to embedding models", ["model"],
+                                 buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000))
+
+
+# observes calls to chat models. It runs inline, instead of being dispatched to a thread, since it just records times
+class _LlmMetricsCallbackHandler(BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self, model: str, provider: str):
+        self._model = model
+        self._provider = provider
+        self._starts: dict[UUID, float] = {}
+        self._pending_first_token: set[UUID] = set()
+
+    def on_chat_model_start(self, serialized: dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any):
+        self._starts[run_id] = time.perf_counter()
+        self._pending_first_token.add(run_id)
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, run_id: UUID, **kwargs: Any):
+        # first chunks may only contain the message role, so we wait for text or tool calls
+        if run_id in self._pending_first_token and (token or getattr(getattr(chunk, "message", None), "tool_call_chunks", None)):
+            self._pending_first_token.discard(run_id)
+            llm_time_to_first_token.observe(time.perf_counter() - self._starts[run_id], model=self._model, provider=self._provider)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "success")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "error")
+
+    def _finish(self, run_id: UUID, status: str):
+        self._pending_first_token.discard(run_id)
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            llm_duration.observe(time.perf_counter() - start, model=self._model, provider=self._provider, status=status)
+
+
+# observes the batch sizes of embedding calls, which determine the number of requests sent to embedding models
+class MeteredEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, model: str):
+        self._embeddings = embeddings
+        self._model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        embedding_batch_size.observe(len(texts), model=self._model)
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        embedding_batch_size.observe(1, model=self._model)
+        return self._embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        embedding_batch_size.observe(len(texts), model=self._model)
+        return await self._embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        embedding_batch_size.observe(1, model=self._model)
+        return await self._embeddings.aembed_query(text)
+
+
 class AiModelProvider(ABC):
+    # identifies the provider in metrics
+    name = ""
+
+    def __init__(self):
+        # chat models are built once per model and endpoint and then copied for each call with call specific settings.
+        # Copies share the underlying clients, avoiding new connection pools and tls handshakes on every call
+        self._chat_models: dict[tuple[str, str], BaseChatModel] = {}
 
     def build_chat_model(self, model: str, temperature: Optional[float]=None, reasoning_effort: Optional[str] = None) -> BaseChatModel:
-        ret = self._build_chat_model(model, temperature, reasoning_effort, False)
-        return self._prepare_chat_model(ret)
+        return self._build_pooled_chat_model(model, temperature, reasoning_effort, False)
     
     def _prepare_chat_model(self, model: Any) -> BaseChatModel:
         model.verbose = True
@@ -55,13 +129,33 @@ class AiModelProvider(ABC):
         return model
 
     def build_streaming_chat_model(self, model: str, temperature: Optional[float]=None, reasoning_effort: Optional[str]=None) -> BaseChatModel:
-        ret = self._build_chat_model(model, temperature, reasoning_effort, True)
-        return self._prepare_chat_model(ret)
+        return self._build_pooled_chat_model(model, temperature, reasoning_effort, True)
+
+    def _build_pooled_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+        key = (model, self._get_endpoint(model))
+        chat_models = self._get_pooled_chat_models()
+        pooled = chat_models.get(key)
+        if pooled is None:
+            pooled = self._build_chat_model(model)
+            chat_models[key] = pooled
+        ret = self._prepare_chat_model(pooled.model_copy(update=self._build_chat_model_settings(model, temperature, reasoning_effort, streaming)))
+        ret.callbacks = [*cast(list, ret.callbacks or []), _LlmMetricsCallbackHandler(model, self.name)]
+        return ret
+
+    def _get_endpoint(self, model: str) -> str:
+        return ""
+
+    def _get_pooled_chat_models(self) -> dict[tuple[str, str], BaseChatModel]:
+        return self._chat_models
 
     @abstractmethod
-    def _build_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+    def _build_chat_model(self, model: str) -> BaseChatModel:
         pass
 
+    # settings are applied with model_copy, which skips model validations, so implementations must apply any required adjustment
+    def _build_chat_model_settings(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> dict[str, Any]:
+        return {"temperature": temperature}
+
     @abstractmethod
     def supports_model(self, model: str) -> bool:
         pass
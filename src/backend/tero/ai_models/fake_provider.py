@@ -0,0 +1,194 @@
+import asyncio
+import io
+import json
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Sequence
+import uuid
+import zlib
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream, generate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel, Field
+
+from ..core.domain import CamelCaseModel
+from ..core.env import env
+from .domain import AiModelProvider
+
+
+# words and trailing spaces are considered tokens, which is close enough to real tokenizers for load testing
+_TOKEN_PATTERN = re.compile(r"\S+\s*")
+_WORDS = ["the", "agent", "answer", "data", "report", "team", "project", "result", "value", "time", "user", "query",
+          "model", "document", "summary", "analysis", "is", "was", "with", "for", "and", "to", "of", "in", "this", "that"]
+
+
+class FakeModelError(Exception):
+    pass
+
+
+class FakeToolCall(CamelCaseModel):
+    name: str
+    args: dict[str, Any] = {}
+
+
+# scripted response returned when the last message text matches the given regex (or always, if no regex is given).
+# Responses with tool calls are only used when the last message is not a tool result, to avoid endless tool call loops.
+class FakeResponse(CamelCaseModel):
+    match: Optional[str] = None
+    content: str = ""
+    tool_calls: list[FakeToolCall] = []
+    error: Optional[str] = None
+
+
+def _count_tokens(text: str) -> int:
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+# Chat model which doesn't call any external service and streams scripted or deterministic (derived from the input)
+# responses simulating the latency of real models, so the whole stack can be load tested without spending on LLMs.
+class FakeChatModel(BaseChatModel):
+    model_name: str
+    temperature: Optional[float] = None
+    streaming: bool = False
+    time_to_first_token_seconds: float = 0
+    tokens_per_second: float = 0
+    response_tokens: int = 50
+    error_rate: float = 0
+    responses: list[FakeResponse] = []
+    # allows tests to inject delays or failures without relying on randomness
+    random: Callable[[], float] = Field(default=random.random, exclude=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def get_num_tokens(self, text: str) -> int:
+        return _count_tokens(text)
+
+    def bind_tools(self, tools: Sequence[dict[str, Any] | type[BaseModel] | Callable | BaseTool], *, tool_choice: Optional[str] = None,
+                   **kwargs: Any) -> Any:
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], tool_choice=tool_choice, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response = self._find_response(messages, kwargs.get("tools"))
+        error = self._find_error(response)
+        if error:
+            time.sleep(self.time_to_first_token_seconds)
+            raise FakeModelError(error)
+        for delay, chunk in self._build_chunks(response, messages, kwargs.get("tools")):
+            time.sleep(delay)
+            if run_manager and isinstance(chunk.message.content, str) and chunk.message.content:
+                run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        response = self._find_response(messages, kwargs.get("tools"))
+        error = self._find_error(response)
+        if error:
+            # real models fail after processing the request for a while
+            await asyncio.sleep(self.time_to_first_token_seconds)
+            raise FakeModelError(error)
+        for delay, chunk in self._build_chunks(response, messages, kwargs.get("tools")):
+            await asyncio.sleep(delay)
+            if run_manager and isinstance(chunk.message.content, str) and chunk.message.content:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    def _find_error(self, response: FakeResponse) -> Optional[str]:
+        if response.error:
+            return response.error
+        return "Injected fake model error" if self.random() < self.error_rate else None
+
+    # generates the chunks to stream with the delay to wait before each one
+    def _build_chunks(self, response: FakeResponse, messages: list[BaseMessage], tools: Optional[list[dict]]) -> Iterator[tuple[float, ChatGenerationChunk]]:
+        token_delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        message_id = f"run-{uuid.uuid4()}"
+        tokens = _TOKEN_PATTERN.findall(response.content)
+        delay = self.time_to_first_token_seconds
+        for token in tokens:
+            yield delay, ChatGenerationChunk(message=AIMessageChunk(content=token, id=message_id))
+            delay = token_delay
+        tool_call_chunks = [{"name": tc.name, "args": json.dumps(tc.args), "id": f"call_{uuid.uuid4().hex}", "index": i}
+                            for i, tc in enumerate(response.tool_calls)]
+        input_tokens = self.get_num_tokens_from_messages(messages) + (self.get_num_tokens(json.dumps(tools)) if tools else 0)
+        output_tokens = len(tokens) + sum(self.get_num_tokens(tc["name"] + tc["args"]) for tc in tool_call_chunks)
+        # usage is only set in the last chunk since langchain sums the usage of all chunks
+        usage = UsageMetadata(input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens)
+        yield (delay if tool_call_chunks or not tokens else 0), ChatGenerationChunk(
+            message=AIMessageChunk(content="", id=message_id, tool_call_chunks=tool_call_chunks, usage_metadata=usage,  # type: ignore
+                                   response_metadata={"model_name": self.model_name, "finish_reason": "tool_calls" if tool_call_chunks else "stop"}))
+
+    def _find_response(self, messages: list[BaseMessage], tools: Optional[list[dict]]) -> FakeResponse:
+        last_message = messages[-1] if messages else HumanMessage("")
+        last_text = last_message.text()
+        tool_names = {t["function"]["name"] for t in tools or []}
+        for response in self.responses:
+            if response.tool_calls and (isinstance(last_message, ToolMessage) or any(tc.name not in tool_names for tc in response.tool_calls)):
+                continue
+            if response.match is None or re.search(response.match, last_text):
+                return response
+        return FakeResponse(content=self._build_deterministic_content(messages))
+
+    def _build_deterministic_content(self, messages: list[BaseMessage]) -> str:
+        # same input always produces the same answer, which makes responses comparable among runs
+        rnd = random.Random(zlib.crc32("".join(m.text() for m in messages).encode()))
+        words = [rnd.choice(_WORDS) for _ in range(self.response_tokens)]
+        return " ".join(words).capitalize() + "." if words else ""
+
+
+class FakeProvider(AiModelProvider):
+    name = "fake"
+
+    def __init__(self, model_ids: list[str], responses: list[FakeResponse]):
+        super().__init__()
+        self._model_ids = model_ids
+        self._responses = responses
+
+    def _build_chat_model(self, model: str) -> BaseChatModel:
+        return FakeChatModel(
+            model_name=model,
+            time_to_first_token_seconds=env.fake_model_ttft_ms / 1000,
+            tokens_per_second=env.fake_model_tokens_per_second,
+            response_tokens=env.fake_model_response_tokens,
+            error_rate=env.fake_model_error_rate,
+            responses=self._responses)
+
+    def _build_chat_model_settings(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> dict[str, Any]:
+        return {"temperature": temperature, "streaming": streaming}
+
+    def supports_model(self, model: str) -> bool:
+        return model in self._model_ids
+
+    async def transcribe_audio(self, file: io.BytesIO, model: str) -> str:
+        return f"Fake transcription of {len(file.getvalue())} bytes"
+
+    def build_embedding(self, model: str) -> Embeddings:
+        return DeterministicFakeEmbedding(size=env.fake_model_embedding_size)
+
+
+def load_fake_responses(path: Optional[str]) -> list[FakeResponse]:
+    if not path:
+        return []
+    with open(path) as f:
+        return [FakeResponse.model_validate(r) for r in json.load(f)]
@@ -1,5 +1,6 @@
+import asyncio
 import io
-from typing import Optional
+import weakref
 
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
@@ -10,13 +11,33 @@ from .domain import AiModelProvider
 
 
 class GoogleProvider(AiModelProvider):
+    name = "google"
 
-    def _build_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+    def __init__(self):
+        super().__init__()
+        self._loop_chat_models: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], BaseChatModel]] = weakref.WeakKeyDictionary()
+
+    # the async grpc client is bound to the event loop that creates it, so models (and their clients) are pooled per event loop
+    def _get_pooled_chat_models(self) -> dict[tuple[str, str], BaseChatModel]:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return super()._get_pooled_chat_models()
+        ret = self._loop_chat_models.get(loop)
+        if ret is None:
+            ret = {}
+            self._loop_chat_models[loop] = ret
+        return ret
+
+    def _build_chat_model(self, model: str) -> BaseChatModel:
         google_model_id = env.google_model_id_mapping.get(model)    
-        return ChatGoogleGenerativeAI(
+        ret = ChatGoogleGenerativeAI(
             google_api_key=env.google_api_key,
-            model=google_model_id,
-            temperature=temperature)
+            model=google_model_id)
+        # async client is lazily created (when an event loop is running), so we create it here to share it among copies built in
+        # the same event loop
+        ret.async_client
+        return ret
 
     def supports_model(self, model: str) -> bool:
         return model in env.google_model_id_mapping
@@ -1,5 +1,5 @@
 import io
-from typing import Callable, Optional, cast
+from typing import Any, Callable, Optional, cast
 
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
@@ -13,14 +13,16 @@ from .domain import AiModelProvider
 
 
 class OpenAIProvider(AiModelProvider):
+    name = "openai"
 
-    def _build_chat_model(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> BaseChatModel:
+    def _build_chat_model(self, model: str) -> BaseChatModel:
         openai_model_id = env.openai_model_id_mapping[model]
         return ReasoningTokenCountingChatOpenAI(
             api_key=env.openai_api_key,
-            model=openai_model_id,
-            temperature=temperature,
-            streaming=streaming)
+            model=openai_model_id)
+
+    def _build_chat_model_settings(self, model: str, temperature: Optional[float], reasoning_effort: Optional[str], streaming: bool) -> dict[str, Any]:
+        return {**build_temperature_settings(env.openai_model_id_mapping[model], temperature), "streaming": streaming}
 
     def supports_model(self, model: str) -> bool:
         return model in env.openai_model_id_mapping
@@ -50,3 +52,9 @@ def get_encoding_model(model_name: str, default: Callable[[], tuple[str, tiktoke
             # we return gpt-4o for o- series since it is supported by existing implementation of get_num_tokens_from_messages
             return "gpt-4o", tiktoken.get_encoding("o200k_base")
         return default()
+
+
+def build_temperature_settings(model_name: str, temperature: Optional[float]) -> dict[str, Any]:
+    # reuse langchain validation which removes temperature for models that don't support it (eg: gpt-5)
+    ret = ChatOpenAI.validate_temperature({"model": model_name, "temperature": temperature})
+    return {"temperature": ret["temperature"]} if "temperature" in ret else {}
@@ -0,0 +1,42 @@
+from typing import Any, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_openai.chat_models.base import BaseChatOpenAI
+
+
+def get_tokenizer_family(llm: BaseChatModel) -> str:
+    # models sharing the same tokenizer produce the same counts, so counts are stored by tokenizer and not by model
+    if isinstance(llm, BaseChatOpenAI):
+        return llm._get_encoding_model()[1].name
+    return type(llm).__name__
+
+
+# token counter compatible with langchain trimming utilities that tokenizes each message only once.
+# Counts are cached by message id (and content, to detect partial copies of messages) so they can be seeded with counts
+# persisted in thread messages and only new or modified messages are actually tokenized.
+class MessageTokenCounter:
+
+    def __init__(self, llm: BaseChatModel):
+        self._llm = llm
+        self.tokenizer_family = get_tokenizer_family(llm)
+        # some implementations add a fixed amount of tokens to every counted list of messages (eg: openai reply priming)
+        self._base_tokens = llm.get_num_tokens_from_messages([])
+        self._counts: dict[str, tuple[Any, int]] = {}
+
+    def seed(self, message: BaseMessage, tokens: int):
+        if message.id:
+            self._counts[message.id] = (message.content, tokens)
+
+    def count_message(self, message: BaseMessage) -> int:
+        cached = self._counts.get(message.id) if message.id else None
+        if cached and (cached[0] is message.content or cached[0] == message.content):
+            return cached[1]
+        ret = self._llm.get_num_tokens_from_messages([message]) - self._base_tokens
+        # we don't override existing entries to avoid replacing the count of a complete message with the one of a partial copy
+        if message.id and not cached:
+            self._counts[message.id] = (message.content, ret)
+        return ret
+
+    def __call__(self, messages: Sequence[BaseMessage]) -> int:
+        return self._base_tokens + sum(self.count_message(m) for m in messages)
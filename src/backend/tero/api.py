@@ -1,10 +1,11 @@
+from contextlib import asynccontextmanager
 import logging
 import os
 
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
 from .agents.api import router as agents_router
@@ -14,10 +15,15 @@ from .ai_models.api import router as ai_models_router
 from .core.env import env
 from .core.api import BASE_PATH
 from .core.domain import CamelCaseModel
+from .core.metrics import METRICS_CONTENT_TYPE, RequestMetricsMiddleware, metrics_registry
+from .core.repos import QueryStatsMiddleware
+from .core.sse import EventStreamCompressionMiddleware
 from .external_agents.api import router as external_agents_router
+from .files.upload import UploadSizeLimitMiddleware
 from .mcp_server import setup_mcp_server
 from .teams.api import router as teams_router
 from .threads.api import router as threads_router
+from .threads.time_saved_estimation import minutes_saved_estimator
 from .tools.api import router as tools_router
 from .usage.api import router as usage_router
 from .users.api import router as users_router
@@ -27,19 +33,32 @@ def _setup_logging():
     class HealthCheckFilter(logging.Filter):
         def filter(self, record):
             if hasattr(record, 'getMessage'):
-                return not 'GET /health' in record.getMessage()
+                message = record.getMessage()
+                return not 'GET /health' in message and not 'GET /metrics' in message
             return True
         
     access_logger = logging.getLogger("uvicorn.access")
     access_logger.addFilter(HealthCheckFilter())
 
 
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    yield
+    await minutes_saved_estimator.drain(env.minutes_saved_shutdown_timeout_seconds)
+
+
 logger = logging.getLogger(__name__)
 _setup_logging()
-app = FastAPI()
+app = FastAPI(lifespan=_lifespan)
+# added first so rejected uploads responses include CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"],
-                   allow_headers=["*"], expose_headers=["Content-Disposition", "Content-Type", "Location"])
+                   allow_headers=["*"], expose_headers=["Content-Disposition", "Content-Type", "Location",
+                                                        "X-DB-Query-Count", "X-DB-Query-Time-Ms", "X-DB-Repeated-Queries"])
 app.add_middleware(GZipMiddleware)
+app.add_middleware(EventStreamCompressionMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(RequestMetricsMiddleware, routes=lambda: app.routes)
 if env.frontend_path:
     app.mount("/assets", StaticFiles(directory=os.path.join(env.frontend_path, "assets")), name="assets")
 
@@ -47,7 +66,7 @@ setup_mcp_server(app)
 
 def _should_serve_frontend(path: str) -> bool:
     api_paths = ["/api", "/assets", "/mcp", "/.well-known/", "/resources/"]
-    return not any(path.startswith(prefix) for prefix in api_paths) and path != "/manifest.json"
+    return not any(path.startswith(prefix) for prefix in api_paths) and path not in ["/manifest.json", "/metrics"]
 
 @app.middleware("http")
 async def frontend_router(request: Request, call_next) -> Response:
@@ -100,6 +119,18 @@ async def health_check():
     return {"status": "healthy"}
 
 
+# metrics are kept by each process, so with several workers each scrape would get the metrics of a random worker
+def metrics_exposed() -> bool:
+    return env.metrics_enabled and env.server_workers == 1
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    if not metrics_exposed():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 for router in [
     ai_models_router,
     agents_router,
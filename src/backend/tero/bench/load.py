@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import json
+import logging
+import time
+from typing import Annotated, Any, AsyncIterator, Callable, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..agents.api import AGENTS_PATH
+from ..ai_models import ai_factory
+from ..ai_models.domain import LlmModel
+from ..ai_models.fake_provider import FakeProvider, FakeResponse, load_fake_responses
+from ..api import app
+from ..core.auth import get_current_user
+from ..core.env import env
+from ..core.metrics import Histogram
+from ..core.repos import db_pool_checkout_duration, get_db, new_db_session
+from ..threads.api import THREAD_MESSAGES_PATH, THREADS_PATH
+from ..threads.time_saved_estimation import minutes_saved_estimator
+from ..users.domain import User
+from ..users.repos import UserRepository
+
+
+logger = logging.getLogger(__name__)
+_USER_HEADER = "X-Bench-User"
+_USERNAME_PREFIX = "bench-user-"
+_USD_LIMIT = 1_000_000_000
+_MINUTES_SAVED_MINUTES = 5
+
+
+# Sends requests directly to the ASGI app (like httpx.ASGITransport) but returns the response as soon as it starts and
+# streams body chunks as the app sends them, which is required to measure streaming latencies.
+class _StreamingASGITransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, asgi_app: Callable):
+        self._app = asgi_app
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = b"".join([chunk async for chunk in request.stream])  # type: ignore
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "headers": [(k.lower(), v) for (k, v) in request.headers.raw],
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query,
+            "server": (request.url.host, request.url.port),
+            "client": ("127.0.0.1", 123),
+            "root_path": "",
+        }
+        started: asyncio.Future[tuple[int, list]] = asyncio.get_running_loop().create_future()
+        chunks: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
+        disconnected = asyncio.Event()
+        request_sent = False
+
+        async def receive() -> dict[str, Any]:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict[str, Any]):
+            if message["type"] == "http.response.start":
+                started.set_result((message["status"], message.get("headers", [])))
+            elif message["type"] == "http.response.body" and message.get("body"):
+                chunks.put_nowait(message["body"])
+
+        async def run():
+            try:
+                await self._app(scope, receive, send)
+            except BaseException as e:
+                if not started.done():
+                    started.set_exception(e)
+                raise
+            finally:
+                chunks.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        status_code, headers = await started
+        return httpx.Response(status_code, headers=headers, stream=_QueueStream(chunks, task, disconnected))
+
+
+class _QueueStream(httpx.AsyncByteStream):
+
+    def __init__(self, chunks: asyncio.Queue[Optional[bytes]], task: asyncio.Task, disconnected: asyncio.Event):
+        self._chunks = chunks
+        self._task = task
+        self._disconnected = disconnected
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while (chunk := await self._chunks.get()) is not None:
+            yield chunk
+
+    async def aclose(self):
+        self._disconnected.set()
+        await self._task
+
+
+@dataclass
+class _MessageResult:
+    error: Optional[str] = None
+    time_to_first_token: Optional[float] = None
+    completion_time: Optional[float] = None
+    chunk_gaps: list[float] = field(default_factory=list)
+
+
+@dataclass
+class _LevelResult:
+    concurrency: int
+    messages: int
+    errors: int
+    error_samples: list[str]
+    duration_seconds: float
+    messages_per_second: float
+    time_to_first_token: dict[str, Optional[float]]
+    inter_chunk: dict[str, Optional[float]]
+    completion: dict[str, Optional[float]]
+    db_pool_wait: dict[str, Optional[float]]
+
+
+def _percentiles(values: list[float]) -> dict[str, Optional[float]]:
+    ordered = sorted(values)
+
+    def percentile(p: int) -> Optional[float]:
+        # nearest rank, which doesn't interpolate values that were never measured
+        return round(ordered[max(0, -(-len(ordered) * p // 100) - 1)] * 1000, 1) if ordered else None
+
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99),
+            "max": round(ordered[-1] * 1000, 1) if ordered else None}
+
+
+# percentiles of observations made since the given bucket counts were taken. Only buckets are kept, so each percentile
+# is the upper bound of the bucket containing it
+def _histogram_percentiles(histogram: Histogram, start_counts: list[int]) -> dict[str, Optional[float]]:
+    counts = [count - start for count, start in zip(histogram.bucket_counts(), start_counts)]
+    total = sum(counts)
+
+    def percentile(p: int) -> Optional[float]:
+        rank = -(-total * p // 100)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return round(bound * 1000, 1)
+        return None
+
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99), "max": percentile(100)}
+
+
+async def _get_bench_user(request: Request, db: Annotated[AsyncSession, Depends(get_db)]) -> User:
+    ret = await UserRepository(db).find_by_id(int(request.headers.get(_USER_HEADER, "0")))
+    if not ret:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return ret
+
+
+async def _prepare_users(count: int) -> list[int]:
+    ret = []
+    async with new_db_session() as db:
+        repo = UserRepository(db)
+        for i in range(count):
+            username = f"{_USERNAME_PREFIX}{i}"
+            user = await repo.find_by_username(username)
+            if not user:
+                user = await repo.create_user(User(username=username, name=f"Bench User {i}", monthly_usd_limit=_USD_LIMIT))
+            ret.append(user.id)
+    return ret
+
+
+async def _prepare_agents(client: httpx.AsyncClient, user_ids: list[int]) -> dict[int, int]:
+    ret = {}
+    for user_id in user_ids:
+        resp = await client.post(AGENTS_PATH, headers={_USER_HEADER: str(user_id)})
+        resp.raise_for_status()
+        ret[user_id] = resp.json()["id"]
+    return ret
+
+
+class _BenchFakeProvider(FakeProvider):
+
+    # avoids console callbacks, like in production environments, which would otherwise dominate measurements
+    def _prepare_chat_model(self, model: Any) -> BaseChatModel:
+        model.callbacks = []
+        return model
+
+
+# single interactions get one number, while batched ones (see BATCH_SYSTEM_PROMPT) require one line per interaction
+def _build_minutes_saved_responses() -> list[FakeResponse]:
+    return [FakeResponse(match="Return ONLY an integer number representing the minutes saved", content=str(_MINUTES_SAVED_MINUTES))] + [
+        FakeResponse(match=f"one per line \\({count} lines in total\\)", content="\n".join([str(_MINUTES_SAVED_MINUTES)] * count))
+        for count in range(2, minutes_saved_estimator.max_batch_size + 1)]
+
+
+async def _register_fake_provider(responses_path: Optional[str]):
+    async with new_db_session() as db:
+        model_ids = list((await db.exec(select(LlmModel.id))).all())
+    responses = load_fake_responses(responses_path or env.fake_model_responses_path) + _build_minutes_saved_responses()
+    # registered first so it serves every model, including the ones used for thread names and minutes saved estimations
+    ai_factory.providers.insert(0, _BenchFakeProvider(model_ids, responses))
+
+
+async def _send_message(client: httpx.AsyncClient, user_id: int, agent_id: int, text: str) -> _MessageResult:
+    ret = _MessageResult()
+    headers = {_USER_HEADER: str(user_id)}
+    try:
+        resp = await client.post(THREADS_PATH, json={"agentId": agent_id}, headers=headers)
+        resp.raise_for_status()
+        thread_id = resp.json()["id"]
+        # thread creation is not part of answering a message, so it's excluded from latencies
+        start = time.perf_counter()
+        async with client.stream("POST", THREAD_MESSAGES_PATH.format(thread_id=thread_id), data={"text": text, "origin": "USER"},
+                                 headers={**headers, "Accept-Encoding": "gzip"}) as resp:
+            if not resp.is_success:
+                await resp.aread()
+                ret.error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+                return ret
+            last_chunk_at: Optional[float] = None
+            event_type: Optional[str] = None
+            has_data = False
+            async for line in resp.aiter_lines():
+                if line.startswith("event:"):
+                    event_type = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    has_data = True
+                elif not line:
+                    now = time.perf_counter()
+                    if event_type == "error":
+                        ret.error = "error event"
+                    elif event_type is None and has_data:
+                        if last_chunk_at is None:
+                            ret.time_to_first_token = now - start
+                        else:
+                            ret.chunk_gaps.append(now - last_chunk_at)
+                        last_chunk_at = now
+                    event_type = None
+                    has_data = False
+        ret.completion_time = time.perf_counter() - start
+    except Exception as e:
+        ret.error = f"{type(e).__name__}: {e}"
+    return ret
+
+
+async def _run_virtual_user(client: httpx.AsyncClient, user_id: int, agent_id: int, messages: int, text: str) -> list[_MessageResult]:
+    return [await _send_message(client, user_id, agent_id, text) for _ in range(messages)]
+
+
+async def _run_level(client: httpx.AsyncClient, concurrency: int, agents: dict[int, int], messages: int, text: str) -> _LevelResult:
+    # time waiting for a connection from the db pool (the first thing to saturate when concurrency grows) is recorded by the pool
+    pool_checkout_counts = db_pool_checkout_duration.bucket_counts()
+    start = time.perf_counter()
+    user_ids = list(agents)[:concurrency]
+    results = [r for user_results in await asyncio.gather(*[_run_virtual_user(client, user_id, agents[user_id], messages, text)
+                                                             for user_id in user_ids]) for r in user_results]
+    duration = time.perf_counter() - start
+    ok = [r for r in results if not r.error]
+    errors = [r.error for r in results if r.error]
+    return _LevelResult(
+        concurrency=concurrency,
+        messages=len(results),
+        errors=len(errors),
+        error_samples=list(dict.fromkeys(errors))[:5],
+        duration_seconds=round(duration, 2),
+        messages_per_second=round(len(ok) / duration, 2),
+        time_to_first_token=_percentiles([r.time_to_first_token for r in ok if r.time_to_first_token is not None]),
+        inter_chunk=_percentiles([gap for r in ok for gap in r.chunk_gaps]),
+        completion=_percentiles([r.completion_time for r in ok if r.completion_time is not None]),
+        db_pool_wait=_histogram_percentiles(db_pool_checkout_duration, pool_checkout_counts))
+
+
+def _print_results(results: list[_LevelResult]):
+    def fmt(stats: dict[str, Optional[float]]) -> str:
+        return "/".join("-" if stats[p] is None else f"{stats[p]:.0f}" for p in ["p50", "p95", "p99"])
+
+    print(f"{'concurrency':>11} {'messages':>8} {'errors':>6} {'msg/s':>7} {'ttft ms':>17} {'inter-chunk ms':>17} "
+          f"{'completion ms':>17} {'db pool wait ms':>17}")
+    for r in results:
+        print(f"{r.concurrency:>11} {r.messages:>8} {r.errors:>6} {r.messages_per_second:>7} {fmt(r.time_to_first_token):>17} "
+              f"{fmt(r.inter_chunk):>17} {fmt(r.completion):>17} {fmt(r.db_pool_wait):>17}")
+        for error in r.error_samples:
+            print(f"{'':>11} error: {error}")
+    print("(latencies shown as p50/p95/p99, db pool wait as the upper bounds of the pool checkout metric buckets)")
+
+
+async def run(concurrency_levels: list[int], messages: int, text: str, real_models: bool, responses_path: Optional[str],
+              output: Optional[str]):
+    if not real_models:
+        await _register_fake_provider(responses_path)
+    app.dependency_overrides[get_current_user] = _get_bench_user
+    try:
+        async with httpx.AsyncClient(transport=_StreamingASGITransport(app), base_url="http://bench", timeout=None) as client:
+            agents = await _prepare_agents(client, await _prepare_users(max(concurrency_levels)))
+            results = []
+            for concurrency in concurrency_levels:
+                logger.info(f"Running {messages} messages per user with {concurrency} concurrent users")
+                results.append(await _run_level(client, concurrency, agents, messages, text))
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+    _print_results(results)
+    if output:
+        with open(output, "w") as f:
+            json.dump([r.__dict__ for r in results], f, indent=2)
+
+
+def _parse_levels(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Load test the threads streaming API, running the ASGI app in process against the configured database")
+    parser.add_argument("--concurrency", type=_parse_levels, default=[1, 5, 10, 25, 50], help="comma separated concurrent users to test (default: 1,5,10,25,50)")
+    parser.add_argument("--messages", type=int, default=5, help="messages sent (each in a new thread) by each user in each concurrency level")
+    parser.add_argument("--text", default="Summarize the main risks of the project and suggest next steps", help="text of messages sent")
+    parser.add_argument("--real-models", action="store_true", help="use configured model providers instead of the offline fake provider (incurs in costs!)")
+    parser.add_argument("--responses", help="JSON file with scripted fake model responses (defaults to FAKE_MODEL_RESPONSES_PATH)")
+    parser.add_argument("--output", help="JSON file to store results")
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.messages, args.text, args.real_models, args.responses, args.output))
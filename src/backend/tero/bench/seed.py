@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import bisect
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import itertools
+import logging
+import random
+import time
+from typing import Any, Iterable, Optional
+
+from sqlmodel import SQLModel, col, func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..agents.domain import Agent, LlmTemperature, ReasoningEffort, UserAgent, NAME_MAX_LENGTH
+from ..ai_models.domain import LlmModel
+from ..core.env import env
+from ..core.repos import new_db_session
+from ..external_agents.domain import ExternalAgent, ExternalAgentTimeSaving
+from ..files.domain import File, FileProcessor, FileStatus
+from ..teams.domain import GLOBAL_TEAM_ID, Role, Team, TeamRole, TeamRoleStatus
+from ..threads.domain import MAX_THREAD_NAME_LENGTH, Thread, ThreadMessage, ThreadMessageFile, ThreadMessageOrigin
+from ..usage.domain import Usage, UsageType
+from ..users.domain import User
+
+
+logger = logging.getLogger(__name__)
+USERNAME_PREFIX = "seed.user"
+USERNAME_DOMAIN = "@example.com"
+# amounts generated with scale 1, most of them grow linearly with the scale factor
+USERS_PER_SCALE = 1000
+USERS_PER_TEAM = 25
+AGENTS_PER_USER = 3
+THREADS_PER_USER = 30
+MEAN_THREAD_TURNS = 5
+TIME_SAVINGS_PER_USER = 4
+_THREADS_BATCH_SIZE = 2000
+_WORDS = ["report", "sales", "budget", "customer", "project", "release", "invoice", "contract", "meeting", "summary",
+          "roadmap", "incident", "deploy", "database", "query", "design", "review", "feature", "bug", "test", "plan",
+          "email", "draft", "policy", "hiring", "candidate", "onboarding", "training", "security", "audit", "metrics",
+          "dashboard", "quarter", "forecast", "pricing", "proposal", "translation", "spanish", "english", "code",
+          "python", "java", "frontend", "backend", "api", "cloud", "cost", "vendor", "support", "ticket", "sprint",
+          "story", "epic", "retro", "feedback", "survey", "campaign", "marketing", "brand", "legal", "compliance",
+          "the", "a", "of", "to", "and", "for", "with", "in", "on", "about", "please", "can", "you", "help", "me",
+          "write", "explain", "summarize", "compare", "list", "create", "update", "check", "find", "improve"]
+_FILE_TYPES = [("pdf", "application/pdf"), ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+               ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"), ("txt", "text/plain"),
+               ("csv", "text/csv"), ("png", "image/png")]
+
+
+@dataclass
+class _SeedUser:
+    id: int
+    # relative amount of threads the user creates, which follows a heavy tailed distribution like in real tenants
+    activity: float
+    accepted_team_ids: list[int] = field(default_factory=list)
+    agent_ids: list[int] = field(default_factory=list)
+
+
+@dataclass
+class _SeedAgent:
+    id: int
+    user_id: int
+    model_id: str
+    shared: bool
+
+
+# picks items with probabilities following Zipf's law (first items are way more popular than last ones), which is how
+# agents, teams and models popularity is usually distributed
+class _ZipfChooser:
+
+    def __init__(self, items: list[Any], exponent: float = 1.1):
+        self._items = items
+        self._cum_weights = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(len(items))))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def choose(self, rnd: random.Random) -> Any:
+        if not self._items:
+            raise ValueError("Can't choose from an empty list of items")
+        return self._items[bisect.bisect(self._cum_weights, rnd.random() * self._cum_weights[-1])]
+
+
+# Generates a synthetic tenant with a realistic distribution of users, teams, agents, threads (with branched messages),
+# usage, time savings and files. Rows are inserted with COPY and ids assigned upfront, since the ORM would take hours
+# to insert the millions of rows generated by big scale factors.
+class _Seeder:
+
+    def __init__(self, db: AsyncSession, scale: float, seed: int, days: int):
+        self._db = db
+        self._rnd = random.Random(seed)
+        self._scale = scale
+        # timestamps are relative to the start of the current day so dashboards for recent periods show data
+        self._end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self._start = self._end - timedelta(days=days)
+        self._next_ids: dict[type[SQLModel], int] = {}
+        self._users: list[_SeedUser] = []
+        self._agents: dict[int, _SeedAgent] = {}
+        self._models: dict[str, LlmModel] = {}
+        self.counts: dict[str, int] = {}
+
+    async def run(self):
+        await self._check_not_seeded()
+        self._models = {m.id: m for m in (await self._db.exec(select(LlmModel).order_by(col(LlmModel.id)))).all()}
+        if not self._models:
+            raise ValueError("No LLM models found. Run database migrations before seeding")
+        for model in [User, Team, Agent, Thread, ThreadMessage, Usage, ExternalAgent, ExternalAgentTimeSaving, File]:
+            self._next_ids[model] = (await self._db.exec(select(func.coalesce(func.max(model.id), 0)))).one() + 1  # type: ignore
+        await self._seed_users()
+        await self._seed_teams()
+        await self._seed_agents()
+        await self._seed_user_agents()
+        await self._seed_threads()
+        await self._seed_time_savings()
+        await self._reset_sequences()
+        await self._db.commit()
+        await self._analyze()
+
+    async def _check_not_seeded(self):
+        seeded = (await self._db.exec(select(User.id).where(col(User.username).startswith(USERNAME_PREFIX)).limit(1))).first()
+        if seeded:
+            raise ValueError("The database already contains seeded data. Use an empty database to avoid mixing different seeds")
+
+    def _new_ids(self, model: type[SQLModel], count: int) -> range:
+        start = self._next_ids[model]
+        self._next_ids[model] = start + count
+        return range(start, start + count)
+
+    def _count(self, model: type[SQLModel], count: int):
+        table = model.__tablename__  # type: ignore
+        self.counts[table] = self.counts.get(table, 0) + count
+
+    async def _copy(self, model: type[SQLModel], columns: list[str], rows: Iterable[tuple]):
+        table = model.__tablename__  # type: ignore
+        conn = await self._db.connection()
+        raw_conn = (await conn.get_raw_connection()).driver_connection
+        count = 0
+        async with raw_conn.cursor() as cursor:  # type: ignore
+            async with cursor.copy(f"COPY \"{table}\" ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    await copy.write_row(row)
+                    count += 1
+        self._count(model, count)
+
+    def _words(self, count: int) -> str:
+        return " ".join(self._rnd.choice(_WORDS) for _ in range(count))
+
+    def _title(self, max_length: int) -> str:
+        return self._words(self._rnd.randint(2, 5)).capitalize()[:max_length]
+
+    def _timestamp(self, start: Optional[datetime] = None) -> datetime:
+        start = start or self._start
+        return start + (self._end - start) * self._rnd.random()
+
+    async def _seed_users(self):
+        count = max(10, round(USERS_PER_SCALE * self._scale))
+        rows = []
+        for user_id in self._new_ids(User, count):
+            created_at = self._timestamp()
+            deleted_at = self._timestamp(created_at) if self._rnd.random() < 0.03 else None
+            rows.append((user_id, f"{USERNAME_PREFIX}{user_id}{USERNAME_DOMAIN}", f"Seed User {user_id}",
+                         self._rnd.choice([10, 20, 50, 100]), 160, created_at, deleted_at))
+            self._users.append(_SeedUser(user_id, self._rnd.paretovariate(1.5)))
+        await self._copy(User, ["id", "username", "name", "monthly_usd_limit", "monthly_hours", "created_at", "deleted_at"], rows)
+
+    async def _seed_teams(self):
+        count = max(2, len(self._users) // USERS_PER_TEAM)
+        team_ids = list(self._new_ids(Team, count))
+        await self._copy(Team, ["id", "name"], [(team_id, f"{self._title(80)} team {team_id}") for team_id in team_ids])
+        teams = _ZipfChooser(team_ids, 0.8)
+        members: dict[int, set[int]] = {team_id: set() for team_id in team_ids}
+        rows = []
+        for user in self._users:
+            # some users don't belong to any team and others to many of them
+            for team_id in {teams.choose(self._rnd) for _ in range(self._rnd.choice([0, 1, 1, 1, 2, 2, 3]))}:
+                status = self._rnd.choices([TeamRoleStatus.ACCEPTED, TeamRoleStatus.PENDING, TeamRoleStatus.REJECTED], [90, 7, 3])[0]
+                role = Role.TEAM_OWNER if not members[team_id] or self._rnd.random() < 0.05 else Role.TEAM_MEMBER
+                members[team_id].add(user.id)
+                if status == TeamRoleStatus.ACCEPTED:
+                    user.accepted_team_ids.append(team_id)
+                rows.append((team_id, user.id, role.name, status.name))
+        await self._copy(TeamRole, ["team_id", "user_id", "role", "status"], rows)
+
+    async def _seed_agents(self):
+        creators = _ZipfChooser(sorted(self._users, key=lambda u: -u.activity), 0.7)
+        models = _ZipfChooser(list(self._models))
+        rows = []
+        for agent_id in self._new_ids(Agent, len(self._users) * AGENTS_PER_USER):
+            user: _SeedUser = creators.choose(self._rnd)
+            # most agents are private, some are shared in a team and a few with the whole organization
+            team_id = None
+            draw = self._rnd.random()
+            if draw < 0.05:
+                team_id = GLOBAL_TEAM_ID
+            elif draw < 0.4 and user.accepted_team_ids:
+                team_id = self._rnd.choice(user.accepted_team_ids)
+            agent = _SeedAgent(agent_id, user.id, models.choose(self._rnd), team_id is not None)
+            self._agents[agent_id] = agent
+            user.agent_ids.append(agent_id)
+            rows.append((agent_id, f"{self._title(NAME_MAX_LENGTH - 8)} {agent_id}", self._title(100), user.id,
+                         self._timestamp(), team_id, agent.model_id, self._words(self._rnd.randint(30, 400)),
+                         self._rnd.choice(list(LlmTemperature)).name, self._rnd.choice(list(ReasoningEffort)).name))
+        await self._copy(Agent, ["id", "name", "description", "user_id", "last_update", "team_id", "model_id", "system_prompt",
+                                 "temperature", "reasoning_effort"], rows)
+        await self._seed_agent_configuration_usage()
+
+    async def _seed_agent_configuration_usage(self):
+        # agents generate usage without messages when their fields are generated or their tools configured
+        rows = []
+        for agent in self._agents.values():
+            for _ in range(self._rnd.randint(0, 3)):
+                model = self._models[agent.model_id]
+                quantity = self._rnd.randint(200, 3000)
+                rows.append((agent.user_id, agent.id, None, model.id, self._timestamp(), quantity,
+                             quantity / 1000 * model.prompt_1k_token_usd, UsageType.PROMPT_TOKENS.name))
+        await self._copy_usage(rows)
+
+    async def _copy_usage(self, rows: list[tuple]):
+        await self._copy(Usage, ["id", "user_id", "agent_id", "message_id", "model_id", "timestamp", "quantity", "usd_cost", "type"],
+                         [(usage_id, *row) for usage_id, row in zip(self._new_ids(Usage, len(rows)), rows)])
+
+    async def _seed_user_agents(self):
+        popular = _ZipfChooser([a.id for a in self._agents.values() if a.shared])
+        rows = []
+        for user in self._users:
+            agent_ids = set(user.agent_ids)
+            # users add a few shared agents, most of them the popular ones (small scales may not have any shared agent)
+            if popular:
+                agent_ids.update(popular.choose(self._rnd) for _ in range(self._rnd.randint(1, 8)))
+            user.agent_ids = sorted(agent_ids)
+            rows.extend((user.id, agent_id, self._timestamp()) for agent_id in user.agent_ids)
+        await self._copy(UserAgent, ["user_id", "agent_id", "creation"], rows)
+
+    async def _seed_threads(self):
+        total_activity = sum(u.activity for u in self._users)
+        threads = []
+        for user in self._users:
+            # threads are always started with an agent, so users with no agents have no threads
+            if not user.agent_ids:
+                continue
+            count = round(len(self._users) * THREADS_PER_USER * user.activity / total_activity)
+            agents = _ZipfChooser(user.agent_ids)
+            threads.extend((user, agents.choose(self._rnd)) for _ in range(count))
+        for batch_start in range(0, len(threads), _THREADS_BATCH_SIZE):
+            await self._seed_threads_batch(threads[batch_start:batch_start + _THREADS_BATCH_SIZE])
+            await self._db.commit()
+            logger.info(f"Seeded {min(batch_start + _THREADS_BATCH_SIZE, len(threads))} of {len(threads)} threads")
+
+    async def _seed_threads_batch(self, threads: list[tuple[_SeedUser, int]]):
+        thread_rows, message_rows, file_rows, message_file_rows, usage_rows = [], [], [], [], []
+        for (user, agent_id), thread_id in zip(threads, self._new_ids(Thread, len(threads))):
+            agent = self._agents[agent_id]
+            creation = self._timestamp()
+            is_test_case = agent.user_id == user.id and self._rnd.random() < 0.05
+            name = None if self._rnd.random() < 0.05 else self._title(MAX_THREAD_NAME_LENGTH)
+            thread_rows.append((thread_id, name, user.id, agent_id, self._rnd.random() < 0.05, creation, is_test_case))
+            # some threads are created and never used, like the ones reused as empty threads when starting a new chat
+            if self._rnd.random() < 0.05:
+                continue
+            messages = self._build_thread_messages(thread_id, creation, round(self._rnd.expovariate(1 / MEAN_THREAD_TURNS)) + 1)
+            for message_id, origin, parent_id, timestamp, turn in messages:
+                if origin == ThreadMessageOrigin.USER:
+                    message_rows.append((message_id, thread_id, origin.name, self._words(self._rnd.randint(5, 60)), timestamp,
+                                         False, parent_id, None, None, None))
+                    if self._rnd.random() < 0.05:
+                        file_id = self._new_ids(File, 1)[0]
+                        file_rows.append(self._build_file(file_id, user.id, timestamp))
+                        message_file_rows.append((message_id, file_id))
+                else:
+                    has_feedback = self._rnd.random() < 0.05
+                    message_rows.append((message_id, thread_id, origin.name, self._words(self._rnd.randint(20, 400)), timestamp,
+                                         self._rnd.random() < 0.01, parent_id,
+                                         self._rnd.randint(1, 60) if self._rnd.random() < 0.3 else None,
+                                         self._words(10) if has_feedback and self._rnd.random() < 0.5 else None,
+                                         self._rnd.random() < 0.7 if has_feedback else None))
+                    usage_rows.extend(self._build_message_usage(user.id, agent, message_id, timestamp, turn))
+        await self._copy(Thread, ["id", "name", "user_id", "agent_id", "deleted", "creation", "is_test_case"], thread_rows)
+        await self._copy(File, ["id", "name", "content_type", "user_id", "timestamp", "content", "status", "processed_content",
+                                "file_processor"], file_rows)
+        await self._copy(ThreadMessage, ["id", "thread_id", "origin", "text", "timestamp", "stopped", "parent_id", "minutes_saved",
+                                         "feedback_text", "has_positive_feedback"], message_rows)
+        await self._copy(ThreadMessageFile, ["thread_message_id", "file_id"], message_file_rows)
+        await self._copy_usage(usage_rows)
+
+    # generates (id, origin, parent_id, timestamp, turn) of a conversation where users sometimes edit their messages or
+    # regenerate agent responses, which creates branches of messages with the same parent
+    def _build_thread_messages(self, thread_id: int, creation: datetime, turns: int) -> list[tuple[int, ThreadMessageOrigin, Optional[int], datetime, int]]:
+        ret = []
+        parent_id: Optional[int] = None
+        timestamp = creation
+        for turn in range(turns):
+            timestamp += timedelta(seconds=self._rnd.randint(10, 900))
+            user_message_id = self._new_ids(ThreadMessage, 1)[0]
+            ret.append((user_message_id, ThreadMessageOrigin.USER, parent_id, timestamp, turn))
+            if turn > 0 and self._rnd.random() < 0.05:
+                # edited message: a sibling of the previous user message with its own response
+                edited_id = self._new_ids(ThreadMessage, 1)[0]
+                timestamp += timedelta(seconds=self._rnd.randint(10, 300))
+                ret.append((edited_id, ThreadMessageOrigin.USER, parent_id, timestamp, turn))
+                user_message_id = edited_id
+            responses = 2 if self._rnd.random() < 0.08 else 1
+            for _ in range(responses):
+                timestamp += timedelta(seconds=self._rnd.randint(2, 60))
+                parent_id = self._new_ids(ThreadMessage, 1)[0]
+                ret.append((parent_id, ThreadMessageOrigin.AGENT, user_message_id, timestamp, turn))
+        return ret
+
+    def _build_message_usage(self, user_id: int, agent: _SeedAgent, message_id: int, timestamp: datetime, turn: int) -> list[tuple]:
+        model = self._models[agent.model_id]
+        # prompts grow with the conversation history
+        prompt_tokens = self._rnd.randint(300, 2000) + turn * self._rnd.randint(200, 800)
+        completion_tokens = self._rnd.randint(30, 1500)
+        ret = [(user_id, agent.id, message_id, model.id, timestamp, prompt_tokens, prompt_tokens / 1000 * model.prompt_1k_token_usd,
+                UsageType.PROMPT_TOKENS.name),
+               (user_id, agent.id, message_id, model.id, timestamp, completion_tokens,
+                completion_tokens / 1000 * model.completion_1k_token_usd, UsageType.COMPLETION_TOKENS.name)]
+        draw = self._rnd.random()
+        if draw < 0.05:
+            ret.append((user_id, agent.id, message_id, None, timestamp, 1, env.web_tool_google_cost_per_1k_searches_usd / 1000,
+                        UsageType.WEB_SEARCH.name))
+        elif draw < 0.07:
+            pages = self._rnd.randint(1, 40)
+            ret.append((user_id, agent.id, message_id, None, timestamp, pages, pages / 1000 * env.azure_doc_intelligence_cost_per_1k_pages_usd,
+                        UsageType.PDF_PARSING.name))
+        elif draw < 0.1:
+            tokens = self._rnd.randint(500, 20000)
+            ret.append((user_id, agent.id, message_id, env.embedding_model, timestamp, tokens, tokens / 1000 * env.embedding_cost_per_1k_tokens,
+                        UsageType.EMBEDDING_TOKENS.name))
+        return ret
+
+    def _build_file(self, file_id: int, user_id: int, timestamp: datetime) -> tuple:
+        extension, content_type = self._rnd.choice(_FILE_TYPES)
+        content = self._words(self._rnd.randint(50, 1500))
+        status = self._rnd.choices([FileStatus.PROCESSED, FileStatus.ERROR, FileStatus.PENDING], [95, 3, 2])[0]
+        return (file_id, f"{self._title(150).replace(' ', '-')}.{extension}", content_type, user_id, timestamp, content.encode(),
+                status.name, content if status == FileStatus.PROCESSED else None,
+                self._rnd.choice([FileProcessor.BASIC, FileProcessor.BASIC, FileProcessor.ENHANCED]).name)
+
+    async def _seed_time_savings(self):
+        external_agent_ids = list((await self._db.exec(select(ExternalAgent.id).order_by(col(ExternalAgent.id)))).all())
+        if not external_agent_ids:
+            external_agent_ids = list(self._new_ids(ExternalAgent, 3))
+            await self._copy(ExternalAgent, ["id", "name"], [(agent_id, f"External agent {agent_id}") for agent_id in external_agent_ids])
+        external_agents = _ZipfChooser(external_agent_ids)
+        rows = []
+        for user in self._users:
+            count = round(self._rnd.expovariate(1 / TIME_SAVINGS_PER_USER))
+            rows.extend((user.id, external_agents.choose(self._rnd), self._rnd.randint(5, 240), self._timestamp()) for _ in range(count))
+        await self._copy(ExternalAgentTimeSaving, ["id", "user_id", "external_agent_id", "minutes_saved", "date"],
+                         [(saving_id, *row) for saving_id, row in zip(self._new_ids(ExternalAgentTimeSaving, len(rows)), rows)])
+
+    async def _reset_sequences(self):
+        for model, next_id in self._next_ids.items():
+            table = model.__tablename__  # type: ignore
+            await self._db.exec(text(f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), {next_id}, false)"))  # type: ignore
+
+    async def _analyze(self):
+        # planner statistics have to be updated for query plans to reflect the new data
+        for table in self.counts:
+            await self._db.exec(text(f"ANALYZE \"{table}\""))  # type: ignore
+        await self._db.commit()
+
+
+async def seed_data(db: AsyncSession, scale: float = 1, seed: int = 42, days: int = 180) -> dict[str, int]:
+    seeder = _Seeder(db, scale, seed, days)
+    await seeder.run()
+    return seeder.counts
+
+
+async def main(scale: float, seed: int, days: int):
+    start = time.perf_counter()
+    async with new_db_session() as db:
+        counts = await seed_data(db, scale, seed, days)
+    for table, count in counts.items():
+        print(f"{table:>28} {count:>12,}")
+    print(f"Seeded in {time.perf_counter() - start:.1f} seconds")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Fill the configured database with a synthetic large tenant for scale and query plan testing")
+    parser.add_argument("--scale", type=float, default=1, help=f"scale factor, where 1 generates {USERS_PER_SCALE} users and around "
+                        f"{USERS_PER_SCALE * THREADS_PER_USER} threads, 350K messages and 400K usage rows (default: 1)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed, the same seed and scale always generate the same distribution of data (default: 42)")
+    parser.add_argument("--days", type=int, default=180, help="days of history to generate, ending today (default: 180)")
+    args = parser.parse_args()
+    asyncio.run(main(args.scale, args.seed, args.days))
@@ -1,8 +1,9 @@
+import asyncio
 import datetime
 import json
 import logging
 import traceback
-from typing import Optional, Annotated, Any, AsyncGenerator
+from typing import Optional, Annotated, Any
 
 import aiohttp
 from fastapi import Depends, HTTPException, status
@@ -15,7 +16,7 @@ from starlette.requests import Request
 from .env import env
 from .repos import get_db
 from ..users.domain import User
-from ..users.repos import UserRepository
+from ..users.repos import UserRepository, user_cache
 
 
 class BearerOpenIdConnect(OpenIdConnect):
@@ -44,38 +45,45 @@ else:
     auth_scheme = lambda: None
 
 
+# keys are shared by all requests in the process and refreshed by only one of them at a time, so requests don't need to
+# fetch openid configuration and keys before doing any actual work
 class OpenIdConfig:
 
-    def __init__(self, url: str, http_cli: aiohttp.ClientSession):
+    def __init__(self, url: str):
         self.url = url
-        self._http_cli = http_cli
-        self._last_update = None
+        self._http_cli: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+        self._last_update: Optional[datetime.datetime] = None
         self._keys = None
 
     async def get_updated_keys(self, period: datetime.timedelta) -> Any:
-        if self._last_update is None or datetime.datetime.now(datetime.UTC) - self._last_update > period:
-            await self._update_keys()
+        if self._requires_update(period):
+            async with self._lock:
+                # check again since keys may have been updated by other request while waiting for the lock
+                if self._requires_update(period):
+                    await self._update_keys()
         return self._keys
 
+    def _requires_update(self, period: datetime.timedelta) -> bool:
+        return self._last_update is None or datetime.datetime.now(datetime.UTC) - self._last_update > period
+
     async def _update_keys(self):
+        if self._http_cli is None or self._http_cli.closed:
+            self._http_cli = aiohttp.ClientSession()
         async with self._http_cli.get(self.url) as config_resp:
             config_resp.raise_for_status()
             jwks_uri = (await config_resp.json())['jwks_uri']
         async with self._http_cli.get(jwks_uri) as ret_resp:
             ret_resp.raise_for_status()
             self._keys = await ret_resp.json()
-        self.keys_last_update = datetime.datetime.now(datetime.UTC)
+        self._last_update = datetime.datetime.now(datetime.UTC)
 
 
-async def get_http_cli() -> AsyncGenerator[aiohttp.ClientSession, None]:
-    async with aiohttp.ClientSession() as cli:
-        yield cli
+_openid_config = OpenIdConfig(config_url) if config_url else None
 
 
-def _get_openid_config(http_cli: Annotated[aiohttp.ClientSession, Depends(get_http_cli)]) -> Optional[OpenIdConfig]:
-    if not config_url:
-        return None
-    return OpenIdConfig(config_url, http_cli)
+def _get_openid_config() -> Optional[OpenIdConfig]:
+    return _openid_config
 
 
 async def _decode_token(token: str, openid_config: Annotated[OpenIdConfig, Depends(_get_openid_config)]) -> dict:
@@ -105,6 +113,9 @@ async def get_current_user(token: Annotated[Optional[str], Depends(auth_scheme)]
         if not token or not open_id_config:
             logger.warning("No token or open_id_config could be found")
             raise _build_auth_exception()
+        cached = user_cache.get(token)
+        if cached:
+            return await UserRepository(db).attach_cached(cached)
         payload = await _decode_token(token, open_id_config)
         username = payload.get("email")
         if username is None:
@@ -125,6 +136,7 @@ async def get_current_user(token: Annotated[Optional[str], Depends(auth_scheme)]
         elif not ret.name and name:
             ret.name = name
             ret = await user_repo.update_user(ret)
+        user_cache.put(token, ret, payload.get("exp"))
         return ret
     except JWTError as e:
         traceback.print_exception(e)
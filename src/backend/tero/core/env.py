@@ -1,5 +1,5 @@
 import os
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 import re
 
@@ -24,6 +24,7 @@ class Settings(BaseSettings):
     openid_client_id : str
     openid_scope : str
     allowed_users : list[str] = []
+    auth_user_cache_ttl_seconds : int = 30
     contact_email : str
     azure_app_insights_connection : Optional[str] = None
     azure_endpoints : list[str]
@@ -33,6 +34,7 @@ class Settings(BaseSettings):
     azure_doc_intelligence_endpoint : Optional[str] = None
     azure_doc_intelligence_key : Optional[SecretStr] = None
     azure_doc_intelligence_cost_per_1k_pages_usd : float
+    azure_doc_intelligence_max_concurrency : int = 4
     temperatures: dict[str, float]
     monthly_usd_limit_default : int
     internal_generator_model : str
@@ -68,6 +70,29 @@ class Settings(BaseSettings):
     web_tool_google_cost_per_1k_searches_usd : float
     browser_tool_playwright_mcp_url : str
     browser_tool_playwright_output_dir : str
+    server_workers : int = 1
+    stream_registry : Literal['memory', 'postgres'] = 'memory'
+    sse_coalesce_window_ms : int = 50
+    sse_coalesce_max_chars : int = 2048
+    minutes_saved_shutdown_timeout_seconds : int = 20
+    sse_compression : bool = True
+    agent_graph_cache_size : int = 128
+    mcp_session_idle_ttl_seconds : int = 300
+    mcp_session_health_check_seconds : int = 60
+    mcp_session_max_concurrency : int = 4
+    file_extraction_workers : int = 2
+    upload_max_size_mb : int = 100
+    db_slow_query_ms : int = 500
+    db_repeated_query_threshold : int = 10
+    db_query_stats_headers : bool = False
+    metrics_enabled : bool = False
+    fake_model_ids : list[str] = []
+    fake_model_responses_path : Optional[str] = None
+    fake_model_ttft_ms : int = 500
+    fake_model_tokens_per_second : float = 50
+    fake_model_response_tokens : int = 100
+    fake_model_error_rate : float = 0
+    fake_model_embedding_size : int = 1536
     
     def is_local_env(self) -> bool:
         found = re.search('@([^/]+)(?:\\d+)?/', self.db_url)
@@ -96,7 +121,7 @@ class Settings(BaseSettings):
     def decode_temperatures(cls, v: str) -> dict[str, float]:
         return {k: float(v) for k, v in (pair.split(':', 1) for pair in v.split(','))} if v else {}
     
-    @field_validator('allowed_users', 'azure_endpoints', 'azure_api_keys', 'agent_basic_models', mode='before')
+    @field_validator('allowed_users', 'azure_endpoints', 'azure_api_keys', 'agent_basic_models', 'fake_model_ids', mode='before')
     @classmethod
     def decode_list(cls, v: str) -> list[str]:
         return v.split(',') if v else []
@@ -0,0 +1,201 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# buckets (in seconds) suitable for request and LLM latencies, which go from milliseconds to minutes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LabelValues = Tuple[str, ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f"{n}=\"{_escape_label_value(v)}\"" for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Metrics are kept in memory by each process and exposed in Prometheus text format. Since scrapes would get the metrics of
+# the worker handling them, metrics are only exposed when running a single worker.
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        (registry or metrics_registry).register(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f"Metric {self.name} requires labels {self.label_names}, but got {list(labels.keys())}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, value in self._samples():
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}"
+
+    def _samples(self) -> Iterable[Tuple[LabelValues, float]]:
+        return []
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None):
+        super().__init__(name, description, label_names, registry)
+        # metrics without labels are exposed from the start, so they are available before anything is observed
+        self._values: Dict[LabelValues, float] = {} if label_names else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterable[Tuple[LabelValues, float]]:
+        return list(self._values.items())
+
+
+# gauges can be set when values change or provide a function to get the value when metrics are collected
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None,
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, label_names, registry)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: str):
+        self._values[self._label_values(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> Iterable[Tuple[LabelValues, float]]:
+        if self._function:
+            return [((), self._function())]
+        return list(self._values.items())
+
+
+class _HistogramValues:
+
+    def __init__(self, bucket_count: int):
+        self.buckets = [0] * bucket_count
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None,
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, description, label_names, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[LabelValues, _HistogramValues] = {} if label_names else {(): _HistogramValues(len(self.buckets))}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        values = self._values.get(key)
+        if values is None:
+            values = _HistogramValues(len(self.buckets))
+            self._values[key] = values
+        values.sum += value
+        values.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                values.buckets[i] += 1
+                break
+
+    # observations in each bucket (not cumulative, including the +Inf one), eg: to compare counts before and after some work
+    def bucket_counts(self, **labels: str) -> list[int]:
+        values = self._values.get(self._label_values(labels))
+        return list(values.buckets) if values else [0] * len(self.buckets)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.type}"
+        label_names = self.label_names + ("le",)
+        for key, values in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values.buckets):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(label_names, key + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(values.sum)}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {values.count}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics.values() for line in m.render()) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+http_request_duration = Histogram("tero_http_request_duration_seconds", "Time to handle HTTP requests, until the response is completely sent",
+                                  ["method", "route", "status"])
+UNMATCHED_ROUTE = "unmatched"
+
+
+# Observes the duration of requests by route template (and not by path) to avoid a time series for each entity id.
+# Routes are solved by the endpoint that handled the request, which the router sets in the request scope.
+class RequestMetricsMiddleware:
+
+    def __init__(self, app: ASGIApp, routes: Callable[[], List]):
+        self._app = app
+        self._routes = routes
+        self._route_paths: Optional[Dict[Callable, str]] = None
+
+    def _find_route_path(self, scope: Scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {}
+            for route in self._routes():
+                endpoint = getattr(route, "endpoint", None)
+                if endpoint and endpoint not in self._route_paths:
+                    self._route_paths[endpoint] = route.path
+        endpoint = scope.get("endpoint")
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE) if endpoint else UNMATCHED_ROUTE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self._app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(time.perf_counter() - start, method=scope["method"], route=self._find_route_path(scope),
+                                          status=str(status))
@@ -1,24 +1,206 @@
-from typing import AsyncGenerator, Any, Optional, cast
+import asyncio
+from contextlib import asynccontextmanager, contextmanager, AbstractAsyncContextManager
+from contextvars import Context, ContextVar, copy_context
+from dataclasses import dataclass, field
+import logging
+import re
+import time
+from typing import AsyncGenerator, Any, Callable, Coroutine, Dict, Generator, Optional, cast
 
 from cryptography.fernet import Fernet
-from sqlalchemy import Dialect
+from sqlalchemy import Dialect, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import QueryableAttribute
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel import Column, Field, String, TypeDecorator
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.sql.expression import SelectOfScalar
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from .env import env
+from .metrics import Counter, Gauge, Histogram
 
 
-engine = create_async_engine(env.db_url)
+logger = logging.getLogger(__name__)
+db_pool_checkout_duration = Histogram("tero_db_pool_checkout_seconds", "Time to get a connection from the db pool, including "
+                                      "waiting for a free connection or opening a new one",
+                                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+db_pool_checkout_timeouts = Counter("tero_db_pool_checkout_timeouts_total", "Times getting a connection from the db pool timed out")
 
 
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
+# sqlalchemy pool events are only triggered once a connection is obtained, so time waiting for a connection is measured here
+class _MeteredPool(AsyncAdaptedQueuePool):
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_checkout_timeouts.inc()
+            raise
+        finally:
+            db_pool_checkout_duration.observe(time.perf_counter() - start)
+
+
+engine = create_async_engine(env.db_url, poolclass=_MeteredPool)
+Gauge("tero_db_pool_size", "Connections kept open by the db pool", function=lambda: cast(_MeteredPool, engine.sync_engine.pool).size())
+Gauge("tero_db_pool_checked_out", "Connections of the db pool currently in use",
+      function=lambda: cast(_MeteredPool, engine.sync_engine.pool).checkedout())
+Gauge("tero_db_pool_overflow", "Connections opened beyond the db pool size",
+      function=lambda: max(cast(_MeteredPool, engine.sync_engine.pool).overflow(), 0))
+DbSessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+
+@asynccontextmanager
+async def new_db_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
 
 
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with new_db_session() as session:
+        yield session
+
+
+# use this dependency in long running operations (like streamed responses) to open short lived sessions for each unit of work
+# instead of keeping a connection checked out from the pool while waiting for LLMs or tools
+def get_db_factory() -> DbSessionFactory:
+    return new_db_session
+
+
+@dataclass
+class StatementStats:
+    count: int = 0
+    time_ms: float = 0
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    time_ms: float = 0
+    # stats are kept by statement text (which is the same for all executions of a query, and cheap to use as key), and
+    # only grouped by fingerprint when needed
+    statements: Dict[str, StatementStats] = field(default_factory=dict)
+    parent: Optional["QueryStats"] = None
+
+    def add(self, statement: str, time_ms: float):
+        stats = self
+        while stats:
+            stats.count += 1
+            stats.time_ms += time_ms
+            statement_stats = stats.statements.setdefault(statement, StatementStats())
+            statement_stats.count += 1
+            statement_stats.time_ms += time_ms
+            stats = stats.parent
+
+    def fingerprints(self) -> Dict[str, StatementStats]:
+        ret: Dict[str, StatementStats] = {}
+        for statement, stats in self.statements.items():
+            fingerprint_stats = ret.setdefault(fingerprint(statement), StatementStats())
+            fingerprint_stats.count += stats.count
+            fingerprint_stats.time_ms += stats.time_ms
+        return ret
+
+    # statements executed many times in a request usually are queries run in a loop (N+1 queries) which can be replaced
+    # by a single query
+    def find_repeated(self, threshold: int = env.db_repeated_query_threshold) -> Dict[str, StatementStats]:
+        return {f: s for f, s in self.fingerprints().items() if s.count >= threshold}
+
+    def summary(self) -> str:
+        return "\n".join(f"{s.count} times ({s.time_ms:.1f}ms): {f}"
+                         for f, s in sorted(self.fingerprints().items(), key=lambda i: i[1].count, reverse=True))
+
+
+_PARAMS_LIST_REGEX = re.compile(r"\(\s*%\(\w+\)s(?:::\w+)?(?:\s*,\s*%\(\w+\)s(?:::\w+)?)*\s*\)")
+_PARAM_REGEX = re.compile(r"%\(\w+\)s(?:::\w+)?|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES_REGEX = re.compile(r"\s+")
+
+
+# statements with the same structure and different parameters (or different amount of values in IN clauses) have the same fingerprint
+def fingerprint(statement: str) -> str:
+    ret = _PARAMS_LIST_REGEX.sub("(?)", statement)
+    ret = _PARAM_REGEX.sub("?", ret)
+    return _SPACES_REGEX.sub(" ", ret).strip()
+
+
+_current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+# collects stats of queries run in the current context (and the tasks it starts) until exiting. Trackers can be nested,
+# and queries are added to all of them
+@contextmanager
+def track_queries() -> Generator[QueryStats, None, None]:
+    ret = QueryStats(parent=_current_query_stats.get())
+    token = _current_query_stats.set(ret)
+    try:
+        yield ret
+    finally:
+        _current_query_stats.reset(token)
+
+
+# tasks copy the context of the code creating them, so long-lived tasks started while handling a request (like background
+# workers or listeners) would otherwise add all their queries to the request stats and keep them in memory
+def create_untracked_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    return asyncio.get_running_loop().create_task(coro, context=_build_untracked_context())
+
+
+def _build_untracked_context() -> Context:
+    ret = copy_context()
+    ret.run(_current_query_stats.set, None)
+    return ret
+
+
+# start time is kept in the execution context, so nothing is left behind when a query fails
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    time_ms = (time.perf_counter() - context.query_start_time) * 1000
+    stats = _current_query_stats.get()
+    if stats:
+        stats.add(statement, time_ms)
+    if time_ms >= env.db_slow_query_ms:
+        logger.warning("Slow query (%.1fms): %s", time_ms, _SPACES_REGEX.sub(" ", statement))
+
+
+# tracks queries run by each request. Slow queries and repeated statements are logged, and, when enabled, query stats
+# are added as response headers. Streamed responses send headers before finishing, so headers only include queries run
+# until the response started
+class QueryStatsMiddleware:
+
+    def __init__(self, app: ASGIApp, add_headers: bool = env.db_query_stats_headers):
+        self._app = app
+        self._add_headers = add_headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_with_stats(message: Message):
+                if self._add_headers and message["type"] == "http.response.start":
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers["X-DB-Query-Count"] = str(stats.count)
+                    headers["X-DB-Query-Time-Ms"] = f"{stats.time_ms:.1f}"
+                    headers["X-DB-Repeated-Queries"] = str(len(stats.find_repeated()))
+                await send(message)
+
+            try:
+                await self._app(scope, receive, send_with_stats)
+            finally:
+                for statement, statement_stats in stats.find_repeated().items():
+                    logger.warning("Statement run %d times (%.1fms) in %s %s: %s", statement_stats.count, statement_stats.time_ms,
+                                   scope["method"], scope["path"], statement)
+
+
 # this method allows to easily cast a query to SelectOfScalar to avoid type errors when using sqlmodel exec method
 # for example when using delete statements
 # this is related to https://github.com/fastapi/sqlmodel/issues/909
@@ -0,0 +1,83 @@
+import time
+from typing import List, Optional
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .env import env
+
+
+EVENT_STREAM_CONTENT_TYPE = "text/event-stream"
+GZIP_LEVEL = 6
+
+
+# Groups consecutive text chunks (generated tokens) into bigger ones, reducing the number of events that need to be
+# encoded, compressed and written. Chunks are released once the window time has elapsed since the first pending chunk
+# or pending text reaches the max size. Streams should flush pending text before emitting any other event.
+class ChunkCoalescer:
+
+    def __init__(self, window_seconds: float = env.sse_coalesce_window_ms / 1000, max_chars: int = env.sse_coalesce_max_chars):
+        self.window_seconds = window_seconds
+        self._max_chars = max_chars
+        self._chunks: List[str] = []
+        self._size = 0
+        self._started_at = 0.0
+
+    def add(self, chunk: str) -> Optional[str]:
+        if not self._chunks:
+            self._started_at = time.monotonic()
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self._max_chars or time.monotonic() - self._started_at >= self.window_seconds:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._chunks:
+            return None
+        ret = "".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return ret
+
+
+# GZipMiddleware skips event streams since it can't compress them incrementally. This middleware compresses them with a
+# single compression context for the whole stream (so later events benefit from previous ones) and sync flushes after each
+# written chunk, so events are not retained by the compressor. It also disables proxy buffering so events are delivered
+# as soon as they are written.
+class EventStreamCompressionMiddleware:
+
+    def __init__(self, app: ASGIApp, compress: bool = env.sse_compression):
+        self._app = app
+        self._compress = compress
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        accepts_gzip = "gzip" in Headers(scope=scope).get("accept-encoding", "")
+        compressor: Optional["zlib._Compress"] = None
+
+        async def send_event_stream(message: Message):
+            nonlocal compressor
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if headers.get("content-type", "").startswith(EVENT_STREAM_CONTENT_TYPE):
+                    headers["Cache-Control"] = "no-cache"
+                    headers["X-Accel-Buffering"] = "no"
+                    if self._compress and accepts_gzip and "content-encoding" not in headers:
+                        # 31 window bits produces gzip format
+                        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+                        headers["Content-Encoding"] = "gzip"
+                        headers.add_vary_header("Accept-Encoding")
+                        if "content-length" in headers:
+                            del headers["content-length"]
+            elif message["type"] == "http.response.body" and compressor:
+                body = compressor.compress(message.get("body", b""))
+                more_body = message.get("more_body", False)
+                body += compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+                message = {**message, "body": body}
+            await send(message)
+
+        await self._app(scope, receive, send_event_stream)
@@ -1,8 +1,8 @@
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 
-from sqlmodel import Field
+from sqlmodel import Field, SQLModel
 
 from ..core.domain import CamelCaseModel
 
@@ -75,3 +75,14 @@ class FileMetadataWithContent(FileMetadata, table=False):
     @staticmethod
     def from_file(file: File) -> 'FileMetadataWithContent':
         return FileMetadataWithContent.model_validate(file)
+
+
+# text extracted from files, to reuse it when the same content is uploaded again (in threads or tools) with the same processor.
+# The processor version is part of the key so changes in a processor extraction logic don't reuse previous extractions.
+class FileExtraction(SQLModel, table=True):
+    __tablename__ : Any = "file_extraction"
+    content_hash: str = Field(primary_key=True, max_length=64)
+    processor: str = Field(primary_key=True, max_length=50)
+    processor_version: int = Field(primary_key=True)
+    processed_content: str
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
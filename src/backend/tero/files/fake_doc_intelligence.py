@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import base64
+import time
+from typing import Any, Optional
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request, Response, status
+import pypdfium2 as pdfium
+import uvicorn
+
+
+# inches, as reported by Azure Document Intelligence for pdfs
+_POINTS_PER_INCH = 72
+
+
+# Offline emulation of the Azure Document Intelligence layout analysis API (submitting a document and polling its result),
+# so enhanced pdf processing can be tested without an Azure resource. Each text line of a page is reported as a paragraph.
+class FakeDocIntelligence:
+
+    def __init__(self, analysis_ms: int = 1000):
+        self.analysis_ms = analysis_ms
+        self.running = 0
+        self.max_running = 0
+        self.analyzed_pages = 0
+        self._results: dict[str, tuple[float, dict[str, Any]]] = {}
+        self._completed: set[str] = set()
+
+    def submit(self, content: bytes) -> str:
+        ret = str(uuid.uuid4())
+        analysis_result = _analyze_layout(content)
+        self._results[ret] = (time.monotonic() + self.analysis_ms / 1000, analysis_result)
+        self.analyzed_pages += len(analysis_result["pages"])
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        return ret
+
+    def find_result(self, operation_id: str) -> Optional[dict[str, Any]]:
+        found = self._results.get(operation_id)
+        if not found:
+            return None
+        ready_time, analyze_result = found
+        if time.monotonic() < ready_time:
+            return {"status": "running"}
+        if operation_id not in self._completed:
+            self._completed.add(operation_id)
+            self.running -= 1
+        return {"status": "succeeded", "analyzeResult": analyze_result}
+
+
+def _analyze_layout(content: bytes) -> dict[str, Any]:
+    pages = []
+    paragraphs = []
+    with pdfium.PdfDocument(content) as pdf:
+        for page_number, page in enumerate(pdf, start=1):
+            width, height = page.get_size()
+            pages.append({"pageNumber": page_number, "width": width / _POINTS_PER_INCH, "height": height / _POINTS_PER_INCH, "unit": "inch"})
+            text = page.get_textpage().get_text_bounded().replace("\r", "")
+            lines = [line.strip() for line in text.split("\n") if line.strip()]
+            for i, line in enumerate(lines):
+                y = 1 + i * 0.25
+                paragraphs.append({"content": line, "boundingRegions": [{"pageNumber": page_number, "polygon": [1, y, 7, y, 7, y + 0.2, 1, y + 0.2]}]})
+    return {"apiVersion": "2024-11-30", "modelId": "prebuilt-layout", "content": "\n".join(p["content"] for p in paragraphs),
+            "pages": pages, "paragraphs": paragraphs, "tables": []}
+
+
+def build_fake_doc_intelligence_app(doc_intelligence: FakeDocIntelligence) -> FastAPI:
+    ret = FastAPI()
+
+    @ret.post("/documentintelligence/documentModels/{model_id}:analyze", status_code=status.HTTP_202_ACCEPTED)
+    async def analyze(model_id: str, request: Request, response: Response):
+        if request.headers.get("content-type", "").startswith("application/json"):
+            content = base64.b64decode((await request.json())["base64Source"])
+        else:
+            content = await request.body()
+        operation_id = await asyncio.to_thread(doc_intelligence.submit, content)
+        response.headers["Operation-Location"] = str(request.url_for("analyze_result", model_id=model_id, operation_id=operation_id)) + "?api-version=2024-11-30"
+        # polling interval, which the client reads from this header and would otherwise default to 30 seconds
+        response.headers["retry-after-ms"] = str(max(1, doc_intelligence.analysis_ms // 4))
+
+    @ret.get("/documentintelligence/documentModels/{model_id}/analyzeResults/{operation_id}")
+    async def analyze_result(model_id: str, operation_id: str, response: Response) -> dict:
+        result = doc_intelligence.find_result(operation_id)
+        if not result:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        response.headers["retry-after-ms"] = str(max(1, doc_intelligence.analysis_ms // 4))
+        return result
+
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Azure Document Intelligence endpoint, to use as AZURE_DOC_INTELLIGENCE_ENDPOINT")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--analysis-ms", type=int, default=1000, help="Time each analysis takes to complete")
+    args = parser.parse_args()
+    uvicorn.run(build_fake_doc_intelligence_app(FakeDocIntelligence(args.analysis_ms)), host="127.0.0.1", port=args.port)
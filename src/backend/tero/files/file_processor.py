@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import Executor
 import io
 from io import BytesIO
 import logging
@@ -11,7 +13,7 @@ import xlrd
 
 from ..files.domain import File
 from ..files.file_quota import FileQuota
-from ..files.pdf_processor import process_pdf_basic, process_pdf_enhanced
+from ..files.pdf_processor import process_pdf_basic, process_pdf_basic_in_pool, process_pdf_enhanced, process_pdf_enhanced_async
 
 
 logger = logging.getLogger(__name__)
@@ -21,23 +23,38 @@ def get_encoding(content_type: Optional[str]) -> str:
     encoding = content_type.split(charset_param, 1)[1] if content_type and charset_param in content_type else 'utf-8'
     return encoding
 
-class BaseFileProcessor(ABC):    
+class BaseFileProcessor(ABC):
+    # processors which are expensive to run (or have a cost) cache their extractions. Increase the version when changing
+    # the extracted text, so previously cached extractions are not reused
+    cache_extractions = False
+    extraction_version = 1
+
     @abstractmethod
     def supports(self, file: File) -> bool:
         # Checks if this processor supports the given file
         pass
     
+    # when the content is available in a file (eg: a spooled upload), processors read it from the given path instead of
+    # using the file content
     @abstractmethod
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
         pass
 
+    # CPU intensive processors override this to extract text in the executor (a process pool), when one is provided. When
+    # the content is available in a file, processes read it from the given path instead of receiving the content
+    async def extract_text_async(self, file: File, file_quota: FileQuota, executor: Optional[Executor], content_path: Optional[str] = None) -> str:
+        return await asyncio.to_thread(self.extract_text, file, file_quota, content_path)
+
 class PlainTextFileProcessor(BaseFileProcessor):
 
     def supports(self, file: File) -> bool:
         return any(file.name.lower().endswith(ext) for ext in {'.txt', '.md', '.csv', '.har', '.json', '.svg'})
     
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
         encoding = get_encoding(file.content_type)
+        if content_path:
+            with open(content_path, encoding=encoding, newline='') as f:
+                return f.read()
         return file.content.decode(encoding)
 
 class Sheet(ABC):
@@ -63,17 +80,27 @@ class Sheet(ABC):
 
 class SpreadsheetFileProcessor(BaseFileProcessor, ABC):
     file_extension: str
+    cache_extractions = True
 
     def supports(self, file: File) -> bool:
         return file.name.lower().endswith(self.file_extension)
 
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
-        sheets = self._load_sheets(file.content)
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        return self._extract_content_text(content_path or file.content)
+
+    async def extract_text_async(self, file: File, file_quota: FileQuota, executor: Optional[Executor], content_path: Optional[str] = None) -> str:
+        if not executor:
+            return await super().extract_text_async(file, file_quota, executor, content_path)
+        return await asyncio.get_running_loop().run_in_executor(executor, self._extract_content_text, content_path or file.content)
+
+    def _extract_content_text(self, content: bytes | str) -> str:
+        sheets = self._load_sheets(content)
         sheet_count = sum(1 for sheet in sheets if sheet.row_count)
         return "\n\n".join(self._format_sheet(sheet, include_sheet_name=sheet_count > 1) for sheet in sheets if sheet.row_count)
 
+    # content is either the file bytes or the path of a file with them
     @abstractmethod
-    def _load_sheets(self, content: bytes) -> list[Sheet]:
+    def _load_sheets(self, content: bytes | str) -> list[Sheet]:
         pass
 
     def _format_sheet(self, sheet: Sheet, include_sheet_name: bool) -> str:
@@ -110,8 +137,8 @@ class XlsxSheet(Sheet):
 class XlsxFileProcessor(SpreadsheetFileProcessor):
     file_extension = '.xlsx'
 
-    def _load_sheets(self, content: bytes) -> list[Sheet]:
-        wb = openpyxl.load_workbook(BytesIO(content))
+    def _load_sheets(self, content: bytes | str) -> list[Sheet]:
+        wb = openpyxl.load_workbook(BytesIO(content) if isinstance(content, bytes) else content)
         return [XlsxSheet(sheet) for sheet in wb.worksheets]
 
 class XlsSheet(Sheet):
@@ -140,36 +167,47 @@ class XlsSheet(Sheet):
 class XlsFileProcessor(SpreadsheetFileProcessor):
     file_extension = '.xls'
 
-    def _load_sheets(self, content: bytes) -> list[Sheet]:
-        wb = xlrd.open_workbook(file_contents=content)
+    def _load_sheets(self, content: bytes | str) -> list[Sheet]:
+        wb = xlrd.open_workbook(file_contents=content) if isinstance(content, bytes) else xlrd.open_workbook(content)
         return [XlsSheet(sheet) for sheet in wb.sheets()]
     
 class BasicPdfFileProcessor(BaseFileProcessor):
+    cache_extractions = True
     
     def supports(self, file: File) -> bool:
         return file.name.lower().endswith('.pdf')
     
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
-        return process_pdf_basic(file, file_quota)
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        return process_pdf_basic(file, file_quota, content_path)
+
+    async def extract_text_async(self, file: File, file_quota: FileQuota, executor: Optional[Executor], content_path: Optional[str] = None) -> str:
+        if not executor:
+            return await super().extract_text_async(file, file_quota, executor, content_path)
+        return await process_pdf_basic_in_pool(file, file_quota, executor, content_path)
 
 class EnhancedPdfFileProcessor(BaseFileProcessor):
+    cache_extractions = True
     
     def supports(self, file: File) -> bool:
         return file.name.lower().endswith('.pdf')
     
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
-        return process_pdf_enhanced(file, file_quota)
+    # runs its own event loop, so it must not be invoked from a running one (use extract_text_async instead)
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        return process_pdf_enhanced(file, file_quota, content_path)
+
+    # analysis is mostly waiting for Azure Document Intelligence, so it runs in the event loop instead of the executor
+    async def extract_text_async(self, file: File, file_quota: FileQuota, executor: Optional[Executor], content_path: Optional[str] = None) -> str:
+        return await process_pdf_enhanced_async(file, file_quota, content_path)
     
 class ImageFileProcessor(BaseFileProcessor):
     
     def supports(self, file: File) -> bool:
         return any(file.name.lower().endswith(ext) for ext in {'.jpg', '.jpeg', '.png'})
     
-    def extract_text(self, file: File, file_quota: FileQuota) -> str:
+    def extract_text(self, file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
         try:
-            image_bytes = io.BytesIO(file.content)
-            image = Image.open(image_bytes)
-            image.verify()
+            with Image.open(content_path or io.BytesIO(file.content)) as image:
+                image.verify()
         except Exception as e:
             logger.error(f"Invalid image file {file.name}: {e}")
             raise ValueError(f"Invalid image file: {file.name}")
@@ -1,8 +1,6 @@
 import logging
 from typing import TYPE_CHECKING, Optional
 
-from langchain_core.messages import HumanMessage
-
 from ..ai_models import ai_factory
 if TYPE_CHECKING:
     from ..threads.engine import AgentEngine
@@ -26,13 +24,30 @@ class FileQuota:
         self.current_quota = current_quota
         self.model = ai_factory.build_streaming_chat_model(engine._agent.model_id, engine._agent.model_temperature, engine._agent.model_reasoning_effort) if engine else None
         self.available_tokens = engine._agent.model.token_limit - engine._agent.model.output_token_limit if engine else None
+        self._counted_tokens = 0
+        self.truncated = False
+
+    # processors add the content as they extract it, so each part is only tokenized once and checking the limit is cheap
+    def add_content(self, content: str):
+        if self.model and self.available_tokens:
+            self._counted_tokens += self.model.get_num_tokens(content)
 
-    def has_reached_token_limit(self, current_content: str) -> bool:
+    # processors check the limit before adding more content, so when the limit is reached the extracted content is truncated
+    def has_reached_token_limit(self) -> bool:
         if not self.model or not self.available_tokens:
             return False
+        self.truncated = self.truncated or self._counted_tokens >= self.available_tokens
+        return self.truncated
 
-        current_tokens = self.model.get_num_tokens_from_messages(messages=[HumanMessage(content=current_content)])
-        return current_tokens >= self.available_tokens
+    # adds the content (eg: a previously extracted one) only if it is within the token limit, since it can't be truncated
+    def try_add_content(self, content: str) -> bool:
+        if not self.model or not self.available_tokens:
+            return True
+        tokens = self.model.get_num_tokens(content)
+        if self._counted_tokens + tokens > self.available_tokens:
+            return False
+        self._counted_tokens += tokens
+        return True
     
     def has_reached_quota_limit(self) -> bool:
         return self.current_quota.current_usage + self.pdf_parsing_usage.usd_cost > self.current_quota.user_quota
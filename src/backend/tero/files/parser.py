@@ -1,14 +1,28 @@
 import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+import hashlib
 import logging
+import multiprocessing
+import time
 from typing import Optional
 
 import chardet
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ..files.domain import File, FileProcessor
+from ..core.env import env
+from ..core.metrics import Counter, Histogram
+from ..files.domain import File, FileExtraction, FileProcessor
 from ..files.file_processor import BaseFileProcessor, PlainTextFileProcessor, XlsxFileProcessor, XlsFileProcessor, BasicPdfFileProcessor, EnhancedPdfFileProcessor, ImageFileProcessor
 from ..files.file_quota import FileQuota
+from ..files.repos import FileExtractionRepository
 
 logger = logging.getLogger(__name__)
+file_extraction_duration = Histogram("tero_file_extraction_duration_seconds", "Time to extract text from files by file processor",
+                                     ["processor", "status"])
+file_extraction_cache = Counter("tero_file_extraction_cache_total", "Lookups of cached file extractions by file processor and result (hit or miss)",
+                                ["processor", "result"])
+_extraction_executor: Optional[ProcessPoolExecutor] = None
+ENCODING_DETECTION_BYTES = 64 * 1024
 
 class UnsupportedFileError(Exception):
     def __init__(self, file_name: str):
@@ -17,7 +31,8 @@ class UnsupportedFileError(Exception):
 def add_encoding_to_content_type(content_type: Optional[str], content: bytes) -> str:
     # add the encoding to the content type so later on it can be used (for exammple in tools file processing) and is avaible to frontend for proper file visualization
     if content_type and content_type.startswith('text/') and not 'charset=' in content_type:
-        detected = chardet.detect(content)
+        # a prefix of the content is enough to detect the encoding, and avoids analyzing every byte of big files
+        detected = chardet.detect(content[:ENCODING_DETECTION_BYTES])
         encoding = detected['encoding'] if detected and detected['encoding'] else 'utf-8'
         content_type = f"{content_type}; charset={encoding.lower()}"
     return content_type or "application/octet-stream"
@@ -35,6 +50,49 @@ def find_file_processor(file: File) -> BaseFileProcessor:
         raise UnsupportedFileError(file.name)
     return found
 
-async def extract_file_text(file: File, file_quota: FileQuota) -> str:
+# CPU intensive extraction (pdfs and spreadsheets) runs in a pool of processes, since running it in threads holds the GIL
+# and stalls the rest of requests (like streamed answers) handled by the server process
+def _get_extraction_executor() -> Optional[Executor]:
+    global _extraction_executor
+    if env.file_extraction_workers <= 0:
+        return None
+    if _extraction_executor is None:
+        # processes are spawned instead of forked, since forking a process running threads (like the event loop ones) is not safe
+        _extraction_executor = ProcessPoolExecutor(max_workers=env.file_extraction_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _extraction_executor
+
+# extractions of expensive processors are cached by content hash, so uploading the same file again (in any thread, tool or
+# by any user) doesn't parse it again (nor pays again for enhanced pdf processing)
+# When the content is available in a file (eg: a spooled upload), its path and hash can be provided to avoid hashing the content
+# again and to let processors running in other processes read it from the file.
+async def extract_file_text(file: File, file_quota: FileQuota, db: AsyncSession, content_hash: Optional[str] = None,
+                            content_path: Optional[str] = None) -> str:
     processor = find_file_processor(file)
-    return await asyncio.to_thread(processor.extract_text, file, file_quota)
+    if not processor.cache_extractions:
+        return await _extract_file_text(processor, file, file_quota, content_path)
+
+    processor_name = type(processor).__name__
+    content_hash = content_hash or await asyncio.to_thread(lambda: hashlib.sha256(file.content).hexdigest())
+    repo = FileExtractionRepository(db)
+    cached = await repo.find(content_hash, processor_name, processor.extraction_version)
+    # cached extractions are complete, so they are only used when fitting the token limit (otherwise the file is extracted again and truncated)
+    if cached and await asyncio.to_thread(file_quota.try_add_content, cached.processed_content):
+        file_extraction_cache.inc(processor=processor_name, result="hit")
+        return cached.processed_content
+    file_extraction_cache.inc(processor=processor_name, result="miss")
+
+    ret = await _extract_file_text(processor, file, file_quota, content_path)
+    if not file_quota.truncated:
+        await repo.add(FileExtraction(content_hash=content_hash, processor=processor_name, processor_version=processor.extraction_version,
+                                      processed_content=ret))
+    return ret
+
+async def _extract_file_text(processor: BaseFileProcessor, file: File, file_quota: FileQuota, content_path: Optional[str]) -> str:
+    start = time.perf_counter()
+    status = "error"
+    try:
+        ret = await processor.extract_text_async(file, file_quota, _get_extraction_executor(), content_path)
+        status = "success"
+        return ret
+    finally:
+        file_extraction_duration.observe(time.perf_counter() - start, processor=type(processor).__name__, status=status)
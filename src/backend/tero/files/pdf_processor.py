@@ -1,10 +1,14 @@
 import abc
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
 from dataclasses import dataclass
 import io
 import logging
-from typing import Optional, TypeVar, Generic, cast
+import tempfile
+from typing import IO, Optional, TypeVar, Generic, cast
 
-from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, AnalyzeResult
 from azure.core.credentials import AzureKeyCredential
 from pydantic import SecretStr
@@ -138,32 +142,81 @@ class BoundedTable(BoundedElement['BoundedTable']):
         return f"\n{table}\n"
 
 
-def process_pdf_basic(upload_file: File, file_quota: FileQuota) -> str:
+def process_pdf_basic(upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
     processor = BasicPDFProcessor()
-    return processor.extract_content(upload_file, file_quota)
+    return processor.extract_content(upload_file, file_quota, content_path)
 
 
-def process_pdf_enhanced(upload_file: File, file_quota: FileQuota) -> str:
+# pages ranges are extracted in parallel by the executor processes and their text is added in order, so quota and token
+# limits are checked as when extracting pages sequentially
+async def process_pdf_basic_in_pool(upload_file: File, file_quota: FileQuota, executor: Executor, content_path: Optional[str] = None) -> str:
+    # processes read the pdf from a file, which avoids sending the whole content to each process and lets pdfium only
+    # load the pages it extracts
+    if content_path:
+        return await _process_pdf_file_basic_in_pool(content_path, upload_file, file_quota, executor)
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        pdf_file.write(upload_file.content)
+        pdf_file.flush()
+        return await _process_pdf_file_basic_in_pool(pdf_file.name, upload_file, file_quota, executor)
+
+
+async def _process_pdf_file_basic_in_pool(path: str, upload_file: File, file_quota: FileQuota, executor: Executor) -> str:
+    processor = BasicPDFProcessor()
+    loop = asyncio.get_running_loop()
+    total_pages = await loop.run_in_executor(executor, count_pdf_pages, path)
+    pending_ranges = deque((start_page, min(start_page + PAGES_CHUNK_SIZE - 1, total_pages)) for start_page in range(1, total_pages + 1, PAGES_CHUNK_SIZE))
+    extractions: deque[tuple[int, asyncio.Future[list[str]]]] = deque()
+    pages_content: list[str] = []
+    try:
+        while pending_ranges or extractions:
+            # only a few ranges are extracted ahead, to keep processes busy without extracting much more than needed when reaching the token limit
+            while pending_ranges and len(extractions) < env.file_extraction_workers:
+                start_page, end_page = pending_ranges.popleft()
+                extractions.append((start_page, loop.run_in_executor(executor, extract_pdf_pages, path, start_page, end_page)))
+            start_page, extraction = extractions.popleft()
+            # tokenizing the pages text is CPU intensive, so it's done in a thread to not block the event loop
+            if not await asyncio.to_thread(processor._add_pages_content, pages_content, start_page, await extraction, upload_file, file_quota):
+                return "\n\n".join(pages_content)
+    finally:
+        for _, extraction in extractions:
+            extraction.cancel()
+    return "\n\n".join(pages_content)
+
+
+def count_pdf_pages(path: str) -> int:
+    with pdfium.PdfDocument(path) as pdf:
+        return len(pdf)
+
+
+def extract_pdf_pages(path: str, start_page: int, end_page: int) -> list[str]:
+    processor = BasicPDFProcessor()
+    with pdfium.PdfDocument(path) as pdf:
+        return [processor._extract_page_text(pdf, page_num) for page_num in range(start_page, end_page + 1)]
+
+
+# only for threads without a running event loop, see EnhancedPDFProcessor.extract_content
+def process_pdf_enhanced(upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+    return asyncio.run(process_pdf_enhanced_async(upload_file, file_quota, content_path))
+
+
+async def process_pdf_enhanced_async(upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
     processor = EnhancedPDFProcessor(endpoint=cast(str, env.azure_doc_intelligence_endpoint), key=cast(SecretStr, env.azure_doc_intelligence_key).get_secret_value())
-    return processor.extract_content(upload_file, file_quota)
+    return await processor.extract_content_async(upload_file, file_quota, content_path)
 
 
 class BasePDFProcessor(abc.ABC):
     
+    # when content_path is provided, the pdf is read from it instead of the file content
     @abc.abstractmethod
-    def extract_content(self, upload_file: File, file_quota: FileQuota) -> str:
+    def extract_content(self, upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
         pass
 
-    def _get_total_pages(self, content: bytes):
-        pdf = PdfReader(io.BytesIO(content))
-        return len(pdf.pages)
-        
-    def _format_pages_content(self, all_pages_content: dict) -> str:
-        return "\n\n".join(f"## Page {page_num}\n{all_pages_content[page_num]}" for page_num in sorted(all_pages_content.keys()))
+    def _format_page_content(self, page_num: int, content: str) -> str:
+        return f"## Page {page_num}\n{content}"
 
-    def _write_pdf_chunk(self, content: bytes, start_page: int, end_page: int) -> bytes:
+    # content is either the pdf bytes or the path of a file with them
+    def _write_pdf_chunk(self, pdf_reader: PdfReader, content: bytes | str, start_page: int, end_page: int) -> bytes:
         try:
-            pdf_reader = PdfReader(io.BytesIO(content))
             pdf_writer = PdfWriter()
             
             for page_num in range(start_page, end_page + 1):
@@ -175,84 +228,141 @@ class BasePDFProcessor(abc.ABC):
             
         except Exception as e:
             logger.warning(f"Failed to write PDF chunk {start_page}-{end_page}: {e}. Using original content.")
-            return content
+            if isinstance(content, bytes):
+                return content
+            with open(content, 'rb') as f:
+                return f.read()
 
 class BasicPDFProcessor(BasePDFProcessor):
 
-    def extract_content(self, upload_file: File, file_quota: FileQuota) -> str:
-        content = upload_file.content
-        total_pages = self._get_total_pages(content)
-        all_pages_content = {}
-        
-        for start_page in range(1, total_pages + 1, PAGES_CHUNK_SIZE):
-            end_page = min(start_page + PAGES_CHUNK_SIZE - 1, total_pages)
-            
-            if file_quota.has_reached_quota_limit():
-                raise QuotaExceededError(f"Quota exceeded when analyzing pdf {upload_file.id} {upload_file.name}")
-                
-            current_content = self._format_pages_content(all_pages_content)
-            if file_quota.has_reached_token_limit(current_content):
-                logger.warning(f"Token limit reached when analyzing pdf {upload_file.id} {upload_file.name}. Stopping analysis at page {start_page-1}")
-                break
-            
-            pdf_chunk = self._write_pdf_chunk(content, start_page, end_page)
-            pages_content = self._process_with_pypdfium2(pdf_chunk, start_page)
-            all_pages_content.update(pages_content)
-            
-        return self._format_pages_content(all_pages_content)
-
-    def _process_with_pypdfium2(self, pdf_chunk: bytes, start_page_offset: int = 0) -> dict:
-        pages_content = {}
-        with pdfium.PdfDocument(pdf_chunk) as pdf:
-            for relative_page_number, page in enumerate(pdf, start=1):
-                actual_page_number = relative_page_number + start_page_offset - 1
-                textpage = page.get_textpage()
-                content = self._clean_pypdfium2_content(textpage.get_text_bounded())
-                pages_content[actual_page_number] = content
-        return pages_content
+    # the document is parsed once and pages are extracted and tokenized one at a time, so time grows linearly with the
+    # number of pages and only one page is loaded at a time
+    def extract_content(self, upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        pages_content: list[str] = []
+        # pdfium loads pages from files on demand, instead of requiring the whole content in memory
+        with pdfium.PdfDocument(content_path or upload_file.content) as pdf:
+            for page_num in range(1, len(pdf) + 1):
+                if not self._add_page_content(pages_content, page_num, self._extract_page_text(pdf, page_num), upload_file, file_quota):
+                    break
+        return "\n\n".join(pages_content)
+
+    # returns False when the token limit has been reached and some of the pages were not added
+    def _add_pages_content(self, pages_content: list[str], start_page: int, pages_text: list[str], upload_file: File, file_quota: FileQuota) -> bool:
+        return all(self._add_page_content(pages_content, page_num, page_text, upload_file, file_quota)
+                   for page_num, page_text in enumerate(pages_text, start=start_page))
+
+    # returns False when the token limit has been reached and the page was not added
+    def _add_page_content(self, pages_content: list[str], page_num: int, page_text: str, upload_file: File, file_quota: FileQuota) -> bool:
+        if file_quota.has_reached_quota_limit():
+            raise QuotaExceededError(f"Quota exceeded when analyzing pdf {upload_file.id} {upload_file.name}")
+        if file_quota.has_reached_token_limit():
+            logger.warning(f"Token limit reached when analyzing pdf {upload_file.id} {upload_file.name}. Stopping analysis at page {page_num-1}")
+            return False
+        page_content = self._format_page_content(page_num, page_text)
+        file_quota.add_content(page_content)
+        pages_content.append(page_content)
+        return True
+
+    def _extract_page_text(self, pdf: pdfium.PdfDocument, page_num: int) -> str:
+        page = pdf[page_num - 1]
+        try:
+            textpage = page.get_textpage()
+            try:
+                return self._clean_pypdfium2_content(textpage.get_text_bounded())
+            finally:
+                textpage.close()
+        finally:
+            page.close()
 
     def _clean_pypdfium2_content(self, content: str) -> str:
         return content.replace("\r", "").strip()
 
 class EnhancedPDFProcessor(BasePDFProcessor):
     
-    def __init__(self, endpoint: str, key: str):
-        self.client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+    def __init__(self, endpoint: str, key: str, max_concurrency: Optional[int] = None):
+        self._endpoint = endpoint
+        self._key = key
+        self._max_concurrency = max_concurrency or env.azure_doc_intelligence_max_concurrency
     
-    def extract_content(self, upload_file: File, file_quota: FileQuota) -> str:
-        content = upload_file.content
-        total_pages = self._get_total_pages(content)
-        all_pages_content = {}
-        analyzed_pages = 0
-        
-        for start_page in range(1, total_pages + 1, PAGES_CHUNK_SIZE):
-            end_page = min(start_page + PAGES_CHUNK_SIZE - 1, total_pages)
-            
+    # runs its own event loop, so it can only be invoked from threads without a running loop (like the ones used by
+    # BaseFileProcessor.extract_text_async). Code running in an event loop should use extract_content_async instead.
+    def extract_content(self, upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        return asyncio.run(self.extract_content_async(upload_file, file_quota, content_path))
+
+    # chunks are analyzed concurrently (up to max concurrency) and their pages are added in order, so the token limit is
+    # checked as when analyzing chunks sequentially
+    async def extract_content_async(self, upload_file: File, file_quota: FileQuota, content_path: Optional[str] = None) -> str:
+        # pypdf reads opened files on demand (while paths are fully read in memory), so only written chunks are loaded
+        pdf_stream = await asyncio.to_thread(open, content_path, 'rb') if content_path else io.BytesIO(upload_file.content)
+        try:
+            return await self._extract_stream_content(pdf_stream, content_path or upload_file.content, upload_file, file_quota)
+        finally:
+            pdf_stream.close()
+
+    async def _extract_stream_content(self, pdf_stream: IO[bytes], content: bytes | str, upload_file: File, file_quota: FileQuota) -> str:
+        pdf_reader = await asyncio.to_thread(PdfReader, pdf_stream)
+        total_pages = len(pdf_reader.pages)
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        # pypdf readers are not thread safe, so chunks are written one at a time
+        reader_lock = asyncio.Lock()
+        pages_content = []
+        async with DocumentIntelligenceClient(endpoint=self._endpoint, credential=AzureKeyCredential(self._key)) as client:
+            analyses = [asyncio.create_task(self._analyze_chunk(client, semaphore, reader_lock, pdf_reader, content, start_page,
+                                                                min(start_page + PAGES_CHUNK_SIZE - 1, total_pages), upload_file, file_quota))
+                        for start_page in range(1, total_pages + 1, PAGES_CHUNK_SIZE)]
+            try:
+                for start_page, analysis in zip(range(1, total_pages + 1, PAGES_CHUNK_SIZE), analyses):
+                    chunk_content = await analysis
+                    # chunks may have started analysis before previous ones were added, so the limit is checked again
+                    if chunk_content is None or self._has_reached_token_limit(start_page, upload_file, file_quota):
+                        break
+                    # tokenizing the pages text is CPU intensive, so it's done in a thread to not block the event loop
+                    await asyncio.to_thread(self._add_pages_content, pages_content, chunk_content, file_quota)
+            finally:
+                for analysis in analyses:
+                    analysis.cancel()
+                await asyncio.gather(*analyses, return_exceptions=True)
+        return "\n\n".join(pages_content)
+
+    # returns None when the token limit is reached before analyzing the chunk
+    async def _analyze_chunk(self, client: DocumentIntelligenceClient, semaphore: asyncio.Semaphore, reader_lock: asyncio.Lock, pdf_reader: PdfReader, content: bytes | str,
+                             start_page: int, end_page: int, upload_file: File, file_quota: FileQuota) -> Optional[dict]:
+        async with semaphore:
+            if self._has_reached_token_limit(start_page, upload_file, file_quota):
+                return None
             if file_quota.has_reached_quota_limit():
                 raise QuotaExceededError(f"Quota exceeded when analyzing pdf {upload_file.id} {upload_file.name}")
-                
-            current_content = self._format_pages_content(all_pages_content)
-            if file_quota.has_reached_token_limit(current_content):
-                logger.warning(f"Token limit reached when analyzing pdf {upload_file.id} {upload_file.name}. Stopping analysis at page {start_page-1}")
-                break
-            
-            pdf_chunk = self._write_pdf_chunk(content, start_page, end_page)   
             chunk_pages = end_page - start_page + 1
-            
-            layout = self._analyze_layout(pdf_chunk)
-            pages_content = self._extract_pages_content(layout, start_page)
+            # pages are reserved right after checking the quota (without awaiting in between), so concurrent chunks check
+            # the quota including the pages being written and analyzed
             self._update_with_pdf_parsing_usage(file_quota, chunk_pages)
-            
-            all_pages_content.update(pages_content)       
-            analyzed_pages += chunk_pages
-            
-        return self._format_pages_content(all_pages_content)
-
-    def _analyze_layout(self, content: bytes) -> AnalyzeResult:
+            try:
+                async with reader_lock:
+                    pdf_chunk = await asyncio.to_thread(self._write_pdf_chunk, pdf_reader, content, start_page, end_page)
+                layout = await self._analyze_layout(client, pdf_chunk)
+            # cancelled analyses keep their reservation, since the service may have already analyzed the pages
+            except Exception:
+                self._update_with_pdf_parsing_usage(file_quota, -chunk_pages)
+                raise
+            return await asyncio.to_thread(self._extract_pages_content, layout, start_page)
+
+    def _add_pages_content(self, pages_content: list[str], chunk_content: dict, file_quota: FileQuota):
+        for page_num in sorted(chunk_content.keys()):
+            page_content = self._format_page_content(page_num, chunk_content[page_num])
+            file_quota.add_content(page_content)
+            pages_content.append(page_content)
+
+    def _has_reached_token_limit(self, start_page: int, upload_file: File, file_quota: FileQuota) -> bool:
+        if file_quota.has_reached_token_limit():
+            logger.warning(f"Token limit reached when analyzing pdf {upload_file.id} {upload_file.name}. Stopping analysis at page {start_page-1}")
+            return True
+        return False
+
+    async def _analyze_layout(self, client: DocumentIntelligenceClient, content: bytes) -> AnalyzeResult:
         request = AnalyzeDocumentRequest(bytes_source=content)
         # https://tech-depth-and-breadth.medium.com/azure-ai-document-intelligence-for-rag-use-cases-4e242b0ba7de
-        poller = self.client.begin_analyze_document("prebuilt-layout", request)
-        return poller.result()
+        poller = await client.begin_analyze_document("prebuilt-layout", request)
+        return await poller.result()
     
     def _extract_pages_content(self, result: AnalyzeResult, start_page_offset: int = 0) -> dict:
         pages_content = {}
@@ -1,9 +1,11 @@
 from datetime import datetime, timezone
 from typing import Optional
 
+import aiofiles
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .domain import File
+from .domain import File, FileExtraction
 
 
 class FileRepository:
@@ -17,6 +19,20 @@ class FileRepository:
         await self._db.refresh(file, ['id'])
         return file
 
+    # the content of spooled uploads is only loaded in memory while storing it, and is expired afterwards (as when loading
+    # files with deferred content) so processing the file reads it from the spool instead of keeping it in memory
+    async def add_with_content_from(self, file: File, content_path: str) -> File:
+        file.content = await _read_content(content_path)
+        ret = await self.add(file)
+        self._db.expire(ret, ['content'])
+        return ret
+
+    async def update_with_content_from(self, file: File, content_path: str):
+        file.content = await _read_content(content_path)
+        await self.update(file)
+        if file in self._db:
+            self._db.expire(file, ['content'])
+
     async def find_by_id(self, file_id: int) -> Optional[File]:
         return await self._db.get(File, file_id)
 
@@ -28,3 +44,22 @@ class FileRepository:
     async def delete(self, file: File):
         await self._db.delete(file)
         await self._db.commit()
+
+
+async def _read_content(path: str) -> bytes:
+    async with aiofiles.open(path, 'rb') as f:
+        return await f.read()
+
+
+class FileExtractionRepository:
+
+    def __init__(self, db: AsyncSession):
+        self._db = db
+
+    async def find(self, content_hash: str, processor: str, processor_version: int) -> Optional[FileExtraction]:
+        return await self._db.get(FileExtraction, (content_hash, processor, processor_version))
+
+    # the same content may be extracted concurrently (eg: uploaded in several threads), so existing extractions are kept
+    async def add(self, extraction: FileExtraction):
+        await self._db.exec(insert(FileExtraction).values(**extraction.model_dump()).on_conflict_do_nothing())
+        await self._db.commit()
@@ -0,0 +1,124 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import hashlib
+from typing import AsyncIterator
+
+import aiofiles
+import aiofiles.os
+import aiofiles.tempfile
+from fastapi import HTTPException, UploadFile, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..core.env import env
+from .parser import ENCODING_DETECTION_BYTES, add_encoding_to_content_type
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+_TOO_LARGE_DETAIL = "fileTooLarge"
+
+
+def _get_max_size() -> int:
+    return env.upload_max_size_mb * 1024 * 1024
+
+
+def _build_too_large_exception() -> HTTPException:
+    return HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=_TOO_LARGE_DETAIL)
+
+
+# Multipart requests (file uploads) are parsed, and their files spooled by starlette, before reaching endpoints, so their
+# size is limited while receiving them: requests declaring a bigger content length are rejected before reading them, and
+# the rest are aborted as soon as they exceed the limit.
+class UploadSizeLimitMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self._app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        headers = Headers(scope=scope)
+        if scope["type"] != "http" or not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self._app(scope, receive, send)
+            return
+
+        max_size = _get_max_size()
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_size:
+            await JSONResponse({"detail": _TOO_LARGE_DETAIL}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)(scope, receive, send)
+            return
+
+        received = 0
+
+        # fastapi lets HTTPExceptions raised while parsing the body reach the exception handlers
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    raise _build_too_large_exception()
+            return message
+
+        await self._app(scope, limited_receive, send)
+
+
+# Uploads are streamed to a temporary file (hashing them and detecting their encoding while reading), instead of reading
+# them in memory at once, so big or concurrent uploads can't exhaust the server memory. Processors read the content from
+# the spool file (processes in the extraction pool included), and the content is only loaded in memory to store it in the
+# database.
+@dataclass
+class SpooledUpload:
+    name: str
+    content_type: str
+    size: int
+    content_hash: str
+    path: str
+    _detached: bool = field(default=False, repr=False)
+
+    async def read(self) -> bytes:
+        async with aiofiles.open(self.path, 'rb') as f:
+            return await f.read()
+
+    # keeps the spool file after the request (eg: to process it in a background task), which should remove it once done
+    def detach(self) -> 'SpooledUpload':
+        self._detached = True
+        return self
+
+    async def remove(self):
+        try:
+            await aiofiles.os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@asynccontextmanager
+async def spool_upload(file: UploadFile, default_name: str) -> AsyncIterator[SpooledUpload]:
+    max_size = _get_max_size()
+    async with aiofiles.tempfile.NamedTemporaryFile('wb', delete=False) as spool:
+        ret = SpooledUpload(name=file.filename or default_name, content_type="", size=0, content_hash="", path=str(spool.name))
+        try:
+            content_hash = hashlib.sha256()
+            encoding_prefix = b""
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                ret.size += len(chunk)
+                if ret.size > max_size:
+                    raise _build_too_large_exception()
+                content_hash.update(chunk)
+                if len(encoding_prefix) < ENCODING_DETECTION_BYTES:
+                    encoding_prefix += chunk[:ENCODING_DETECTION_BYTES - len(encoding_prefix)]
+                await spool.write(chunk)
+            await spool.flush()
+        except BaseException:
+            await ret.remove()
+            raise
+        finally:
+            # starlette spools big uploads in unnamed temporary files (which other processes can't open), so we release
+            # them as soon as they are copied, instead of keeping two copies on disk while processing the upload
+            await file.close()
+    ret.content_type = add_encoding_to_content_type(file.content_type, encoding_prefix)
+    ret.content_hash = content_hash.hexdigest()
+    try:
+        yield ret
+    finally:
+        if not ret._detached:
+            await ret.remove()
@@ -6,6 +6,7 @@ from sqlalchemy.orm import selectinload
 
 from ..core.repos import scalar, attr
 from ..users.domain import User
+from ..users.repos import user_cache
 from .domain import Team, TeamRole, TeamRoleStatus, TeamUser, Role, GLOBAL_TEAM_ID
 
 class TeamRepository:
@@ -58,6 +59,7 @@ class TeamRepository:
     async def save_team_role(self, team_role: TeamRole):
         await self._db.merge(team_role)
         await self._db.commit()
+        user_cache.clear()
 
     async def delete_team_role(self, team_id: int, user_id: int):
         stmt = (
@@ -66,6 +68,7 @@ class TeamRepository:
         )
         await self._db.exec(scalar(stmt))
         await self._db.commit()
+        user_cache.clear()
 
     async def find_teams(self) -> List[Team]:
         stmt = (
@@ -84,6 +87,7 @@ class TeamRepository:
     async def update(self, team: Team):
         await self._db.merge(team)
         await self._db.commit()
+        user_cache.clear()
 
     async def remove_team_roles(self, team_id: int):
         stmt = (
@@ -92,10 +96,12 @@ class TeamRepository:
         )
         await self._db.exec(scalar(stmt))
         await self._db.commit()
+        user_cache.clear()
 
     async def delete(self, team: Team):
         await self._db.delete(team)
         await self._db.commit()
+        user_cache.clear()
 
     async def find_user_team_roles(self, user_id: int) -> List[TeamRole]:
         query = select(TeamRole).where(TeamRole.user_id == user_id)
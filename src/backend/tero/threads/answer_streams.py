@@ -0,0 +1,129 @@
+import asyncio
+from collections import deque
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from sse_starlette.event import ServerSentEvent
+
+from ..core.metrics import Gauge
+from ..core.sse import ChunkCoalescer
+
+
+logger = logging.getLogger(__name__)
+BUFFER_SIZE = 2000
+# time to keep finished streams so clients reconnecting right after the answer completes can still get the last events
+FINISHED_STREAM_TTL_SECONDS = 60
+answer_stream_connections = Gauge("tero_answer_stream_connections_active", "Clients connected to answer streams (SSE connections)")
+
+
+# Keeps the last events of an answer being streamed, decoupling the answer generation from the client connection.
+# Each event gets a sequential id, so clients can reconnect sending the last received id (Last-Event-ID header) and
+# get the missed events and then continue receiving new ones. Generated text chunks are coalesced before being buffered.
+class AnswerStream:
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE, coalescer: Optional[ChunkCoalescer] = None):
+        self._events: deque[tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self._last_id = 0
+        # text is kept in parts and only joined when needed, since concatenating each chunk would copy the whole text every time
+        self._text_parts: list[str] = []
+        self._finished = False
+        self._new_events = asyncio.Event()
+        self._coalescer = coalescer or ChunkCoalescer()
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, event: ServerSentEvent):
+        if event.event is None:
+            text = self._coalescer.add(event.data)
+            if text is not None:
+                self._append(ServerSentEvent(data=text))
+            elif self._flush_timer is None:
+                self._flush_timer = asyncio.get_running_loop().call_later(self._coalescer.window_seconds, self._flush)
+        else:
+            # pending text is sent before any other event to keep events order
+            self._flush()
+            self._append(event)
+
+    def _flush(self):
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        text = self._coalescer.flush()
+        if text is not None:
+            self._append(ServerSentEvent(data=text))
+
+    def _append(self, event: ServerSentEvent):
+        self._last_id += 1
+        event.id = str(self._last_id)
+        if event.event is None:
+            self._text_parts.append(event.data)
+        self._events.append((self._last_id, event.encode()))
+        self._notify()
+
+    def finish(self):
+        self._flush()
+        self._finished = True
+        self._notify()
+
+    def _notify(self):
+        self._new_events.set()
+        self._new_events = asyncio.Event()
+
+    async def subscribe(self, last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        next_id = (last_event_id or 0) + 1
+        answer_stream_connections.inc()
+        try:
+            while True:
+                new_events = self._new_events
+                oldest_id = self._events[0][0] if self._events else self._last_id + 1
+                if next_id < oldest_id:
+                    # missed events are no longer available, so we send the answer text generated so far instead
+                    yield ServerSentEvent(event="partialAnswer", id=str(self._last_id), data=json.dumps({"text": "".join(self._text_parts)})).encode()
+                    next_id = self._last_id + 1
+                pending = [data for event_id, data in self._events if event_id >= next_id]
+                next_id = self._last_id + 1
+                for data in pending:
+                    yield data
+                if self._finished and next_id > self._last_id:
+                    return
+                await new_events.wait()
+        finally:
+            answer_stream_connections.dec()
+
+
+class AnswerStreams:
+
+    def __init__(self):
+        self._streams: dict[int, AnswerStream] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, thread_id: int, events: AsyncIterator[ServerSentEvent]) -> AnswerStream:
+        ret = AnswerStream()
+        self._streams[thread_id] = ret
+        task = asyncio.create_task(self._publish(thread_id, ret, events))
+        # keep a reference to the task to avoid it being garbage collected while running
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return ret
+
+    async def _publish(self, thread_id: int, stream: AnswerStream, events: AsyncIterator[ServerSentEvent]):
+        try:
+            async for event in events:
+                stream.publish(event)
+        except Exception:
+            logger.exception(f"Problem streaming answer for thread {thread_id}")
+            stream.publish(ServerSentEvent(event="error"))
+        finally:
+            stream.finish()
+            asyncio.get_running_loop().call_later(FINISHED_STREAM_TTL_SECONDS, self._remove, thread_id, stream)
+
+    def _remove(self, thread_id: int, stream: AnswerStream):
+        if self._streams.get(thread_id) is stream:
+            del self._streams[thread_id]
+
+    def find(self, thread_id: int) -> Optional[AnswerStream]:
+        return self._streams.get(thread_id)
+
+
+answer_streams = AnswerStreams()
+Gauge("tero_answer_streams_active", "Answers being generated", function=lambda: len(answer_streams._tasks))
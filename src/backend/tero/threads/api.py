@@ -1,12 +1,12 @@
 import asyncio
-from contextlib import AsyncExitStack
 from enum import Enum
 import io
 import json
 import logging
+import time
 from typing import Annotated, Optional, List, AsyncIterator, cast
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, Request, File as FastAPIFile
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, Request, Header, File as FastAPIFile
 from fastapi.responses import StreamingResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sse_starlette.event import ServerSentEvent
@@ -17,29 +17,33 @@ from ..core.api import BASE_PATH
 from ..core.auth import get_current_user
 from ..core.domain import CamelCaseModel
 from ..core.env import env
-from ..core.repos import get_db
+from ..core.repos import get_db, get_db_factory, DbSessionFactory
 from ..files.api import build_file_download_response
 from ..files.domain import File, FileStatus, FileMetadata, FileProcessor, FileMetadataWithContent
-from ..files.parser import add_encoding_to_content_type, extract_file_text
+from ..files.parser import extract_file_text
 from ..files.file_quota import FileQuota, CurrentQuota, QuotaExceededError
 from ..files.repos import FileRepository
+from ..files.upload import spool_upload
 from ..tools.oauth import ToolOAuthRequest, build_tool_oauth_request_http_exception
 from ..usage.domain import Usage, UsageType, MessageUsage    
 from ..usage.repos import UsageRepository
 from ..users.domain import User
+from .answer_streams import answer_streams
 from .domain import ThreadListItem, Thread, ThreadMessage, ThreadMessageOrigin, ThreadUpdate,\
     ThreadMessagePublic, ThreadMessageFile, ThreadMessageUpdate, AgentActionEvent, AgentFileEvent,\
     AgentMessageEvent, ThreadTranscriptionResult
-from .engine import build_thread_name, AgentEngine
-from .time_saved_estimation import estimate_minutes_saved
+from .engine import build_thread_name, AgentEngine, LoadedTools
+from .time_saved_estimation import estimate_minutes_saved, minutes_saved_estimator
 from .repos import ThreadRepository, ThreadMessageRepository, ThreadMessageFileRepository
+from .stream_registry import stream_registry
 
 
 THREADS_PATH = f"{BASE_PATH}/threads"
+# interval to store partial answers while they are being generated
+ANSWER_CHECKPOINT_SECONDS = 5
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-active_streaming_connections: dict[int, asyncio.Event] = {}
 
 
 @router.get(THREADS_PATH)
@@ -132,7 +136,8 @@ class ThreadMessageOriginApi(Enum):
 
 @router.post(THREAD_MESSAGES_PATH, status_code=status.HTTP_201_CREATED)
 async def add_message(thread_id: int, request: Request, user: Annotated[User, Depends(get_current_user)],
-        db: Annotated[AsyncSession, Depends(get_db)], files: List[UploadFile] = []) -> StreamingResponse:
+        db: Annotated[AsyncSession, Depends(get_db)], db_factory: Annotated[DbSessionFactory, Depends(get_db_factory)],
+        files: List[UploadFile] = []) -> StreamingResponse:
     thread = await _find_thread(thread_id, user.id, db)
     current_usage = await UsageRepository(db).find_current_month_user_usage_usd(user.id)
     if current_usage >= user.monthly_usd_limit:
@@ -150,12 +155,17 @@ async def add_message(thread_id: int, request: Request, user: Annotated[User, De
     if parent_message_id is not None:
         await _check_parent_message_id_exists(parent_message_id, thread.id, db)
     existing_files = [ await _find_thread_message_file(thread_id, file_id, db) for file_id in file_ids ]
+    engine = AgentEngine(thread.agent, user.id)
+    # tools are loaded with their own sessions, so we return the request connection to the pool meanwhile. Otherwise, under
+    # load, requests may take all pool connections while waiting for new ones to load tools.
+    await db.commit()
+    try:
+        # tools are loaded before creating anything on db to trigger any tool authentication requirements, and then used to answer
+        loaded_tools = await engine.load_tools(db_factory, thread.id)
+    except ToolOAuthRequest as e:
+        raise build_tool_oauth_request_http_exception(e)
+    
     try:
-        # initialize engine so any tool authentication requirements are triggered before creating anything on db
-        engine = AgentEngine(thread.agent, user.id, db)
-        async with AsyncExitStack() as stack:
-            await engine.load_tools(stack)
-        
         initial_thread_message = ThreadMessage(
             thread_id=thread.id,
             text=message_text,
@@ -168,16 +178,17 @@ async def add_message(thread_id: int, request: Request, user: Annotated[User, De
         await _attach_existing_files_to_message(existing_files, user_message, db)
         await _handle_file_contents(files, user_message, user, thread, engine, db)
         user_message = await repo.refresh_with_files(user_message)
+        await asyncio.to_thread(engine.count_tokens, user_message)
+        await repo.update(user_message)
 
-        return StreamingResponse(
-            _agent_response(user_message, thread, user.id, db, is_in_agent_edition),
-            media_type="text/event-stream",
-        )
-    except ToolOAuthRequest as e:
-        raise build_tool_oauth_request_http_exception(e)
-    
-    except QuotaExceededError:
-        raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, detail="quotaExceeded")
+        # the answer is generated in background so it is not lost if the client disconnects, and can be resumed
+        stream = answer_streams.start(thread.id, _agent_response(user_message, thread, user.id, db_factory, is_in_agent_edition, loaded_tools))
+        return StreamingResponse(stream.subscribe(), media_type="text/event-stream")
+    except BaseException as e:
+        await loaded_tools.aclose()
+        if isinstance(e, QuotaExceededError):
+            raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, detail="quotaExceeded")
+        raise
 
 
 async def _check_parent_message_id_exists(parent_message_id: int, thread_id: int, db: AsyncSession):
@@ -203,101 +214,173 @@ async def _handle_file_contents(files: List[UploadFile], user_message: ThreadMes
     file_repo = FileRepository(db)
     if files:
         for f in files:
-            content = await f.read()
-            content_type = add_encoding_to_content_type(f.content_type, content)
-            file_processor = FileProcessor.ENHANCED if env.azure_doc_intelligence_endpoint and env.azure_doc_intelligence_key else FileProcessor.BASIC
-            file = File(name=f.filename or "uploaded-file", content_type=content_type, content=content, user_id=user.id, file_processor=file_processor)
-            pdf_parsing_usage = Usage(message_id=user_message.id, user_id=user.id, agent_id=thread.agent_id, model_id=None, type=UsageType.PDF_PARSING)
-            current_usage = await UsageRepository(db).find_current_month_user_usage_usd(user.id)
-            file_quota = FileQuota(pdf_parsing_usage, engine, CurrentQuota(current_usage, user.monthly_usd_limit))
-            try:
-                file.processed_content = await extract_file_text(file, file_quota)
-                file.status = FileStatus.PROCESSED
-                saved_file = await file_repo.add(file)
-                await ThreadMessageFileRepository(db).add(ThreadMessageFile(thread_message_id=user_message.id, file_id=saved_file.id))                    
-            
-            finally:
-                await UsageRepository(db).add(pdf_parsing_usage)
-
-
-async def _agent_response(message: ThreadMessage, thread: Thread, user_id: int, db: AsyncSession, is_in_agent_edition: bool) \
-        -> AsyncIterator[bytes]:
+            async with spool_upload(f, "uploaded-file") as upload:
+                file_processor = FileProcessor.ENHANCED if env.azure_doc_intelligence_endpoint and env.azure_doc_intelligence_key else FileProcessor.BASIC
+                file = File(name=upload.name, content_type=upload.content_type, user_id=user.id, file_processor=file_processor)
+                pdf_parsing_usage = Usage(message_id=user_message.id, user_id=user.id, agent_id=thread.agent_id, model_id=None, type=UsageType.PDF_PARSING)
+                current_usage = await UsageRepository(db).find_current_month_user_usage_usd(user.id)
+                file_quota = FileQuota(pdf_parsing_usage, engine, CurrentQuota(current_usage, user.monthly_usd_limit))
+                try:
+                    file.processed_content = await extract_file_text(file, file_quota, db, upload.content_hash, upload.path)
+                    file.status = FileStatus.PROCESSED
+                    saved_file = await file_repo.add_with_content_from(file, upload.path)
+                    await ThreadMessageFileRepository(db).add(ThreadMessageFile(thread_message_id=user_message.id, file_id=saved_file.id))                    
+                
+                finally:
+                    await UsageRepository(db).add(pdf_parsing_usage)
+
+
+# the response stream outlives the request so it opens a short lived session for each unit of work, avoiding holding
+# a pooled connection while waiting for the LLM or tools
+async def _agent_response(message: ThreadMessage, thread: Thread, user_id: int, db_factory: DbSessionFactory, is_in_agent_edition: bool,
+                          loaded_tools: LoadedTools) -> AsyncIterator[ServerSentEvent]:
     message_usage = None
+    answer: Optional[ThreadMessage] = None
+    minutes_saved_estimation: Optional[asyncio.Future[int]] = None
+    stop_event: Optional[asyncio.Event] = None
+    thread_name_task: Optional[asyncio.Task[str]] = None
     yield ServerSentEvent(event="userMessage", data=json.dumps({
         "id": message.id, 
         "files": [FileMetadata.from_file(f.file).model_dump(mode="json", by_alias=True) for f in message.files if f.file]
-    })).encode()
+    }))
     try:
-        stop_event = asyncio.Event()
-        active_streaming_connections[thread.id] = stop_event
+        stop_event = await stream_registry.register(thread.id)
 
-        repo = ThreadMessageRepository(db)
         message_usage = MessageUsage(user_id=user_id, agent_id=thread.agent_id, model_id=thread.agent.model_id, message_id=message.id)
-        thread_messages = await repo.find_previous_messages(message)
+        async with db_factory() as db:
+            thread_messages = await ThreadMessageRepository(db).find_previous_messages(message)
             
+        # the thread name is generated while answering to avoid delaying the first answer tokens
         if len(thread_messages) == 0:
-            thread.name = await build_thread_name(message.text, message_usage, db)
-            await ThreadRepository(db).update(thread)
+            thread_name_task = asyncio.create_task(_update_thread_name(thread, message.text, message_usage, db_factory))
             
-        answer_stream = AgentEngine(thread.agent, user_id, db).answer([*thread_messages, message], message_usage, stop_event)
         complete_answer = ""
+        last_checkpoint = time.monotonic()
         files: List[FileMetadata] = []
-        async for event in answer_stream:
-            if isinstance(event, AgentActionEvent):
-                payload = json.dumps(event.model_dump(mode="json", by_alias=True))
-                yield ServerSentEvent(event="status", data=payload).encode()
-            elif isinstance(event, AgentFileEvent):
-                files.append(event.file)
-            elif isinstance(event, AgentMessageEvent):
-                complete_answer = complete_answer + event.content
-                yield ServerSentEvent(data=event.content).encode()
+        engine = AgentEngine(thread.agent, user_id)
+        async with loaded_tools:
+            answer_stream = engine.answer([*thread_messages, message], message_usage, stop_event, loaded_tools)
+            async for event in answer_stream:
+                if thread_name_task and thread_name_task.done():
+                    thread_name_event = _build_thread_name_event(thread_name_task)
+                    if thread_name_event:
+                        yield thread_name_event
+                    thread_name_task = None
+                if isinstance(event, AgentActionEvent):
+                    payload = json.dumps(event.model_dump(mode="json", by_alias=True))
+                    yield ServerSentEvent(event="status", data=payload)
+                elif isinstance(event, AgentFileEvent):
+                    files.append(event.file)
+                elif isinstance(event, AgentMessageEvent):
+                    complete_answer = complete_answer + event.content
+                    yield ServerSentEvent(data=event.content)
+                    if time.monotonic() - last_checkpoint >= ANSWER_CHECKPOINT_SECONDS:
+                        answer = await _checkpoint_answer(answer, complete_answer, message, db_factory)
+                        last_checkpoint = time.monotonic()
+                else:
+                    raise RuntimeError(f"Unsupported event type: {type(event)}")
+        if thread_name_task:
+            await asyncio.wait([thread_name_task])
+            thread_name_event = _build_thread_name_event(thread_name_task)
+            if thread_name_event:
+                yield thread_name_event
+            thread_name_task = None
+
+        skip_estimation = stop_event.is_set() or is_in_agent_edition
+        is_new_answer = answer is None
+        answer = answer or ThreadMessage(thread_id=thread.id, origin=ThreadMessageOrigin.AGENT, parent_id=message.id)
+        answer.text = complete_answer
+        answer.minutes_saved = 0 if skip_estimation else None
+        answer.stopped = stop_event.is_set()
+        await asyncio.to_thread(engine.count_tokens, answer)
+        async with db_factory() as db:
+            if is_new_answer:
+                answer = await ThreadMessageRepository(db).add(answer)
             else:
-                raise RuntimeError(f"Unsupported event type: {type(event)}")
-
-        if stop_event.is_set() or is_in_agent_edition:
-            minutes_saved = 0
-        else:
-            minutes_saved = await estimate_minutes_saved(
-                user_message=message.text,
-                agent_response=complete_answer,
-                thread=thread,
-                thread_messages=thread_messages,
-                message_usage=message_usage,
-                db=db
-            )
-
-        answer = await repo.add(ThreadMessage(
-            thread_id=thread.id,
-            text=complete_answer,
-            origin=ThreadMessageOrigin.AGENT,
-            parent_id=message.id,
-            minutes_saved=minutes_saved,
-            stopped=stop_event.is_set()
-        ))
-        for f in files:
-            await ThreadMessageFileRepository(db).add(ThreadMessageFile(thread_message_id=answer.id, file_id=f.id))
+                await ThreadMessageRepository(db).update(answer)
+            for f in files:
+                await ThreadMessageFileRepository(db).add(ThreadMessageFile(thread_message_id=answer.id, file_id=f.id))
+        if not skip_estimation:
+            minutes_saved_estimation = minutes_saved_estimator.submit(answer, message.text, thread, thread_messages, user_id, db_factory)
         
         yield ServerSentEvent(event="metadata", data=json.dumps({
             "answerMessageId": answer.id,
             "files": [f.model_dump(mode="json", by_alias=True) for f in files],
             "minutesSaved": answer.minutes_saved,
             "stopped": answer.stopped
-        })).encode()
+        }))
     except Exception:
         logger.exception("Problem answering message")
-        yield ServerSentEvent(event="error").encode()
+        yield ServerSentEvent(event="error")
     finally:
-        await UsageRepository(db).add(message_usage)
-        del active_streaming_connections[thread.id]
+        # tools are released after answering, but also if answering failed before
+        await loaded_tools.aclose()
+        if thread_name_task:
+            # we still wait for the name to be stored and its usage registered
+            await asyncio.wait([thread_name_task])
+        async with db_factory() as db:
+            await UsageRepository(db).add(message_usage)
+        if stop_event:
+            await stream_registry.unregister(thread.id, stop_event)
+
+    if minutes_saved_estimation:
+        # the answer is already stored and acknowledged, so we just push the estimation to the client when available.
+        # Shield avoids cancelling the estimation (which is stored anyway) if the client disconnects
+        try:
+            minutes_saved = await asyncio.shield(minutes_saved_estimation)
+        except Exception:
+            return
+        yield ServerSentEvent(event="minutesSaved", data=json.dumps({
+            "answerMessageId": answer.id,
+            "minutesSaved": minutes_saved
+        }))
+
+
+# partial answers are stored as stopped so they are kept, and shown as such, if the process dies while answering
+async def _checkpoint_answer(answer: Optional[ThreadMessage], text: str, message: ThreadMessage, db_factory: DbSessionFactory) \
+        -> ThreadMessage:
+    async with db_factory() as db:
+        repo = ThreadMessageRepository(db)
+        if answer is None:
+            return await repo.add(ThreadMessage(thread_id=message.thread_id, text=text, origin=ThreadMessageOrigin.AGENT,
+                parent_id=message.id, minutes_saved=0, stopped=True))
+        answer.text = text
+        await repo.update(answer)
+        return answer
+
+
+async def _update_thread_name(thread: Thread, first_message: str, message_usage: MessageUsage, db_factory: DbSessionFactory) -> str:
+    thread.name = await build_thread_name(first_message, message_usage, db_factory)
+    async with db_factory() as db:
+        await ThreadRepository(db).update(thread)
+    return thread.name
+
+
+def _build_thread_name_event(thread_name_task: asyncio.Task[str]) -> Optional[ServerSentEvent]:
+    try:
+        return ServerSentEvent(event="threadName", data=json.dumps({"name": thread_name_task.result()}))
+    except Exception:
+        # a failure generating the name should not affect the answer
+        logger.exception("Problem generating thread name")
+        return None
+
+
+@router.get(f"{THREAD_PATH}/answer-stream")
+async def resume_answer_stream(thread_id: int, user: Annotated[User, Depends(get_current_user)],
+                               db: Annotated[AsyncSession, Depends(get_db)],
+                               last_event_id: Annotated[Optional[int], Header()] = None) -> StreamingResponse:
+    await _find_thread(thread_id, user.id, db)
+    stream = answer_streams.find(thread_id)
+    if not stream:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return StreamingResponse(stream.subscribe(last_event_id), media_type="text/event-stream")
 
 
 @router.post(THREAD_PATH + "/stop", status_code=status.HTTP_200_OK)
 async def stop_message(thread_id: int,
                       user: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
-    stop_event = active_streaming_connections.get(thread_id)
-    if stop_event:
-        stop_event.set()
-    else:
+    await _find_thread(thread_id, user.id, db)
+    if not await stream_registry.stop(thread_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
 
@@ -306,7 +389,8 @@ THREAD_MESSAGE_PATH = f"{THREAD_PATH}/messages/{{message_id}}"
 
 @router.put(THREAD_MESSAGE_PATH)
 async def update_message(thread_id: int, message_id: int, updated_message: ThreadMessageUpdate,
-                      user: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
+                      user: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)],
+                      db_factory: Annotated[DbSessionFactory, Depends(get_db_factory)]):
     thread = await _find_thread(thread_id, user.id, db)
     thread_message = await _find_thread_message(message_id, db)
     has_positive_feedback = thread_message.has_positive_feedback
@@ -323,7 +407,7 @@ async def update_message(thread_id: int, message_id: int, updated_message: Threa
                 thread=thread,
                 thread_messages=await thread_message_repo.find_previous_messages(parent_message),
                 message_usage=message_usage,
-                db=db
+                db_factory=db_factory
             )
             await UsageRepository(db).add(message_usage)
         thread_message.minutes_saved = minutes_saved
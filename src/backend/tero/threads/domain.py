@@ -3,7 +3,7 @@ from datetime import datetime, timezone
 from enum import Enum
 from typing import Any, Optional, List, Union
 
-from sqlalchemy import Column, Text
+from sqlalchemy import Column, Text, JSON
 from sqlmodel import SQLModel, Field, Relationship, Index
 
 from ..agents.domain import Agent, AgentListItem
@@ -88,6 +88,8 @@ class ThreadMessage(CamelCaseModel, table=True):
     minutes_saved: Optional[int] = None
     feedback_text: Optional[str] = None
     has_positive_feedback: Optional[bool] = None
+    # tokens of the message as sent to the LLM (including attached files) by tokenizer family, computed when the message is stored
+    token_counts: Optional[dict[str, int]] = Field(default=None, sa_column=Column(JSON), exclude=True)
     
     files: List["ThreadMessageFile"] = Relationship(back_populates="thread_message")
 
@@ -95,6 +97,10 @@ class ThreadMessage(CamelCaseModel, table=True):
         update_dict = update.model_dump()
         self.sqlmodel_update(update_dict)
 
+    def set_token_count(self, tokenizer_family: str, tokens: int):
+        # a new dict is assigned so sqlalchemy detects the change in the json column
+        self.token_counts = {**(self.token_counts or {}), tokenizer_family: tokens}
+
 
 class ThreadMessageFile(CamelCaseModel, table=True):
     __tablename__ : Any = "thread_message_file"
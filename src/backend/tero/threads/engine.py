@@ -1,11 +1,17 @@
 import asyncio
 import base64
+from collections import OrderedDict
 from collections.abc import AsyncIterator
-from contextlib import AsyncExitStack
+import copy
 from datetime import datetime, timezone
+from functools import partial
 import json
-from typing import Callable, List, Any, cast, Optional
+import logging
+import time
+from typing import Callable, List, Any, cast, Optional, Hashable
+from uuid import UUID
 
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import (
     HumanMessage,
@@ -20,21 +26,30 @@ from langchain_core.messages.utils import (
     _first_max_tokens,
 )
 from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool, BaseTool
-from langgraph.prebuilt import create_react_agent
+from langgraph.graph.graph import CompiledGraph
+from langgraph.prebuilt import create_react_agent, ToolNode
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ..agents.domain import Agent
+from ..agents.domain import Agent, AgentToolConfig
 from ..agents.repos import AgentToolConfigRepository
 from ..ai_models import ai_factory
 from ..ai_models.repos import AiModelRepository
+from ..ai_models.token_counter import MessageTokenCounter
 from ..core.env import env
+from ..core.metrics import Histogram
+from ..core.repos import DbSessionFactory
 from ..usage.domain import MessageUsage
 from ..tools.core import AgentTool, AgentToolMetadata
 from ..tools.repos import ToolRepository
 from .domain import ThreadMessage, ThreadMessageOrigin, MAX_THREAD_NAME_LENGTH, AgentEvent, AgentActionEvent, AgentFileEvent, AgentMessageEvent, AgentAction
 
 
+logger = logging.getLogger(__name__)
+tool_duration = Histogram("tero_tool_duration_seconds", "Time of tool executions by agent tool id", ["tool", "status"])
+
+
 # adding this tool because we are going to add more tools in the future and right now
 # is easier to add a lame tool and make it work with it than without any tools
 @tool
@@ -43,84 +58,238 @@ def clock() -> str:
     return f"{datetime.now(timezone.utc)}."
 
 
+_TOOLS_CONFIG_KEY = "tero_tools"
+_TOKEN_COUNTER_CONFIG_KEY = "tero_token_counter"
+
+
+# tools in compiled graphs are bound to the request that built the graph, so this node only uses them for their schemas
+# and invokes the tools of the current request, provided in the run configuration.
+# ToolNode provides no public way to replace its tools per run, so this overrides its private _afunc, which is stable in
+# the pinned langgraph-prebuilt version (test_request_tool_node_overrides_tool_node_afunc fails if its signature changes)
+class _RequestToolNode(ToolNode):
+
+    async def _afunc(self, input: Any, config: RunnableConfig, *, store: Any) -> Any:
+        node = copy.copy(self)
+        node.tools_by_name = config["configurable"][_TOOLS_CONFIG_KEY]
+        return await ToolNode._afunc(node, input, config, store=store)
+
+
+# observes tool executions, identifying each langchain tool by the agent tool providing it. It runs inline, instead of
+# being dispatched to a thread, since it just records times
+class _ToolMetricsCallbackHandler(BaseCallbackHandler):
+    run_inline = True
+    ignore_llm = True
+    ignore_chat_model = True
+    ignore_chain = True
+    ignore_agent = True
+    ignore_retriever = True
+
+    def __init__(self, tool_ids: dict[str, str]):
+        self._tool_ids = tool_ids
+        self._starts: dict[UUID, tuple[float, str]] = {}
+
+    def on_tool_start(self, serialized: dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = serialized.get("name", "")
+        self._starts[run_id] = (time.perf_counter(), self._tool_ids.get(name, name))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "success")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "error")
+
+    def _finish(self, run_id: UUID, status: str):
+        started = self._starts.pop(run_id, None)
+        if started:
+            start, tool_id = started
+            tool_duration.observe(time.perf_counter() - start, tool=tool_id, status=status)
+
+
+class AgentGraph:
+
+    def __init__(self, graph: CompiledGraph, tools_tokens: int):
+        self.graph = graph
+        self.tools_tokens = tools_tokens
+
+
+# Keeps compiled graphs of recently used agent configurations, so messages don't need to build the graph and convert
+# tools to count their tokens again
+class AgentGraphCache:
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._graphs: OrderedDict[Hashable, AgentGraph] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[AgentGraph]:
+        ret = self._graphs.get(key)
+        if ret:
+            self._graphs.move_to_end(key)
+        return ret
+
+    def put(self, key: Hashable, graph: AgentGraph):
+        self._graphs[key] = graph
+        self._graphs.move_to_end(key)
+        while len(self._graphs) > self._max_size:
+            self._graphs.popitem(last=False)
+
+    def clear(self):
+        self._graphs.clear()
+
+    def __len__(self) -> int:
+        return len(self._graphs)
+
+
+agent_graph_cache = AgentGraphCache(env.agent_graph_cache_size)
+
+
+# Loads agent tools concurrently, each one in its own task and db session (sessions don't support concurrent operations).
+# Tool contexts (eg: MCP sessions) need to be entered and exited in the same task, so each task keeps its tool loaded
+# until tools are released. This allows loading tools while handling a request and then using them to stream the answer.
+class LoadedTools:
+
+    def __init__(self):
+        self.tools: List[AgentTool] = []
+        # agent tool id of each langchain tool, available after building langchain tools
+        self.tool_ids: dict[str, str] = {}
+        self._sessions: List[AsyncSession] = []
+        self._release = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def load(self, build_tool: Callable[[AsyncSession], AgentTool], db_factory: DbSessionFactory) -> AgentTool:
+        loaded: asyncio.Future[AgentTool] = asyncio.get_running_loop().create_future()
+        self._tasks.append(asyncio.create_task(self._hold(build_tool, db_factory, loaded)))
+        return await loaded
+
+    async def _hold(self, build_tool: Callable[[AsyncSession], AgentTool], db_factory: DbSessionFactory,
+                    loaded: asyncio.Future[AgentTool]):
+        try:
+            async with db_factory() as db:
+                async with build_tool(db).load() as tool:
+                    # connection is returned to the pool until tools are used
+                    await db.commit()
+                    self._sessions.append(db)
+                    if not loaded.done():
+                        loaded.set_result(tool)
+                    await self._release.wait()
+        except asyncio.CancelledError:
+            loaded.cancel()
+            raise
+        except Exception as e:
+            if not loaded.done():
+                loaded.set_exception(e)
+            else:
+                logger.exception("Problem releasing tool")
+
+    async def build_langchain_tools(self) -> List[BaseTool]:
+        tools = await asyncio.gather(*[t.build_langchain_tools() for t in self.tools])
+        self.tool_ids = {lt.name: t.id for t, lts in zip(self.tools, tools) for lt in lts}
+        ret = [lt for lts in tools for lt in lts]
+        # end the transactions opened while loading tools so no connection is held while waiting for the model
+        for db in self._sessions:
+            await db.commit()
+        return ret
+
+    async def aclose(self):
+        self._release.set()
+        await asyncio.gather(*self._tasks)
+
+    async def __aenter__(self) -> 'LoadedTools':
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+
 class AgentEngine:
     _MEMORY_INPUT_KEY = "input"
+    _SYSTEM_MESSAGE_ID = "system"
 
-    def __init__(self, agent: Agent, user_id: int, db: AsyncSession):
+    def __init__(self, agent: Agent, user_id: int):
         self._agent = agent
         self._user_id = user_id
-        self._db = db
+        # built when answering (or counting tokens) and reused to count tokens of following messages
+        self._token_counter: Optional[MessageTokenCounter] = None
 
-    async def load_tools(self, stack: AsyncExitStack, thread_id: Optional[int] = None) -> List[AgentTool]:
-        tool_configs = await AgentToolConfigRepository(self._db).find_by_agent_id(
-            agent_id=self._agent.id
-        )
-        ret = []
-        for tc in tool_configs:
-            agent_tool = ToolRepository().find_by_id(tc.tool_id)
-            if not agent_tool:
-                raise ValueError(f"Tool {tc.tool_id} not found")
-            agent_tool.configure(self._agent, self._user_id, tc.config, self._db, thread_id=thread_id)
-            tool = await stack.enter_async_context(agent_tool.load())
-            ret.append(tool)
+    async def load_tools(self, db_factory: DbSessionFactory, thread_id: Optional[int] = None) -> LoadedTools:
+        async with db_factory() as db:
+            tool_configs = await AgentToolConfigRepository(db).find_by_agent_id(
+                agent_id=self._agent.id
+            )
+        ret = LoadedTools()
+        try:
+            ret.tools = list(await asyncio.gather(*[ret.load(partial(self._build_tool, tc, thread_id), db_factory) for tc in tool_configs]))
+        except BaseException:
+            await ret.aclose()
+            raise
         return ret
-    
-    async def answer(self, messages: List[ThreadMessage], message_usage: MessageUsage, stop_event: asyncio.Event) -> AsyncIterator[AgentEvent]:
+
+    def _build_tool(self, tool_config: AgentToolConfig, thread_id: Optional[int], db: AsyncSession) -> AgentTool:
+        ret = ToolRepository().find_by_id(tool_config.tool_id)
+        if not ret:
+            raise ValueError(f"Tool {tool_config.tool_id} not found")
+        ret.configure(self._agent, self._user_id, tool_config.config, db, thread_id=thread_id)
+        return ret
+
+    async def answer(self, messages: List[ThreadMessage], message_usage: MessageUsage, stop_event: asyncio.Event,
+                     loaded_tools: LoadedTools) -> AsyncIterator[AgentEvent]:
         llm = ai_factory.build_streaming_chat_model(self._agent.model.id, self._agent.model_temperature,  self._agent.model_reasoning_effort)
-        async with AsyncExitStack() as stack:
-            agent_tools = await self.load_tools(stack, thread_id=messages[0].thread_id)
-            tools = [ lt for t in agent_tools for lt in await t.build_langchain_tools() ]
-            tools.append(clock)
-            agent = create_react_agent(
-                llm, tools, pre_model_hook=self._build_message_trimmer(llm, tools)
-            )
+        agent_tools = loaded_tools.tools
+        tools = await loaded_tools.build_langchain_tools()
+        tools.append(clock)
+        token_counter = self._token_counter = MessageTokenCounter(llm)
+        input = self._build_input(messages, token_counter)
+        agent_graph = self._get_agent_graph(llm, agent_tools, tools)
 
-            input = self._build_input(messages)
-            generated_content = ""
-            stream = agent.astream(
-                input,
-                {
-                    # multiply by 2 and add 1 because recursion counts every event (find tool & call tool)
-                    "recursion_limit": 20 * 2 + 1
+        generated_content = ""
+        stream = agent_graph.graph.astream(
+            input,
+            {
+                # multiply by 2 and add 1 because recursion counts every event (find tool & call tool)
+                "recursion_limit": 20 * 2 + 1,
+                "callbacks": [_ToolMetricsCallbackHandler(loaded_tools.tool_ids)],
+                "configurable": {
+                    _TOOLS_CONFIG_KEY: {t.name: t for t in tools},
+                    _TOKEN_COUNTER_CONFIG_KEY: token_counter,
                 },
-                stream_mode=["updates", "messages", "custom"],
-            )
-            async for mode, content in stream:
-                if stop_event.is_set():
-                    break
-                if mode == "updates":
-                    async for status_update in self._process_updates(content):
-                        yield status_update
-                elif mode == "custom":
-                    yield cast(AgentActionEvent, content)
-                elif mode == "messages":
-                    msg, metadata = content
-                    metadata = cast(dict, metadata)
-                    # we need to filter AI messages since AI messages from tools are also returned
-                    if ((isinstance(msg, AIMessage) and metadata.get("langgraph_node") != "tools") \
-                        or (isinstance(msg, ToolMessage) and msg.response_metadata.get("return_direct"))) \
-                        and msg.content:
-                        content = self._get_content(msg.content)
-                        generated_content += content
-                        yield AgentMessageEvent(content=content)
-                    if isinstance(msg, AIMessage):
-                        message_usage.increment_with_metadata(msg.usage_metadata, self._agent.model)
-                    elif isinstance(msg, ToolMessage):
-                        agent_tool_metadata = AgentToolMetadata.model_validate(msg.response_metadata)
-                        message_usage.increment_tool_usage(agent_tool_metadata.tool_usage)
-                        if agent_tool_metadata.file:
-                            yield AgentFileEvent(file=agent_tool_metadata.file)
-            
-            # If the response was stopped, approximate the token usage
+            },
+            stream_mode=["updates", "messages", "custom"],
+        )
+        async for mode, content in stream:
             if stop_event.is_set():
-                approximate_input_tokens = llm.get_num_tokens_from_messages(input["messages"]) + self._count_tools_tokens(tools, llm)
-                approximate_output_tokens = llm.get_num_tokens(generated_content) if generated_content else 0
-                message_usage.increment_with_metadata(
-                    {
-                        "input_tokens": approximate_input_tokens,
-                        "output_tokens": approximate_output_tokens,
-                        "total_tokens": approximate_input_tokens + approximate_output_tokens
-                    }, self._agent.model)
+                break
+            if mode == "updates":
+                async for status_update in self._process_updates(content):
+                    yield status_update
+            elif mode == "custom":
+                yield cast(AgentActionEvent, content)
+            elif mode == "messages":
+                msg, metadata = content
+                metadata = cast(dict, metadata)
+                # we need to filter AI messages since AI messages from tools are also returned
+                if ((isinstance(msg, AIMessage) and metadata.get("langgraph_node") != "tools") \
+                    or (isinstance(msg, ToolMessage) and msg.response_metadata.get("return_direct"))) \
+                    and msg.content:
+                    content = self._get_content(msg.content)
+                    generated_content += content
+                    yield AgentMessageEvent(content=content)
+                if isinstance(msg, AIMessage):
+                    message_usage.increment_with_metadata(msg.usage_metadata, self._agent.model)
+                elif isinstance(msg, ToolMessage):
+                    agent_tool_metadata = AgentToolMetadata.model_validate(msg.response_metadata)
+                    message_usage.increment_tool_usage(agent_tool_metadata.tool_usage)
+                    if agent_tool_metadata.file:
+                        yield AgentFileEvent(file=agent_tool_metadata.file)
+        
+        # If the response was stopped, approximate the token usage
+        if stop_event.is_set():
+            approximate_input_tokens = token_counter(input["messages"]) + agent_graph.tools_tokens
+            approximate_output_tokens = llm.get_num_tokens(generated_content) if generated_content else 0
+            message_usage.increment_with_metadata(
+                {
+                    "input_tokens": approximate_input_tokens,
+                    "output_tokens": approximate_output_tokens,
+                    "total_tokens": approximate_input_tokens + approximate_output_tokens
+                }, self._agent.model)
     
     def _get_content(self, msg: str | list[str | dict]) -> str:
         if isinstance(msg, str):
@@ -165,18 +334,46 @@ class AgentEngine:
                     result.append(tool_calls["name"])
                 yield AgentActionEvent(action=AgentAction.PLANNING, result=result)
 
-    def _build_message_trimmer(
-        self, llm: BaseChatModel, tools: List[BaseTool]
-    ) -> Callable[[Any], Any]:
-        def pre_model_hook(state):
+    def _get_agent_graph(self, llm: BaseChatModel, agent_tools: List[AgentTool], tools: List[BaseTool]) -> AgentGraph:
+        model = self._agent.model
+        # last update changes with any change to the agent, but tool configs and models are updated independently
+        key = (
+            self._agent.id,
+            self._agent.last_update,
+            model.id,
+            model.token_limit,
+            model.output_token_limit,
+            self._agent.model_temperature,
+            self._agent.model_reasoning_effort,
+            # tools names, descriptions and arguments are bound to the llm in the graph, and some tools may change them without
+            # changing their config (eg: docs tool description is updated with uploaded files, mcp servers may change their
+            # tools). Tools provide a cheap version instead of converting their schemas on every message
+            tuple((t.id, json.dumps(t.config, sort_keys=True, default=str), t.get_langchain_tools_version()) for t in agent_tools),
+        )
+        ret = agent_graph_cache.get(key)
+        if not ret:
+            tools_tokens = self._count_tools_tokens(self._build_tools_json(tools), llm)
+            graph = create_react_agent(
+                llm, _RequestToolNode(tools),
+                pre_model_hook=self._build_message_trimmer(model.token_limit, model.output_token_limit, tools_tokens)
+            )
+            ret = AgentGraph(graph, tools_tokens)
+            agent_graph_cache.put(key, ret)
+        return ret
+
+    # the trimmer is part of cached graphs, so it must not reference the engine, which is bound to a request
+    @staticmethod
+    def _build_message_trimmer(model_token_limit: int, output_token_limit: int, tools_tokens: int) -> Callable[[Any, RunnableConfig], Any]:
+        def pre_model_hook(state, config: RunnableConfig):
             # this is mostly the same logic (but simplified) as invoking langchain trim_messages with last strategy and allow partial
             # , but if a message is too big to fit, instead of returning the last part, we return the first part of the message.
             # This way, we keep the first part of the message that we consider should be more relevan.
             # For example, if user sends text and files, then text is kept, first files are kept, and the first part of the last file that fits is kept as well.
+            # Token counts of messages are cached (and seeded with the ones stored in thread messages), so each step only tokenizes new or partial messages.
+            token_counter: MessageTokenCounter = config["configurable"][_TOKEN_COUNTER_CONFIG_KEY]
             messages = state["messages"]
             system_message = messages[0]
             messages = messages[1:]
-            token_counter = llm.get_num_tokens_from_messages
 
             # Reverse messages to use _first_max_tokens with reversed logic
             messages = messages[::-1]
@@ -188,12 +385,7 @@ class AgentEngine:
             )
             messages = messages[end_index:]
 
-            model_token_limit = self._agent.model.token_limit
-            tools_tokens = self._count_tools_tokens(tools, llm)
             system_message_tokens = token_counter([system_message])
-            output_token_limit = (
-                self._agent.model.output_token_limit
-            )  # needed to reserve space for larger responses
 
             result = _first_max_tokens(
                 messages,
@@ -202,6 +394,7 @@ class AgentEngine:
                     model_token_limit
                     - tools_tokens
                     - system_message_tokens
+                    # needed to reserve space for larger responses
                     - output_token_limit,
                 ),
                 token_counter=token_counter,
@@ -214,53 +407,73 @@ class AgentEngine:
 
         return pre_model_hook
 
-    def _count_tools_tokens(self, tools: List[BaseTool], llm: BaseChatModel) -> int:
-        openai_tools = [convert_to_openai_tool(tool) for tool in tools]
-        tools_json = json.dumps(openai_tools)
+    @staticmethod
+    def _build_tools_json(tools: List[BaseTool]) -> str:
+        return json.dumps([convert_to_openai_tool(tool) for tool in tools])
+
+    def _count_tools_tokens(self, tools_json: str, llm: BaseChatModel) -> int:
         return llm.get_num_tokens(tools_json)
 
-    def _build_input(self, messages: List[ThreadMessage]) -> Any:
-        messages_list: List[BaseMessage] = [SystemMessage(self._agent.system_prompt)]
+    # tokenizes the whole message (including the processed content of attached files), so it should be run in a thread to
+    # not block the event loop
+    def count_tokens(self, message: ThreadMessage):
+        if not self._token_counter:
+            self._token_counter = MessageTokenCounter(ai_factory.build_chat_model(self._agent.model.id))
+        token_counter = self._token_counter
+        message.set_token_count(token_counter.tokenizer_family, token_counter.count_message(self._build_message(message)))
+
+    def _build_input(self, messages: List[ThreadMessage], token_counter: MessageTokenCounter) -> Any:
+        messages_list: List[BaseMessage] = [SystemMessage(self._agent.system_prompt, id=self._SYSTEM_MESSAGE_ID)]
         for message in messages:
-            if message.origin == ThreadMessageOrigin.USER:
-                content = []
-                message_text = message.text
-
-                for file_obj in message.files:
-                    # svg files should be treated as text
-                    if file_obj.file.content_type.startswith("image/") and not file_obj.file.name.lower().endswith('.svg'):
-                        content.append(
-                            {
-                                "type": "image",
-                                "source_type": "base64",
-                                "mime_type": file_obj.file.content_type,
-                                "data": base64.b64encode(file_obj.file.content).decode(
-                                    "utf-8"
-                                ),
-                            }
-                        )
-                    else:
-                        message_text = (
-                            message_text
-                            + "\n\n File named: "
-                            + file_obj.file.name
-                            + "\n\n"
-                            + file_obj.file.processed_content
-                            if file_obj.file.processed_content
-                            else ""
-                        )
-
-                if message_text.strip():
-                    content.append({"type": "text", "text": message_text})
-
-                messages_list.append(HumanMessage(content=content))
-            else:
-                messages_list.append(AIMessage(message.text))
+            built_message = self._build_message(message)
+            stored_tokens = (message.token_counts or {}).get(token_counter.tokenizer_family)
+            if stored_tokens is not None:
+                token_counter.seed(built_message, stored_tokens)
+            messages_list.append(built_message)
         return {"messages": messages_list}
 
+    def _build_message(self, message: ThreadMessage) -> BaseMessage:
+        # messages are identified with thread message ids so their token counts can be reused while trimming
+        message_id = str(message.id) if message.id else None
+        if message.origin == ThreadMessageOrigin.USER:
+            content = []
+            message_text = message.text
+
+            for file_obj in message.files:
+                # svg files should be treated as text
+                if file_obj.file.content_type.startswith("image/") and not file_obj.file.name.lower().endswith('.svg'):
+                    content.append(
+                        {
+                            "type": "image",
+                            "source_type": "base64",
+                            "mime_type": file_obj.file.content_type,
+                            "data": base64.b64encode(file_obj.file.content).decode(
+                                "utf-8"
+                            ),
+                        }
+                    )
+                else:
+                    message_text = (
+                        message_text
+                        + "\n\n File named: "
+                        + file_obj.file.name
+                        + "\n\n"
+                        + file_obj.file.processed_content
+                        if file_obj.file.processed_content
+                        else ""
+                    )
+
+            if message_text.strip():
+                content.append({"type": "text", "text": message_text})
+
+            return HumanMessage(content=content, id=message_id)
+        else:
+            return AIMessage(message.text, id=message_id)
+
 
-async def build_thread_name(first_thread_message: str, message_usage: MessageUsage, db: AsyncSession) -> str:
-    model = await AiModelRepository(db).find_by_id(env.internal_generator_model)
+async def build_thread_name(first_thread_message: str, message_usage: MessageUsage, db_factory: DbSessionFactory) -> str:
+    async with db_factory() as db:
+        model = await AiModelRepository(db).find_by_id(env.internal_generator_model)
     if not model:
         raise ValueError("Internal generator model not found")
     llm = ai_factory.build_chat_model(model.id, env.internal_generator_temperature)
@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import Optional, List
 
 from sqlalchemy.orm import selectinload, aliased
-from sqlmodel import select, func, or_, and_, col, delete
+from sqlmodel import select, func, or_, and_, col, delete, literal, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ..agents.domain import Agent
@@ -122,6 +122,16 @@ class ThreadMessageRepository:
         self._db.add(thread_message)
         await self._db.commit()
 
+    async def update_minutes_saved(self, message_id: int, minutes_saved: int):
+        # we don't override minutes saved that may have been already set (eg: by user feedback)
+        stmt = (
+            update(ThreadMessage)
+            .where(and_(ThreadMessage.id == message_id, col(ThreadMessage.minutes_saved).is_(None)))
+            .values(minutes_saved=minutes_saved)
+        )
+        await self._db.exec(scalar(stmt))
+        await self._db.commit()
+
     async def find_by_thread_id(self, thread_id: int) -> List[ThreadMessage]:
         stmt = (
             select(ThreadMessage)
@@ -134,16 +144,26 @@ class ThreadMessageRepository:
         return list(ret.all())
 
     async def find_previous_messages(self, message: ThreadMessage) -> List[ThreadMessage]:
-        parents: List[ThreadMessage] = []
-        current = message
-        while current.parent_id is not None:
-            parent = await self.find_by_id(current.parent_id)
-            if parent is None:
-                break
-            parents.append(parent)
-            current = parent
-        parents.reverse()
-        return parents
+        if message.parent_id is None:
+            return []
+        # walk the whole branch of ancestors in one query instead of one query per parent
+        ancestors = (
+            select(col(ThreadMessage.id), col(ThreadMessage.parent_id), literal(1).label('depth'))
+            .where(ThreadMessage.id == message.parent_id)
+            .cte('ancestors', recursive=True))
+        parent_message = aliased(ThreadMessage)
+        ancestors = ancestors.union_all(
+            select(parent_message.id, parent_message.parent_id, ancestors.c.depth + 1)
+            .join(ancestors, and_(parent_message.id == ancestors.c.parent_id)))
+        stmt = (
+            select(ThreadMessage)
+            .join(ancestors, and_(ThreadMessage.id == ancestors.c.id))
+            .order_by(ancestors.c.depth.desc())
+            .options(
+                selectinload(attr(ThreadMessage.files)).selectinload(attr(ThreadMessageFile.file))
+            ))
+        ret = await self._db.exec(stmt)
+        return list(ret.all())
 
     async def find_by_id(self, message_id: int) -> Optional[ThreadMessage]:
         stmt = (
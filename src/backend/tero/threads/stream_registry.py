@@ -0,0 +1,210 @@
+from abc import ABC, abstractmethod
+import asyncio
+import logging
+from typing import Optional
+
+import psycopg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..core.env import env
+from ..core.repos import create_untracked_task, engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# keeps track of threads with an answer being streamed, so they can be stopped from any request. A thread may have several
+# answers being streamed (eg: regenerating an answer while the previous one is still being generated), and stopping the
+# thread stops all of them.
+class StreamRegistry(ABC):
+
+    def __init__(self):
+        self._stop_events: dict[int, list[asyncio.Event]] = {}
+
+    async def register(self, thread_id: int) -> asyncio.Event:
+        ret = asyncio.Event()
+        self._stop_events.setdefault(thread_id, []).append(ret)
+        return ret
+
+    async def unregister(self, thread_id: int, stop_event: asyncio.Event):
+        stop_events = self._stop_events.get(thread_id, [])
+        if stop_event in stop_events:
+            stop_events.remove(stop_event)
+        if not stop_events:
+            self._stop_events.pop(thread_id, None)
+
+    # returns False if there is no active stream for the given thread
+    async def stop(self, thread_id: int) -> bool:
+        if self._set_stop_events(thread_id):
+            return True
+        return await self._stop_remote(thread_id)
+
+    def _set_stop_events(self, thread_id: int) -> bool:
+        stop_events = self._stop_events.get(thread_id, [])
+        for stop_event in stop_events:
+            stop_event.set()
+        return bool(stop_events)
+
+    @abstractmethod
+    async def _stop_remote(self, thread_id: int) -> bool:
+        pass
+
+
+class InMemoryStreamRegistry(StreamRegistry):
+
+    async def _stop_remote(self, thread_id: int) -> bool:
+        return False
+
+
+# Shares active streams and stop signals among processes (and nodes) using the database.
+# Each process holds a session advisory lock per thread with active streams in a dedicated connection, so active streams can
+# be looked up from any process and are automatically released if the process dies. Stop signals are sent with NOTIFY and
+# received by every process listening in the channel.
+# Locks are only taken with pg_try_advisory_lock, since waiting for a lock held by another process (streaming an answer for
+# the same thread) would block every other registration in the process. In such case the process retries taking the lock
+# in background, and meanwhile the thread is still found as streaming through the other process lock.
+class PostgresStreamRegistry(StreamRegistry):
+    _CHANNEL = "tero_stream_stop"
+    # namespace for advisory locks to avoid collisions with any other advisory lock
+    _LOCK_CLASS_ID = 7315
+    _LOCK_RETRY_SECONDS = 1.0
+
+    def __init__(self, db_engine: AsyncEngine):
+        super().__init__()
+        self._engine = db_engine
+        self._conninfo = db_engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._lock_conn: Optional[psycopg.AsyncConnection] = None
+        self._lock_conn_lock = asyncio.Lock()
+        # session advisory locks are reentrant, so we keep track of the ones held to take and release each one only once
+        self._locked_threads: set[int] = set()
+        self._lock_retries: dict[int, asyncio.Task] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._listening = asyncio.Event()
+
+    async def register(self, thread_id: int) -> asyncio.Event:
+        await self._start_listener()
+        ret = await super().register(thread_id)
+        try:
+            if not await self._try_lock(thread_id):
+                self._retry_lock(thread_id)
+        except Exception:
+            # stream can still be stopped by requests reaching this process
+            logger.exception(f"Problem registering stream for thread {thread_id}")
+        return ret
+
+    async def unregister(self, thread_id: int, stop_event: asyncio.Event):
+        await super().unregister(thread_id, stop_event)
+        try:
+            await self._unlock(thread_id)
+        except Exception:
+            logger.exception(f"Problem unregistering stream for thread {thread_id}")
+
+    # returns False if the lock is held by another process
+    async def _try_lock(self, thread_id: int) -> bool:
+        async with self._lock_conn_lock:
+            if thread_id in self._locked_threads or thread_id not in self._stop_events:
+                return True
+            conn = await self._get_lock_conn()
+            # the lock may have been taken while reconnecting
+            if thread_id in self._locked_threads:
+                return True
+            return await self._try_lock_with_conn(conn, thread_id)
+
+    async def _try_lock_with_conn(self, conn: psycopg.AsyncConnection, thread_id: int) -> bool:
+        cursor = await conn.execute("SELECT pg_try_advisory_lock(%s, %s)", (self._LOCK_CLASS_ID, thread_id))
+        row = await cursor.fetchone()
+        ret = bool(row and row[0])
+        if ret:
+            self._locked_threads.add(thread_id)
+        return ret
+
+    async def _unlock(self, thread_id: int):
+        async with self._lock_conn_lock:
+            if thread_id not in self._locked_threads or thread_id in self._stop_events:
+                return
+            self._locked_threads.discard(thread_id)
+            if self._lock_conn is not None and not self._lock_conn.closed:
+                await self._lock_conn.execute("SELECT pg_advisory_unlock(%s, %s)", (self._LOCK_CLASS_ID, thread_id))
+
+    async def _get_lock_conn(self) -> psycopg.AsyncConnection:
+        if self._lock_conn is None or self._lock_conn.closed:
+            self._lock_conn = await psycopg.AsyncConnection.connect(self._conninfo, autocommit=True)
+            # locks are released when their connection is closed, so we take again the ones of active streams
+            self._locked_threads.clear()
+            for thread_id in list(self._stop_events):
+                if not await self._try_lock_with_conn(self._lock_conn, thread_id):
+                    self._retry_lock(thread_id)
+        return self._lock_conn
+
+    def _retry_lock(self, thread_id: int):
+        retry = self._lock_retries.get(thread_id)
+        if retry is None or retry.done():
+            self._lock_retries[thread_id] = create_untracked_task(self._retry_lock_until_taken(thread_id))
+
+    async def _retry_lock_until_taken(self, thread_id: int):
+        try:
+            while thread_id in self._stop_events:
+                await asyncio.sleep(self._LOCK_RETRY_SECONDS)
+                try:
+                    if await self._try_lock(thread_id):
+                        return
+                except Exception:
+                    logger.exception(f"Problem registering stream for thread {thread_id}")
+        finally:
+            self._lock_retries.pop(thread_id, None)
+
+    async def _stop_remote(self, thread_id: int) -> bool:
+        async with self._engine.connect() as conn:
+            # if the lock can be acquired, then no process is streaming an answer for the thread
+            acquired = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:class_id, :thread_id)"),
+                                           {"class_id": self._LOCK_CLASS_ID, "thread_id": thread_id})).scalar()
+            if acquired:
+                await conn.rollback()
+                return False
+            await conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self._CHANNEL, "payload": str(thread_id)})
+            await conn.commit()
+            return True
+
+    async def _start_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listening.clear()
+            self._listener = create_untracked_task(self._listen())
+        await self._listening.wait()
+
+    async def close(self):
+        tasks = [t for t in [self._listener, *self._lock_retries.values()] if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._listener = None
+        async with self._lock_conn_lock:
+            if self._lock_conn:
+                await self._lock_conn.close()
+                self._lock_conn = None
+            self._locked_threads.clear()
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self._conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self._CHANNEL}")
+                    self._listening.set()
+                    async for notify in conn.notifies():
+                        self._set_stop_events(int(notify.payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Problem listening for stream stop signals, retrying")
+                # avoids blocking streams while the database is not reachable
+                self._listening.set()
+                await asyncio.sleep(1)
+
+
+def _build_stream_registry() -> StreamRegistry:
+    if env.stream_registry == "postgres":
+        return PostgresStreamRegistry(engine)
+    return InMemoryStreamRegistry()
+
+
+stream_registry = _build_stream_registry()
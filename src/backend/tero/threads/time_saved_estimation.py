@@ -1,5 +1,7 @@
-from typing import List, cast
+import asyncio
 import logging
+import re
+from typing import Any, List, Optional, cast
 
 from langchain_core.messages import (
     SystemMessage,
@@ -7,50 +9,104 @@ from langchain_core.messages import (
     HumanMessage,
     BaseMessage,
 )
+from langchain_core.messages.ai import UsageMetadata
 from langchain_core.messages.utils import (
     _default_text_splitter,
     _first_max_tokens,
 )
-from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ..agents.domain import LlmTemperature
 from ..ai_models import ai_factory
 from ..ai_models.repos import AiModelRepository
 from ..ai_models.domain import LlmModel
+from ..ai_models.token_counter import MessageTokenCounter
 from ..threads.repos import ThreadMessageRepository
 from ..core.env import env
+from ..core.repos import DbSessionFactory, create_untracked_task
 from ..usage.domain import MessageUsage
+from ..usage.repos import UsageRepository
 from .domain import Thread, ThreadMessage, ThreadMessageOrigin
 
 logger = logging.getLogger(__name__)
 
 
-async def estimate_minutes_saved(user_message: str, agent_response: str, thread: Thread, thread_messages: List[ThreadMessage], message_usage: MessageUsage, db: AsyncSession) -> int:
-    thread_messages = thread_messages[-2:] if len(thread_messages) > 2 else thread_messages
-    internal_generator_model = cast(LlmModel, await AiModelRepository(db).find_by_id(env.internal_generator_model))
-    feedback_messages = await ThreadMessageRepository(db).find_feedback_messages(thread.agent_id, thread.user_id, limit=4)
-    llm = ai_factory.build_chat_model(env.internal_generator_model, LlmTemperature.PRECISE.get_float())
+async def estimate_minutes_saved(user_message: str, agent_response: str, thread: Thread, thread_messages: List[ThreadMessage], message_usage: MessageUsage, db_factory: DbSessionFactory) -> int:
+    ret = await _estimate_interactions_minutes_saved([MinutesSavedInteraction(user_message, agent_response, thread_messages)], thread, db_factory)
+    message_usage.increment_with_metadata(ret.usage_metadata, ret.model)
+    return ret.minutes_saved[0]
+
+
+class MinutesSavedInteraction:
+
+    def __init__(self, user_message: str, agent_response: str, thread_messages: List[ThreadMessage]):
+        self.user_message = user_message
+        self.agent_response = agent_response
+        self.thread_messages = thread_messages[-2:] if len(thread_messages) > 2 else thread_messages
+
+
+class _InteractionsEstimation:
+
+    def __init__(self, minutes_saved: List[int], usage_metadata: Optional[UsageMetadata], model: LlmModel):
+        self.minutes_saved = minutes_saved
+        self.usage_metadata = usage_metadata
+        self.model = model
 
-    messages = [
-        HumanMessage(content=user_message),
-        AIMessage(content=agent_response),
-    ] + [
-        HumanMessage(content=message.text) if message.origin == ThreadMessageOrigin.USER else AIMessage(content=message.text) 
-        for message in thread_messages
-    ] + [
-        HumanMessage(content=message.text) if message.origin == ThreadMessageOrigin.USER else AIMessage(content=message.text) 
-        for message in feedback_messages
-    ]
 
-    token_counter = llm.get_num_tokens_from_messages
+async def _estimate_interactions_minutes_saved(interactions: List[MinutesSavedInteraction], thread: Thread, db_factory: DbSessionFactory) -> _InteractionsEstimation:
+    async with db_factory() as db:
+        internal_generator_model = cast(LlmModel, await AiModelRepository(db).find_by_id(env.internal_generator_model))
+        feedback_messages = await ThreadMessageRepository(db).find_feedback_messages(thread.agent_id, thread.user_id, limit=4)
+    llm = ai_factory.build_chat_model(env.internal_generator_model, LlmTemperature.PRECISE.get_float())
+
+    token_counter = MessageTokenCounter(llm)
+    system_prompt_template = SYSTEM_PROMPT if len(interactions) == 1 else BATCH_SYSTEM_PROMPT
     max_tokens = max(
         0,
         # Leave some buffer for the agent name and description, and other fixed texts
         int(internal_generator_model.token_limit * 0.9)
-        - token_counter([AIMessage(SYSTEM_PROMPT)])
+        - token_counter([AIMessage(system_prompt_template)])
         - internal_generator_model.output_token_limit,
     )
-    trimmed_messages = _first_max_tokens(
+    feedback = [_build_message(message, token_counter) for message in feedback_messages]
+
+    if len(interactions) == 1:
+        interaction = interactions[0]
+        trimmed_messages = _trim_messages(_build_interaction_messages(interaction, token_counter) + feedback, max_tokens, token_counter)
+        system_prompt = SYSTEM_PROMPT.format(
+            agent_name=thread.agent.name, 
+            agent_description=thread.agent.description,
+            **_pop_interaction_fields(interaction, trimmed_messages),
+            reference_examples=_add_reference_examples(feedback_messages, trimmed_messages)
+        )
+    else:
+        # each interaction and the reference examples get the same share of the available tokens
+        share = max_tokens // (len(interactions) + 1)
+        system_prompt = BATCH_SYSTEM_PROMPT.format(
+            agent_name=thread.agent.name,
+            agent_description=thread.agent.description,
+            interactions_count=len(interactions),
+            reference_examples=_add_reference_examples(feedback_messages, _trim_messages(feedback, share, token_counter)),
+            interactions="\n".join(INTERACTION_TEMPLATE.format(
+                number=i + 1,
+                **_pop_interaction_fields(interaction, _trim_messages(_build_interaction_messages(interaction, token_counter), share, token_counter))
+            ) for i, interaction in enumerate(interactions))
+        )
+
+    response = await llm.ainvoke([SystemMessage(system_prompt)])
+    return _InteractionsEstimation(_parse_minutes_saved(response.content, len(interactions)), response.usage_metadata, internal_generator_model)
+
+
+def _build_interaction_messages(interaction: MinutesSavedInteraction, token_counter: MessageTokenCounter) -> List[BaseMessage]:
+    return [
+        HumanMessage(content=interaction.user_message),
+        AIMessage(content=interaction.agent_response),
+    ] + [
+        _build_message(message, token_counter) for message in interaction.thread_messages
+    ]
+
+
+def _trim_messages(messages: List[BaseMessage], max_tokens: int, token_counter: MessageTokenCounter) -> List[BaseMessage]:
+    return _first_max_tokens(
         messages,
         max_tokens=max_tokens,
         token_counter=token_counter,
@@ -58,24 +114,163 @@ async def estimate_minutes_saved(user_message: str, agent_response: str, thread:
         partial_strategy="first"
     )
 
-    system_prompt = SYSTEM_PROMPT.format(
-        agent_name=thread.agent.name, 
-        agent_description=thread.agent.description,
+
+def _pop_interaction_fields(interaction: MinutesSavedInteraction, trimmed_messages: List[BaseMessage]) -> dict[str, Any]:
+    return dict(
         user_message=trimmed_messages.pop(0).content if trimmed_messages else "[NO USER MESSAGE]", 
         agent_response=trimmed_messages.pop(0).content if trimmed_messages else "[NO AGENT RESPONSE]", 
-        previous_message=trimmed_messages.pop(0).content if trimmed_messages and thread_messages else "[NO PREVIOUS USER MESSAGE IN CONVERSATION]", 
-        previous_agent_response=trimmed_messages.pop(0).content if trimmed_messages and thread_messages else "[NO PREVIOUS AGENT RESPONSE IN CONVERSATION]",
-        reference_examples=_add_reference_examples(feedback_messages, trimmed_messages)
+        previous_message=trimmed_messages.pop(0).content if trimmed_messages and interaction.thread_messages else "[NO PREVIOUS USER MESSAGE IN CONVERSATION]", 
+        previous_agent_response=trimmed_messages.pop(0).content if trimmed_messages and interaction.thread_messages else "[NO PREVIOUS AGENT RESPONSE IN CONVERSATION]",
     )
 
-    response = await llm.ainvoke([SystemMessage(system_prompt)])
-    try:
-        return int(response.content.strip())
-    except ValueError:
-        logger.exception(f"Invalid int response from minutes saved estimation LLM: {response.content}")
-        return 0
-    finally:
-        message_usage.increment_with_metadata(response.usage_metadata, internal_generator_model)
+
+def _parse_minutes_saved(content: Any, count: int) -> List[int]:
+    if count == 1:
+        try:
+            return [int(content.strip())]
+        except ValueError:
+            logger.exception(f"Invalid int response from minutes saved estimation LLM: {content}")
+            return [0]
+    ret = [int(line) for line in re.findall(r"^\s*(\d+)\s*$", content, re.MULTILINE)]
+    if len(ret) != count:
+        raise ValueError(f"Expected {count} minutes saved values from estimation LLM but got: {content}")
+    return ret
+
+
+def _build_message(message: ThreadMessage, token_counter: MessageTokenCounter) -> BaseMessage:
+    if message.origin == ThreadMessageOrigin.USER:
+        # stored counts of user messages include attached files, so they can't be reused for just the message text
+        return HumanMessage(content=message.text)
+    ret = AIMessage(content=message.text, id=str(message.id))
+    stored_tokens = (message.token_counts or {}).get(token_counter.tokenizer_family)
+    if stored_tokens is not None:
+        token_counter.seed(ret, stored_tokens)
+    return ret
+
+
+class _EstimationRequest:
+
+    def __init__(self, answer_id: int, interaction: MinutesSavedInteraction, thread: Thread, message_usage: MessageUsage, db_factory: DbSessionFactory):
+        self.answer_id = answer_id
+        self.interaction = interaction
+        self.thread = thread
+        self.message_usage = message_usage
+        self.db_factory = db_factory
+        self.result: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+
+
+# Estimates minutes saved in background, so answers are persisted and acknowledged without waiting for the evaluator.
+# Requests submitted within a short window are processed together and the ones for the same agent and user are
+# evaluated with a single LLM call. Estimations are stored in the answer messages once available.
+class MinutesSavedEstimator:
+
+    def __init__(self, max_batch_size: int = 8, batch_window_seconds: float = 0.5):
+        self._max_batch_size = max_batch_size
+        self._batch_window_seconds = batch_window_seconds
+        self._queue: Optional[asyncio.Queue[_EstimationRequest]] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    def submit(self, answer: ThreadMessage, user_message: str, thread: Thread, thread_messages: List[ThreadMessage], user_id: int,
+               db_factory: DbSessionFactory) -> asyncio.Future[int]:
+        message_usage = MessageUsage(user_id=user_id, agent_id=thread.agent_id, model_id=env.internal_generator_model, message_id=answer.parent_id)
+        request = _EstimationRequest(cast(int, answer.id), MinutesSavedInteraction(user_message, answer.text, thread_messages), thread, message_usage, 
+                                     db_factory)
+        self._get_queue().put_nowait(request)
+        return request.result
+
+    def _get_queue(self) -> asyncio.Queue[_EstimationRequest]:
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = create_untracked_task(self._run(self._queue))
+        return self._queue
+
+    async def _run(self, queue: asyncio.Queue[_EstimationRequest]):
+        while True:
+            batch = await self._collect_batch(queue)
+            groups: dict[tuple[int, int], List[_EstimationRequest]] = {}
+            for request in batch:
+                groups.setdefault((request.thread.agent_id, request.thread.user_id), []).append(request)
+            await asyncio.gather(*[self._process_group(group) for group in groups.values()])
+            for _ in batch:
+                queue.task_done()
+
+    # queued estimations are only kept in memory, so this allows waiting for them before stopping the server
+    async def drain(self, timeout_seconds: float):
+        if self._queue is None or self._worker is None or self._worker.done() or self._loop is not asyncio.get_running_loop():
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Pending minutes saved estimations could not be completed before stopping (%d queued)", self._queue.qsize())
+
+    async def _collect_batch(self, queue: asyncio.Queue[_EstimationRequest]) -> List[_EstimationRequest]:
+        ret = [await queue.get()]
+        deadline = asyncio.get_running_loop().time() + self._batch_window_seconds
+        while len(ret) < self._max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                ret.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return ret
+
+    async def _process_group(self, requests: List[_EstimationRequest]):
+        try:
+            minutes_saved = await self._estimate_group(requests)
+            async with requests[0].db_factory() as db:
+                repo = ThreadMessageRepository(db)
+                for request, minutes in zip(requests, minutes_saved):
+                    await repo.update_minutes_saved(request.answer_id, minutes)
+                    await UsageRepository(db).add(request.message_usage)
+            for request, minutes in zip(requests, minutes_saved):
+                if not request.result.done():
+                    request.result.set_result(minutes)
+        except Exception as e:
+            logger.exception("Problem estimating minutes saved")
+            for request in requests:
+                if not request.result.done():
+                    request.result.set_exception(e)
+
+    async def _estimate_group(self, requests: List[_EstimationRequest]) -> List[int]:
+        if len(requests) > 1:
+            try:
+                estimation = await _estimate_interactions_minutes_saved([r.interaction for r in requests], requests[0].thread, 
+                                                                        requests[0].db_factory)
+                _split_usage(estimation, [r.message_usage for r in requests])
+                return estimation.minutes_saved
+            except ValueError:
+                logger.exception("Problem estimating minutes saved in batch, estimating each interaction individually")
+        ret = []
+        for request in requests:
+            estimation = await _estimate_interactions_minutes_saved([request.interaction], request.thread, request.db_factory)
+            request.message_usage.increment_with_metadata(estimation.usage_metadata, estimation.model)
+            ret.append(estimation.minutes_saved[0])
+        return ret
+
+
+def _split_usage(estimation: _InteractionsEstimation, message_usages: List[MessageUsage]):
+    if not estimation.usage_metadata:
+        return
+    count = len(message_usages)
+    for i, message_usage in enumerate(message_usages):
+        # the first usage gets any remainder so the total matches the actual usage
+        message_usage.increment_with_metadata(UsageMetadata(
+            input_tokens=estimation.usage_metadata["input_tokens"] // count + (estimation.usage_metadata["input_tokens"] % count if i == 0 else 0),
+            output_tokens=estimation.usage_metadata["output_tokens"] // count + (estimation.usage_metadata["output_tokens"] % count if i == 0 else 0),
+            total_tokens=estimation.usage_metadata["total_tokens"] // count + (estimation.usage_metadata["total_tokens"] % count if i == 0 else 0),
+        ), estimation.model)
+
+
+minutes_saved_estimator = MinutesSavedEstimator()
 
 
 def _add_reference_examples(feedback_thread_messages: List[ThreadMessage], feedback_trimmed_messages: List[BaseMessage]) -> str:
@@ -97,21 +292,7 @@ Minutes saved: {minutes_saved}""")
     return "\n".join(examples) if examples else "[NO REFERENCE EXAMPLES]"
 
 
-SYSTEM_PROMPT = """
-You are an evaluator determining the value of an AI assistant's response to the user.
-AI assistant name and description: {agent_name} - \"\"\"{agent_description}\"\"\"
-
-Return ONLY an integer number representing the minutes saved. It can be 0 or a positive number. No explanation, no punctuation, no other text.
-
----
-
-INSTRUCTIONS:
-- Reply with the exact number of minutes saved. 
-- Reply 0 only if the response is purely a greeting, confirmation, vague promise of help, or only a follow-up question with no actual work done.
-
----
-
-DEFINITION OF VALUE:
+_VALUE_GUIDE = """DEFINITION OF VALUE:
 A response provides value if it is useful, actionable, or directly usable, including but not limited to:
 - Specific solutions or troubleshooting steps
 - Multi-step guides or clear instructions
@@ -153,7 +334,24 @@ SCORING GUIDANCE:
 
 ---
 
-EVALUATION:
+"""
+
+
+SYSTEM_PROMPT = """
+You are an evaluator determining the value of an AI assistant's response to the user.
+AI assistant name and description: {agent_name} - \"\"\"{agent_description}\"\"\"
+
+Return ONLY an integer number representing the minutes saved. It can be 0 or a positive number. No explanation, no punctuation, no other text.
+
+---
+
+INSTRUCTIONS:
+- Reply with the exact number of minutes saved. 
+- Reply 0 only if the response is purely a greeting, confirmation, vague promise of help, or only a follow-up question with no actual work done.
+
+---
+
+""" + _VALUE_GUIDE + """EVALUATION:
 Only reply the exact number of minutes saved.
 Only return the minutes saved for the interaction shown in the "INTERACTION TO EVALUATE" section. Do not include context messages in your calculation.
 
@@ -174,4 +372,45 @@ Previous agent response: \"\"\"{previous_agent_response}\"\"\"
 INTERACTION TO EVALUATE (this is the only part to score):
 User message: \"\"\"{user_message}\"\"\"
 Agent response: \"\"\"{agent_response}\"\"\"
-"""
\ No newline at end of file
+"""
+
+
+BATCH_SYSTEM_PROMPT = """
+You are an evaluator determining the value of an AI assistant's responses to the user in several interactions.
+AI assistant name and description: {agent_name} - \"\"\"{agent_description}\"\"\"
+
+Return ONLY one integer number per line, representing the minutes saved in each interaction, in the same order as the interactions. Each number can be 0 or a positive number. No explanation, no punctuation, no other text.
+
+---
+
+INSTRUCTIONS:
+- Reply with the exact number of minutes saved for each interaction. 
+- Reply 0 for an interaction only if the response is purely a greeting, confirmation, vague promise of help, or only a follow-up question with no actual work done.
+
+---
+
+""" + _VALUE_GUIDE + """EVALUATION:
+Only reply the exact number of minutes saved for each interaction, one per line ({interactions_count} lines in total).
+Evaluate each interaction independently and only return the minutes saved for the user message and agent response of each interaction. Do not include context messages in your calculation.
+
+---
+
+REFERENCE EXAMPLES FROM REAL USERS:
+(These take precedence over all other instructions or scoring guidance. If the reference examples contradict the general rules, follow the reference examples)
+{reference_examples}
+
+---
+
+INTERACTIONS TO EVALUATE:
+{interactions}
+"""
+
+
+INTERACTION_TEMPLATE = """
+Interaction {number}:
+Conversation context (for reference only — do not count toward minutes saved):
+Previous user message: \"\"\"{previous_message}\"\"\"
+Previous agent response: \"\"\"{previous_agent_response}\"\"\"
+User message to evaluate: \"\"\"{user_message}\"\"\"
+Agent response to evaluate: \"\"\"{agent_response}\"\"\"
+"""
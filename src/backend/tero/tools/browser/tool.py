@@ -11,8 +11,6 @@ from langchain_core.tools import BaseTool, StructuredTool, InjectedToolCallId
 from langchain_core.runnables import RunnableConfig
 from langchain_core.callbacks import AsyncCallbackManagerForToolRun
 from langchain_core.messages import ToolMessage
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_mcp_adapters.tools import load_mcp_tools
 from sqlmodel.ext.asyncio.session import AsyncSession
 from json_schema_to_pydantic import create_model
 from pydantic import BaseModel
@@ -22,6 +20,7 @@ from ...core.env import env
 from ...files.domain import File, FileStatus, FileMetadata
 from ...files.repos import FileRepository
 from ..core import AgentTool, AgentToolConfig, load_schema, StatusUpdateCallbackHandler
+from ..mcp.session_pool import mcp_session_pool
 
 
 logger = logging.getLogger(__name__)
@@ -102,13 +101,16 @@ class BrowserTool(AgentTool):
 
     @asynccontextmanager
     async def load(self) -> AsyncIterator['BrowserTool']:
-        server_name = "playwright"
-        client = MultiServerMCPClient({server_name: {"transport": "streamable_http", "url": env.browser_tool_playwright_mcp_url}})
-        async with client.session(server_name) as mcp_session:
-            self._tools = await load_mcp_tools(mcp_session)
-            self._tools = [ScreenshotPersistingTool(cast(StructuredTool, t), self.user_id, self._thread_id, cast(AsyncSession, self._db)) if t.name == "browser_take_screenshot" else t for t in self._tools]
-            for tool in self._tools:
-                tool.callbacks = [StatusUpdateCallbackHandler(tool.name, description=tool.description)]
+        # each thread gets its own browser session, which is kept among messages of the thread. We don't share sessions
+        # among threads of a user since the playwright MCP server keeps one browser (open tabs, current page, cookies) per
+        # session, and threads answered concurrently would navigate the same pages and see each other's state.
+        # Idle sessions are closed by the pool after MCP_SESSION_IDLE_TTL_SECONDS.
+        session_key = (env.browser_tool_playwright_mcp_url, self.user_id, self._thread_id)
+        async with mcp_session_pool.session(session_key, {"transport": "streamable_http", "url": env.browser_tool_playwright_mcp_url}) as mcp_session:
+            tools = await mcp_session.list_tools()
+            tools = [ScreenshotPersistingTool(cast(StructuredTool, t), self.user_id, self._thread_id, cast(AsyncSession, self._db)) if t.name == "browser_take_screenshot" else t for t in tools]
+            # listed tools are shared by all users of the pooled session, so we work on copies of them
+            self._tools = [tool.model_copy(update={"callbacks": [StatusUpdateCallbackHandler(tool.name, description=tool.description)]}) for tool in tools]
             yield self
 
     async def clone(
@@ -2,7 +2,7 @@ import abc
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 import json
-from typing import Any, List, Optional, cast, Dict, Callable
+from typing import Any, List, Optional, cast, Dict, Callable, Hashable
 
 import jsonschema
 from langchain.tools import BaseTool
@@ -14,6 +14,7 @@ from ..agents.domain import Agent, AgentToolConfig
 from ..core.assets import solve_module_path
 from ..core.domain import CamelCaseModel
 from ..files.domain import File, FileMetadata
+from ..files.upload import SpooledUpload
 from ..threads.domain import AgentActionEvent, AgentAction
 from ..tools.oauth import ToolAuthCallback, ToolOAuthState
 from ..usage.domain import ToolUsage
@@ -171,10 +172,11 @@ class AgentTool(CamelCaseModel, abc.ABC):
     async def teardown(self):
         pass
 
-    async def add_file(self, file: File, user: User):
+    # uploaded files provide their spooled upload, so tools read the content from it instead of the file
+    async def add_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
         raise NotImplementedError()
 
-    async def update_file(self, file: File, user: User):
+    async def update_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
         raise NotImplementedError()
 
     async def remove_file(self, file: File):
@@ -190,6 +192,12 @@ class AgentTool(CamelCaseModel, abc.ABC):
     async def build_langchain_tools(self) -> List[BaseTool]:
         pass
 
+    # override this method when built langchain tools (their names, descriptions or arguments) may change without changing
+    # the tool config (eg: descriptions generated from uploaded files, tools listed by a server), so agent graphs bound to
+    # them are rebuilt. It is invoked after building the langchain tools and should be cheap, since it runs on every message
+    def get_langchain_tools_version(self) -> Hashable:
+        return None
+
     async def auth(self, auth_callback: ToolAuthCallback, state: ToolOAuthState):
         raise NotImplementedError()
     
@@ -202,11 +210,11 @@ class AgentTool(CamelCaseModel, abc.ABC):
 class AgentToolWithFiles(AgentTool, abc.ABC):
 
     @abc.abstractmethod
-    async def add_file(self, file: File, user: User):
+    async def add_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
         pass
 
     @abc.abstractmethod
-    async def update_file(self, file: File, user: User):
+    async def update_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
         pass
 
     @abc.abstractmethod
@@ -2,7 +2,7 @@ import aiofiles
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 import logging
-from typing import List, Any, Optional, cast, Sequence
+from typing import List, Any, Optional, cast, Hashable, Sequence
 from uuid import UUID
 from enum import Enum
 import tiktoken
@@ -42,6 +42,7 @@ from ...usage.domain import Usage, MessageUsage, UsageType
 from ...usage.repos import UsageRepository
 from ...users.domain import User
 from ...files.repos import FileRepository
+from ...files.upload import SpooledUpload
 from ...threads.domain import AgentActionEvent, AgentAction
 from ..core import AgentToolWithFiles, load_schema
 from .domain import DocToolFile, DocToolConfig
@@ -92,6 +93,7 @@ class DocsTool(AgentToolWithFiles):
     )
     config_schema: dict = load_schema(__file__)
     _embedding_usage: Optional[Usage] = None
+    _tool_description: Optional[str] = None
 
     @model_validator(mode="after")
     def remove_advanced_processing_if_not_configured(self):
@@ -135,14 +137,13 @@ class DocsTool(AgentToolWithFiles):
         await DocToolConfigRepository(self.db).remove(self.agent.id)
 
     def _build_vectorstore(self):
-        ai_provider = ai_factory.get_provider(env.embedding_model)
-        return PGVector(embeddings=ai_provider.build_embedding(env.embedding_model), connection=self._get_async_engine(),
+        return PGVector(embeddings=ai_factory.build_embedding(env.embedding_model), connection=self._get_async_engine(),
                         collection_name=self._build_collection_name(self.agent.id), use_jsonb=True)
 
-    async def add_file(self, file: File, user: User):
-        await self._handle_file(file, user)
+    async def add_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
+        await self._handle_file(file, user, upload)
 
-    async def _handle_file(self, file: File, user: User):
+    async def _handle_file(self, file: File, user: User, upload: Optional[SpooledUpload]):
         pdf_parsing_usage = None
         message_usage = None
         try:
@@ -152,7 +153,7 @@ class DocsTool(AgentToolWithFiles):
             current_usage = await UsageRepository(self.db).find_current_month_user_usage_usd(file.user_id)
             file_quota = FileQuota(pdf_parsing_usage, None, CurrentQuota(current_usage, user.monthly_usd_limit))
             file.file_processor = FileProcessor.ENHANCED if self.config.get(ADVANCED_FILE_PROCESSING) else FileProcessor.BASIC
-            file_doc = await self._build_document(file, file_quota)
+            file_doc = await self._build_document(file, file_quota, upload)
             file.processed_content = file_doc.page_content
             await FileRepository(self.db).update(file)
             await self._update_tool_description_with_file(file, model, message_usage)
@@ -181,10 +182,10 @@ class DocsTool(AgentToolWithFiles):
             raise ValueError("Internal generator model not found")
         return ret
 
-    @staticmethod
-    async def _build_document(file: File, file_quota: FileQuota):
+    async def _build_document(self, file: File, file_quota: FileQuota, upload: Optional[SpooledUpload]):
         metadata = {'id': str(file.id)}
-        content = await extract_file_text(file, file_quota)
+        content = await extract_file_text(file, file_quota, self.db, upload.content_hash, upload.path) if upload \
+            else await extract_file_text(file, file_quota, self.db)
         return Document(page_content=content, metadata=metadata)
 
     async def _generate_file_description(self, file: File, model: LlmModel, message_usage: MessageUsage) -> str:
@@ -231,10 +232,10 @@ class DocsTool(AgentToolWithFiles):
             prompt += f"\n- {f.description}"
         return await self._generate_description(prompt, 200, model, message_usage)
 
-    async def update_file(self, file: File, user: User):
+    async def update_file(self, file: File, user: User, upload: Optional[SpooledUpload] = None):
         # clear processed content before update to avoid partial quota-exceeded state
         await self._remove_file_processed_content(file)
-        await self._handle_file(file, user)            
+        await self._handle_file(file, user, upload)            
 
     async def remove_file(self, file: File):
         # langchain does not provide an abstraction to just remove one document from the index, so we built this logic
@@ -335,6 +336,7 @@ class DocsTool(AgentToolWithFiles):
         tool_config = await DocToolConfigRepository(self.db).find_by_agent_id(
             self.agent.id
         )
+        self._tool_description = tool_config.description if tool_config else None
         if not tool_config:
             return []
         docs_tool = self
@@ -347,6 +349,10 @@ class DocsTool(AgentToolWithFiles):
         )]
 
 
+    # the description is generated from uploaded files
+    def get_langchain_tools_version(self) -> Hashable:
+        return self._tool_description
+
     async def clone(
         self,
         agent_id: int,
@@ -0,0 +1,160 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+import itertools
+import logging
+import time
+from typing import Any, Hashable, Optional
+
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp import ClientSession
+from mcp.types import ServerNotification, ToolListChangedNotification
+
+from ...core.env import env
+from ...core.repos import create_untracked_task
+
+
+logger = logging.getLogger(__name__)
+_SERVER_NAME = "server"
+_HEALTH_CHECK_TIMEOUT_SECONDS = 5
+_tools_versions = itertools.count(1)
+
+
+# Keeps an MCP session open in its own task, since session contexts need to be entered and exited in the same task,
+# and caches the tools listed by the server until it notifies they changed. Each listing gets a new tools version, so
+# users of the tools can cheaply detect when they change.
+class PooledMcpSession:
+
+    def __init__(self, connection: dict[str, Any], max_concurrency: int):
+        self._connection = connection
+        self._session: Optional[ClientSession] = None
+        self._tools: Optional[list[BaseTool]] = None
+        self.tools_version = 0
+        self._ready: Optional[asyncio.Future[None]] = None
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self._last_checked = time.monotonic()
+
+    async def open(self):
+        if self._ready is None:
+            self._ready = asyncio.get_running_loop().create_future()
+            self._task = create_untracked_task(self._run(self._ready))
+        await asyncio.shield(self._ready)
+
+    async def _run(self, ready: asyncio.Future[None]):
+        connection = {**self._connection, "session_kwargs": {"message_handler": self._handle_message}}
+        try:
+            async with MultiServerMCPClient({_SERVER_NAME: connection}).session(_SERVER_NAME) as session:  # type: ignore
+                self._session = session
+                ready.set_result(None)
+                await self._closing.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"MCP session to {self._connection.get('url')} closed with error: {e}")
+        finally:
+            self._session = None
+
+    async def _handle_message(self, message: Any):
+        if isinstance(message, ServerNotification) and isinstance(message.root, ToolListChangedNotification):
+            self._tools = None
+
+    @property
+    def session(self) -> ClientSession:
+        if not self._session:
+            raise RuntimeError("MCP session is not open")
+        return self._session
+
+    async def list_tools(self) -> list[BaseTool]:
+        if self._tools is None:
+            self._tools = await load_mcp_tools(self.session)
+            self.tools_version = next(_tools_versions)
+        return self._tools
+
+    async def is_healthy(self, check_interval_seconds: float) -> bool:
+        if self._task and self._task.done():
+            return False
+        if self._session is None or self.leases > 0 or time.monotonic() - self._last_checked < check_interval_seconds:
+            return True
+        try:
+            await asyncio.wait_for(self._session.send_ping(), _HEALTH_CHECK_TIMEOUT_SECONDS)
+            self._last_checked = time.monotonic()
+            return True
+        except Exception:
+            logger.warning(f"MCP session to {self._connection.get('url')} is not healthy", exc_info=True)
+            return False
+
+    async def close(self):
+        self._closing.set()
+        if self._task:
+            await self._task
+
+
+# Shares open MCP sessions among messages, avoiding the connection handshake and tools listing on every message.
+# Sessions are closed once idle for a given time, checked with a ping when reused after some time, and the amount of
+# concurrent users of each session is limited.
+class McpSessionPool:
+
+    def __init__(self, idle_ttl_seconds: int, health_check_seconds: int, max_concurrency: int):
+        self._idle_ttl_seconds = idle_ttl_seconds
+        self._health_check_seconds = health_check_seconds
+        self._max_concurrency = max_concurrency
+        self._sessions: dict[Hashable, PooledMcpSession] = {}
+        self._closing_tasks: set[asyncio.Task] = set()
+
+    # the key should identify the server and the credentials used to connect to it
+    @asynccontextmanager
+    async def session(self, key: Hashable, connection: dict[str, Any]) -> AsyncIterator[PooledMcpSession]:
+        self._discard_idle()
+        ret = await self._acquire(key, connection)
+        async with ret.semaphore:
+            ret.leases += 1
+            try:
+                yield ret
+            finally:
+                ret.leases -= 1
+                ret.last_used = time.monotonic()
+                asyncio.get_running_loop().call_later(self._idle_ttl_seconds, self._discard_idle)
+
+    async def _acquire(self, key: Hashable, connection: dict[str, Any]) -> PooledMcpSession:
+        ret = self._sessions.get(key)
+        if ret and not await ret.is_healthy(self._health_check_seconds):
+            self._discard(key, ret)
+        ret = self._sessions.get(key)
+        if not ret:
+            ret = PooledMcpSession(connection, self._max_concurrency)
+            self._sessions[key] = ret
+        try:
+            await ret.open()
+        except BaseException:
+            self._discard(key, ret)
+            raise
+        return ret
+
+    def _discard_idle(self):
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if session.leases == 0 and now - session.last_used >= self._idle_ttl_seconds:
+                self._discard(key, session)
+
+    def _discard(self, key: Hashable, session: PooledMcpSession):
+        if self._sessions.get(key) is session:
+            del self._sessions[key]
+        task = asyncio.create_task(session.close())
+        self._closing_tasks.add(task)
+        task.add_done_callback(self._closing_tasks.discard)
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*[s.close() for s in sessions], return_exceptions=True)
+
+
+mcp_session_pool = McpSessionPool(env.mcp_session_idle_ttl_seconds, env.mcp_session_health_check_seconds,
+                                  env.mcp_session_max_concurrency)
@@ -1,16 +1,16 @@
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
+import copy
 import logging
-from typing import Any, Optional, cast, Mapping
+from typing import Any, Hashable, Optional, cast
 
 from langchain_core.tools import BaseTool
-from langchain_mcp_adapters.client import MultiServerMCPClient, SSEConnection
-from langchain_mcp_adapters.tools import load_mcp_tools
 from pydantic import AnyHttpUrl
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ...agents.domain import Agent, AgentToolConfig
 from ..core import AgentTool, StatusUpdateCallbackHandler, load_schema
+from .session_pool import mcp_session_pool
 from ..oauth import AgentToolOauth, ToolAuthCallback, ToolOAuthClientInfoRepository, ToolOAuthState, ToolOAuthRepository
 
 
@@ -25,6 +25,7 @@ class McpTool(AgentTool):
     config_schema: dict = load_schema(__file__)
     _oauth: Optional[AgentToolOauth] = None
     _tools: Optional[list[BaseTool]] = None
+    _tools_version: Optional[int] = None
     
     def configure(self, agent: Agent, user_id: int, config: dict, db: AsyncSession, thread_id: Optional[int] = None):
         super().configure(agent, user_id, config, db, thread_id)
@@ -50,21 +51,21 @@ class McpTool(AgentTool):
     async def load(self) -> AsyncIterator['McpTool']:
         oauth = self._get_oauth()
         tokens = await oauth.solve_tokens()
-        app_name = cast(str, AnyHttpUrl(oauth.server_url).host)
         transport = "sse" if oauth.server_url.endswith("/sse") else "streamable_http"
         base_config = {
             "transport": transport,
             "url": oauth.server_url,
             "headers": {"Authorization": f"Bearer {tokens.access_token}"} if tokens else {}
         }
-        connections: Mapping[str, Any] = {app_name: cast(SSEConnection, base_config) if transport == "sse" else base_config}
-        async with MultiServerMCPClient(connections).session(app_name) as mcp_session:
-            tools = await load_mcp_tools(mcp_session)
+        session_key = (oauth.server_url, self.user_id, tokens.access_token if tokens else None)
+        async with mcp_session_pool.session(session_key, base_config) as mcp_session:
+            tools = await mcp_session.list_tools()
+            self._tools_version = mcp_session.tools_version
             # this is required since https://mcp.atlassian.com/v1/sse returns arrays with no items description and openAI doesn't like tool with such schema,
             # same happens with https://browser.mcp.cloudflare.com/sse returning a type object with no properties
-            self._tools = self._fix_tools_schemas(tools)
-            for tool in self._tools:
-                tool.callbacks = [StatusUpdateCallbackHandler(tool.name, description=tool.description)]
+            # listed tools are shared by all users of the pooled session, so we work on copies of them
+            self._tools = [tool.model_copy(update={"callbacks": [StatusUpdateCallbackHandler(tool.name, description=tool.description)]})
+                for tool in self._fix_tools_schemas(tools)]
             yield self
     
     def _get_oauth(self) -> AgentToolOauth:
@@ -77,12 +78,11 @@ class McpTool(AgentTool):
             raise RuntimeError("MCP tool has not been set up properly")
         return self._tools
     
+    def get_langchain_tools_version(self) -> Hashable:
+        return self._tools_version
+
     def _fix_tools_schemas(self, tools: list[BaseTool]) -> list[BaseTool]:
-        ret = []
-        for tool in tools:
-            tool.args_schema = self._fix_schema(tool.args_schema)
-            ret.append(tool)
-        return ret
+        return [tool.model_copy(update={"args_schema": self._fix_schema(copy.deepcopy(tool.args_schema))}) for tool in tools]
     
     def _fix_schema(self, schema: Any) -> Any:
         if isinstance(schema, dict):
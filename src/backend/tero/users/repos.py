@@ -1,18 +1,98 @@
+from dataclasses import dataclass
 import logging
-from typing import Optional
+import time
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, TypeVar
 
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import col, select, and_, delete
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ..core.env import env
 from ..core.repos import attr, scalar
-from ..teams.domain import TeamRole
+from ..teams.domain import Team, TeamRole
 from .domain import User
 
 
 logger = logging.getLogger(__name__)
 
 
+# immutable copy of a user and its team roles. Cached users are kept as snapshots, instead of the loaded instances, since
+# instances are bound to the session of the request that loaded them and would be shared (and modified) by concurrent requests.
+@dataclass(frozen=True)
+class CachedUser:
+    user: Mapping[str, Any]
+    team_roles: tuple[tuple[Mapping[str, Any], Optional[Mapping[str, Any]]], ...]
+
+    @staticmethod
+    def from_user(user: User) -> 'CachedUser':
+        return CachedUser(
+            user=MappingProxyType(user.model_dump()),
+            team_roles=tuple((MappingProxyType(tr.model_dump()), MappingProxyType(tr.team.model_dump()) if tr.team else None) for tr in user.team_roles))
+
+    # builds new detached instances, as if they were loaded from db, so they can be merged into a session without querying it
+    def to_user(self) -> User:
+        team_roles = []
+        for team_role_data, team_data in self.team_roles:
+            team_role = TeamRole(**team_role_data)
+            set_committed_value(team_role, "team", _to_detached(Team(**team_data)) if team_data else None)
+            team_roles.append(_to_detached(team_role))
+        ret = User(**self.user)
+        set_committed_value(ret, "team_roles", team_roles)
+        return _to_detached(ret)
+
+
+T = TypeVar("T")
+
+
+def _to_detached(entity: T) -> T:
+    make_transient_to_detached(entity)
+    return entity
+
+
+# process wide cache of users (with their team roles) resolved from access tokens, to avoid loading them from db on every
+# authenticated request. Entries are short lived and the cache is cleared on any change to users, teams or team roles.
+# Clearing only applies to the current process, so when running several server workers, other workers see the changes
+# once their entries expire (after at most the configured ttl).
+class UserCache:
+
+    def __init__(self, ttl_seconds: int):
+        self._ttl_seconds = ttl_seconds
+        self._entries: dict[str, tuple[float, CachedUser]] = {}
+
+    def get(self, key: str) -> Optional[CachedUser]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            self._entries.pop(key, None)
+            return None
+        return user
+
+    def put(self, key: str, user: User, max_expires_at: Optional[float] = None):
+        if self._ttl_seconds <= 0:
+            return
+        now = time.time()
+        expires_at = now + self._ttl_seconds
+        if max_expires_at is not None:
+            expires_at = min(expires_at, max_expires_at)
+        if expires_at > now:
+            self._evict_expired(now)
+            self._entries[key] = (expires_at, CachedUser.from_user(user))
+
+    def _evict_expired(self, now: float):
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_cache = UserCache(env.auth_user_cache_ttl_seconds)
+
+
 class UserRepository:
 
     def __init__(self, db: AsyncSession):
@@ -36,9 +116,14 @@ class UserRepository:
         result = await self._db.exec(stmt)
         return result.one_or_none()
 
+    # adds a cached user to the session, without loading it from db, so it can be used as any other user loaded by the session
+    async def attach_cached(self, cached: CachedUser) -> User:
+        return await self._db.merge(cached.to_user(), load=False)
+
     async def create_user(self, user: User) -> User:
         self._db.add(user)
         await self._db.commit()
+        user_cache.clear()
         await self._db.refresh(user, ['id', 'team_roles'])
         return user
 
@@ -50,6 +135,7 @@ class UserRepository:
     async def update_user(self, user: User) -> User:
         self._db.add(user)
         await self._db.commit()
+        user_cache.clear()
         await self._db.refresh(user, ['id', 'team_roles'])
         return user
 
@@ -57,3 +143,4 @@ class UserRepository:
         stmt = delete(User).where(col(User.id) == user_id)
         await self._db.exec(scalar(stmt))
         await self._db.commit()
+        user_cache.clear()
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import gc
+import json
+import os
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, Generator, List, Optional
+
+import pytest
+
+
+# benchmarks take a while and their timings are only meaningful when run on their own, so they only run when BENCHMARKS is set.
+# Results are stored in BENCHMARK_SAVE file (if set) and compared against the ones in BENCHMARK_COMPARE file (if set),
+# failing benchmarks which are slower than the baseline more than BENCHMARK_TOLERANCE (ratio)
+ENABLED = bool(os.environ.get("BENCHMARKS"))
+SAVE_PATH = os.environ.get("BENCHMARK_SAVE")
+COMPARE_PATH = os.environ.get("BENCHMARK_COMPARE")
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.25"))
+DEFAULT_ROUNDS = 20
+CALIBRATION_ROUNDS = 10
+
+pytestmark = pytest.mark.skipif(not ENABLED, reason="BENCHMARKS is not set")
+
+
+@dataclass
+class BenchmarkResult:
+    rounds: int
+    min_ms: float
+    median_ms: float
+    mean_ms: float
+    stddev_ms: float
+    # min time relative to the calibration workload, which makes results comparable among machines. The min time is used
+    # since it is the least affected by other processes running in the machine
+    relative: float
+
+
+# pure python workload used to scale results by the speed of the machine running them
+def _calibration_workload():
+    data = [{"id": i, "name": f"item {i}", "tags": [str(i % 7), str(i % 11)]} for i in range(2000)]
+    json.loads(json.dumps(data))
+    sorted(data, key=lambda d: d["name"])
+
+
+# like timeit, garbage collection is disabled while measuring to avoid its pauses adding noise to results
+@contextmanager
+def _gc_disabled() -> Generator[None, None, None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _measure(fn: Callable[[], Any], rounds: int) -> List[float]:
+    ret = []
+    for _ in range(rounds):
+        with _gc_disabled():
+            start = time.perf_counter()
+            fn()
+            ret.append(time.perf_counter() - start)
+    return ret
+
+
+class BenchmarkSession:
+
+    def __init__(self):
+        self.results: Dict[str, BenchmarkResult] = {}
+        self.baseline: Dict[str, Any] = {}
+        if COMPARE_PATH:
+            with open(COMPARE_PATH) as f:
+                self.baseline = json.load(f)["benchmarks"]
+        self.calibrations: List[float] = []
+
+    # the calibration workload is measured right after each benchmark, since the speed of shared machines (like CI
+    # runners) changes during the session
+    def _calibrate(self) -> float:
+        ret = min(_measure(_calibration_workload, CALIBRATION_ROUNDS))
+        self.calibrations.append(ret)
+        return ret
+
+    def add(self, name: str, times: List[float]):
+        calibration = self._calibrate()
+        ret = BenchmarkResult(
+            rounds=len(times),
+            min_ms=round(min(times) * 1000, 4),
+            median_ms=round(statistics.median(times) * 1000, 4),
+            mean_ms=round(statistics.mean(times) * 1000, 4),
+            stddev_ms=round(statistics.stdev(times) * 1000, 4) if len(times) > 1 else 0,
+            relative=round(min(times) / calibration, 4))
+        self.results[name] = ret
+        if not COMPARE_PATH:
+            return
+        baseline = self.baseline.get(name)
+        # benchmarks missing in the baseline would never be compared, so the baseline needs to be saved again
+        if not baseline:
+            pytest.fail(f"{name} has no baseline entry in {COMPARE_PATH}")
+        if ret.relative > baseline["relative"] * (1 + TOLERANCE):
+            pytest.fail(f"{name} is {ret.relative / baseline['relative']:.2f}x slower than baseline "
+                        f"(relative {ret.relative} vs {baseline['relative']})")
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"calibration_ms": round(statistics.median(self.calibrations) * 1000, 4) if self.calibrations else None,
+                       "benchmarks": {name: asdict(r) for name, r in sorted(self.results.items())}}, f, indent=2)
+            f.write("\n")
+
+
+class Benchmark:
+
+    def __init__(self, name: str, session: BenchmarkSession):
+        self._name = name
+        self._session = session
+
+    # setup is invoked before each round, without being measured, and its result is passed to the measured function.
+    # This allows benchmarking functions which modify their input.
+    def __call__(self, fn: Callable[..., Any], setup: Optional[Callable[[], tuple]] = None, rounds: int = DEFAULT_ROUNDS) -> Any:
+        ret = None
+        times = []
+        for _ in range(rounds + 1):
+            args = setup() if setup else ()
+            with _gc_disabled():
+                start = time.perf_counter()
+                ret = fn(*args)
+                times.append(time.perf_counter() - start)
+        # first round is discarded as warmup
+        self._session.add(self._name, times[1:])
+        return ret
+
+    async def run_async(self, fn: Callable[[], Awaitable[Any]], rounds: int = DEFAULT_ROUNDS) -> Any:
+        ret = None
+        times = []
+        for _ in range(rounds + 1):
+            with _gc_disabled():
+                start = time.perf_counter()
+                ret = await fn()
+                times.append(time.perf_counter() - start)
+        self._session.add(self._name, times[1:])
+        return ret
+
+
+@pytest.fixture(scope="session")
+def benchmark_session() -> Generator[BenchmarkSession, None, None]:
+    ret = BenchmarkSession()
+    yield ret
+    if SAVE_PATH:
+        ret.save(SAVE_PATH)
+
+
+@pytest.fixture
+def benchmark(request: pytest.FixtureRequest, benchmark_session: BenchmarkSession) -> Benchmark:
+    return Benchmark(request.node.name.removeprefix("test_"), benchmark_session)
@@ -0,0 +1,191 @@
+import copy
+from datetime import datetime, timezone
+import random
+from typing import Any, List, cast
+
+from jinja2 import BaseLoader
+from langchain_core.tools import BaseTool
+from pydantic import SecretStr
+
+from .common import *
+from ..common import build_pdf
+
+from tero.agents.distribution import _build_jinja_env
+from tero.agents.domain import Agent
+from tero.agents.template_parser import JinjaTemplateParser
+from tero.ai_models.openai_provider import ReasoningTokenCountingChatOpenAI
+from tero.files.domain import File
+from tero.files.file_processor import Sheet, SpreadsheetFileProcessor
+from tero.files.file_quota import CurrentQuota, FileQuota
+from tero.files.pdf_processor import BasicPDFProcessor, EnhancedPDFProcessor
+from tero.threads.api import _map_messages_to_tree
+from tero.threads.domain import ThreadMessage, ThreadMessageOrigin
+from tero.threads.engine import AgentEngine
+from tero.usage.domain import Usage, UsageType
+from tero.tools.jira.tool import JiraTool
+from tero.tools.mcp.tool import McpTool
+
+
+# inputs are generated with a fixed seed so every run benchmarks exactly the same data
+SEED = 42
+
+
+def _words(rnd: random.Random, count: int) -> str:
+    return " ".join(rnd.choice(["agent", "thread", "report", "value", "data", "summary", "user", "tool"]) for _ in range(count))
+
+
+def _render_agent_markdown() -> tuple[str, str]:
+    rnd = random.Random(SEED)
+    jinja_env = _build_jinja_env()
+    template = jinja_env.get_template("agent-template.md")
+    prompts = [{"name": f"Prompt {i}", "content": _words(rnd, 200), "visibility": "PRIVATE"} for i in range(30)]
+    rendered = template.render(
+        name="Benchmark agent",
+        author="John Doe",
+        description=_words(rnd, 50),
+        system_prompt=_words(rnd, 2000),
+        icon=None,
+        model_name="GPT-4o",
+        model_config={"Temperature": "Neutral"},
+        conversation_starters=prompts[:10],
+        user_prompts=prompts[10:],
+        tools=[{"name": f"tool-{i}", "files": {f"file-{j}.pdf": f"tools/tool-{i}/file-{j}.pdf" for j in range(5)},
+                "config": {f"key{j}": f"value {j}" for j in range(5)}} for i in range(10)],
+        tests=[{"name": f"Test {i}", "messages": [{"text": _words(rnd, 50)} for _ in range(4)]} for i in range(30)])
+    return rendered, cast(BaseLoader, jinja_env.loader).get_source(jinja_env, "agent-template.md")[0]
+
+
+# token counting is part of the measured paths, so we use the tokenizer of a real model instead of the fake provider one
+def _build_chat_model() -> ReasoningTokenCountingChatOpenAI:
+    return ReasoningTokenCountingChatOpenAI(api_key=SecretStr("benchmark"), model="gpt-4o-mini")
+
+
+def test_jinja_template_parser_parse(benchmark: Benchmark):
+    rendered, template_body = _render_agent_markdown()
+    parsed = benchmark(lambda: JinjaTemplateParser(_build_jinja_env()).parse(rendered, template_body))
+    assert len(parsed["user_prompts"]) == 20 and len(parsed["tests"]) == 30
+
+
+def _build_branched_messages(count: int) -> List[ThreadMessage]:
+    rnd = random.Random(SEED)
+    ret: List[ThreadMessage] = []
+    for i in range(1, count + 1):
+        # most messages continue the conversation, but some branch from a previous message (edited or regenerated)
+        parent_id = ret[-1].id if ret and rnd.random() > 0.1 else (rnd.choice(ret).id if ret else None)
+        ret.append(ThreadMessage(id=i, thread_id=1, origin=ThreadMessageOrigin.USER if i % 2 else ThreadMessageOrigin.AGENT,
+                                 text=_words(rnd, 30), parent_id=parent_id, timestamp=datetime(2025, 1, 1, tzinfo=timezone.utc)))
+    return ret
+
+
+def test_map_messages_to_tree(benchmark: Benchmark):
+    messages = _build_branched_messages(1000)
+    tree = benchmark(lambda: _map_messages_to_tree(messages))
+    assert len(tree) == 1
+
+
+def _build_mcp_schema(depth: int, width: int) -> dict[str, Any]:
+    if depth == 0:
+        return {"type": "array", "items": {}}
+    return {"type": "object", "properties": {
+        **{f"prop{i}": _build_mcp_schema(depth - 1, width) for i in range(width)},
+        "list": {"type": "array"},
+        "empty": {"type": "object"},
+        "anyOf": [{"type": "string"}, {"type": "array", "items": {"description": "no type"}}],
+    }}
+
+
+def test_mcp_tool_fix_schema(benchmark: Benchmark):
+    schemas = [_build_mcp_schema(4, 4) for _ in range(10)]
+    tool = McpTool()
+    # schemas are fixed in place, so each round gets its own copy
+    fixed = benchmark(lambda s: [tool._fix_schema(schema) for schema in s], setup=lambda: (copy.deepcopy(schemas),))
+    assert fixed[0]["properties"]["list"]["items"] == {"type": "string"}
+
+
+async def _build_jira_tools() -> List[BaseTool]:
+    return await JiraTool().build_langchain_tools()
+
+
+async def test_jira_tool_build_langchain_tools(benchmark: Benchmark):
+    tools = await benchmark.run_async(_build_jira_tools)
+    assert tools
+
+
+class _MemorySheet(Sheet):
+
+    def __init__(self, rows: List[List[Any]]):
+        self._rows = rows
+
+    @property
+    def title(self) -> str:
+        return "Data"
+
+    @property
+    def row_count(self) -> int:
+        return len(self._rows)
+
+    @property
+    def column_count(self) -> int:
+        return len(self._rows[0]) if self._rows else 0
+
+    def cell(self, row_idx: int, col_idx: int) -> Any:
+        return self._rows[row_idx][col_idx]
+
+
+class _MemorySpreadsheetFileProcessor(SpreadsheetFileProcessor):
+    file_extension = ".mem"
+
+    def _load_sheets(self, content: bytes | str) -> list[Sheet]:
+        return []
+
+
+def test_spreadsheet_file_processor_format_sheet(benchmark: Benchmark):
+    rnd = random.Random(SEED)
+    sheet = _MemorySheet([[rnd.choice([None, rnd.randint(0, 10000), rnd.random(), _words(rnd, 3)]) for _ in range(20)]
+                          for _ in range(2000)])
+    processor = _MemorySpreadsheetFileProcessor()
+    text = benchmark(lambda: processor._format_sheet(sheet, include_sheet_name=True))
+    assert text.count("\n") == 2001
+
+
+def _polygon(x: float, y: float, width: float, height: float) -> List[float]:
+    return [x, y, x + width, y, x + width, y + height, x, y + height]
+
+
+def _build_page_layout(rnd: random.Random) -> tuple[list, list]:
+    paragraphs = [{"content": _words(rnd, 20), "boundingRegions": [{"pageNumber": 1, "polygon": _polygon(1, i * 0.2, 6, 0.15)}]}
+                  for i in range(200)]
+    tables = [{"boundingRegions": [{"pageNumber": 1, "polygon": _polygon(1, t * 8, 6, 4)}],
+               "cells": [{"rowIndex": r, "columnIndex": c, "content": _words(rnd, 2)} for r in range(10) for c in range(6)]}
+              for t in range(5)]
+    return paragraphs, tables
+
+
+def test_enhanced_pdf_processor_create_page_elements(benchmark: Benchmark):
+    paragraphs, tables = _build_page_layout(random.Random(SEED))
+    processor = EnhancedPDFProcessor(endpoint="https://localhost", key="benchmark")
+    elements = benchmark(lambda: processor._create_page_elements(paragraphs, tables))
+    assert len(elements) < len(paragraphs) + len(tables)
+
+
+def test_basic_pdf_processor_extract_content(benchmark: Benchmark):
+    rnd = random.Random(SEED)
+    file = File(name="manual.pdf", content_type="application/pdf", content=build_pdf([_words(rnd, 30) for _ in range(1000)]))
+    processor = BasicPDFProcessor()
+
+    def setup() -> tuple:
+        file_quota = FileQuota(Usage(user_id=1, agent_id=1, model_id=None, type=UsageType.PDF_PARSING), None, CurrentQuota(0, 1))
+        file_quota.model = _build_chat_model()
+        file_quota.available_tokens = 1000000
+        return (file_quota,)
+
+    text = benchmark(lambda file_quota: processor.extract_content(file, file_quota), setup=setup, rounds=5)
+    assert text.count("## Page ") == 1000
+
+
+async def test_agent_engine_count_tools_tokens(benchmark: Benchmark):
+    tools = await _build_jira_tools()
+    engine = AgentEngine(Agent(id=1, user_id=1, model_id="gpt-4o-mini"), user_id=1)
+    llm = _build_chat_model()
+    tokens = benchmark(lambda: engine._count_tools_tokens(engine._build_tools_json(tools), llm))
+    assert tokens > 0
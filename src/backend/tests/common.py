@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import asynccontextmanager, contextmanager
 import json
 import logging
 import os
@@ -11,7 +12,6 @@ import pytest
 import pytest_asyncio
 import sqlparse
 from fastapi import status, Depends # noqa: F401  # used by test files importing common
-from freezegun import freeze_time # noqa: F401  # used by test files importing common
 from httpx import Response, AsyncClient, ASGITransport
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
@@ -29,7 +29,7 @@ from tero.api import app
 from tero.core.env import env # noqa: F401  # used by test files importing common
 from tero.core.api import BASE_PATH # noqa: F401  # used by test files importing common
 from tero.core.assets import solve_asset_path
-from tero.core.repos import get_db
+from tero.core.repos import QueryStats, get_db, get_db_factory, track_queries
 from tero.files.domain import FileStatus
 from tero.threads.api import THREAD_MESSAGES_PATH, THREADS_PATH, ThreadCreateApi
 from tero.threads.domain import Thread, ThreadMessage
@@ -61,6 +61,11 @@ TEST_ICON = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6QAAAA1
 # avoid transformers module giving erros when using freeze_time due to torch not being installed (torch gives problems when installed on x86_64 macos)
 freezegun.configure(extend_ignore_list=["transformers"])
 
+
+# event loops keep using real time so timers (like the batching window of minutes saved estimations) still expire
+def freeze_time(time_to_freeze: datetime):
+    return freezegun.freeze_time(time_to_freeze, real_asyncio=True)
+
 # Fix for pydantic datetime schema generation with freezegun
 # Based on: https://github.com/pydantic/pydantic/discussions/9343
 from pydantic._internal._generate_schema import GenerateSchema
@@ -106,12 +111,28 @@ async def client_fixture(session: AsyncSession) -> AsyncGenerator[AsyncClient, N
     async def get_db_override() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
+    # streamed responses run work concurrently (eg: thread name generation), so they need independent sessions
+    @asynccontextmanager
+    async def new_db_session_override() -> AsyncGenerator[AsyncSession, None]:
+        async with AsyncSession(session.bind, expire_on_commit=False) as ret:
+            yield ret
+
     app.dependency_overrides[get_db] = get_db_override
+    app.dependency_overrides[get_db_factory] = lambda: new_db_session_override
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
         yield client
     app.dependency_overrides.clear()
 
 
+# fails when the block runs more queries than the given budget, which allows detecting endpoints or repositories running
+# additional queries (like N+1 queries) due to changes
+@contextmanager
+def assert_max_queries(max_queries: int) -> Generator[QueryStats, None, None]:
+    with track_queries() as ret:
+        yield ret
+    assert ret.count <= max_queries, f"Expected at most {max_queries} queries, but {ret.count} were run:\n{ret.summary()}"
+
+
 def assert_response(resp: Response, expected: Sequence[BaseModel] | BaseModel):
     resp.raise_for_status()
     assert resp.json() == (
@@ -277,6 +298,27 @@ async def find_asset_bytes(filename: str) -> bytes:
         return await file.read()
 
 
+# builds a minimal pdf with a line of text in each page, to avoid depending on binary assets
+def build_pdf(pages: List[str]) -> bytes:
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", "", "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+    ret = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(ret))
+        ret += f"{i} 0 obj\n{obj}\nendobj\n".encode()
+    xref_offset = len(ret)
+    ret += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode() + "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    ret += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return ret
+
+
 async def find_last_id(column: Mapped[int], db: AsyncSession) -> int:
     result = await db.exec(select(func.max(column)))
     return result.one()
@@ -0,0 +1,171 @@
+import asyncio
+from dataclasses import asdict, dataclass, field
+import json
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Dict, Generator, List, cast
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..common import *
+from ..common import _init_db_data
+
+from tero.bench.seed import seed_data
+
+
+# the suite is slow (seeds a large tenant and runs each query twice), so it only runs when QUERY_PLANS is set.
+# Budgets are rewritten instead of checked when QUERY_PLANS_SAVE is set
+ENABLED = bool(os.environ.get("QUERY_PLANS"))
+SAVE = bool(os.environ.get("QUERY_PLANS_SAVE"))
+BUDGETS_PATH = Path(__file__).parent / "budgets.json"
+OUTPUT_PATH = Path(os.environ.get("QUERY_PLANS_OUTPUT", Path(__file__).parent / "plans"))
+# costs are deterministic for a given seed and scale, but execution times depend on the machine running the queries
+COST_TOLERANCE = float(os.environ.get("QUERY_PLANS_COST_TOLERANCE", "0.5"))
+TIME_TOLERANCE = float(os.environ.get("QUERY_PLANS_TIME_TOLERANCE", "1.0"))
+# avoids failing queries which take a few milliseconds due to small variations in the machine load
+MIN_TIME_SLACK_MS = 10
+# tables with fewer rows than this are cheap to scan, and postgres prefers sequential scans on them anyway
+LARGE_TABLE_ROWS = 10000
+DEFAULT_SCALE = 0.5
+DEFAULT_SEED = 42
+
+pytestmark = [pytest.mark.asyncio, pytest.mark.skipif(not ENABLED, reason="QUERY_PLANS is not set")]
+
+
+@dataclass
+class QueryPlanResult:
+    cost: float
+    time_ms: float
+    seq_scans: List[str] = field(default_factory=list)
+
+
+class QueryPlanSession:
+
+    def __init__(self, db_url: str):
+        self.db_url = db_url
+        budgets = json.loads(BUDGETS_PATH.read_text()) if BUDGETS_PATH.exists() else {}
+        self.scale: float = budgets.get("scale", DEFAULT_SCALE)
+        self.seed: int = budgets.get("seed", DEFAULT_SEED)
+        self.budgets: Dict[str, Any] = budgets.get("queries", {})
+        self.results: Dict[str, QueryPlanResult] = {}
+        self.large_tables: set[str] = set()
+
+    # budgets of queries which didn't run (eg: when running only some tests) are kept as they were
+    def save(self):
+        queries = {**self.budgets, **{name: asdict(r) for name, r in self.results.items()}}
+        with open(BUDGETS_PATH, "w") as f:
+            json.dump({"scale": self.scale, "seed": self.seed, "queries": dict(sorted(queries.items()))}, f, indent=2)
+            f.write("\n")
+
+
+async def _seed_db(session: QueryPlanSession):
+    engine = create_async_engine(session.db_url)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+            await _init_db_data(conn)
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            await seed_data(db, scale=session.scale, seed=session.seed)
+            # reltuples is updated by the ANALYZE run at the end of seeding
+            conn = await db.connection()
+            tables = await conn.exec_driver_sql("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples > %(rows)s",
+                                                {"rows": LARGE_TABLE_ROWS})
+            session.large_tables = set(tables.scalars().all())
+    finally:
+        await engine.dispose()
+
+
+# the database is seeded once per test session, since seeding a large tenant takes a while
+@pytest.fixture(scope="session")
+def query_plan_session(postgres_container: PostgresContainer) -> Generator[QueryPlanSession, None, None]:
+    ret = QueryPlanSession(postgres_container.get_connection_url())
+    asyncio.run(_seed_db(ret))
+    yield ret
+    if SAVE:
+        ret.save()
+
+
+@pytest_asyncio.fixture(name="seeded_db")
+async def seeded_db_fixture(query_plan_session: QueryPlanSession) -> AsyncGenerator[AsyncSession, None]:
+    engine = create_async_engine(query_plan_session.db_url)
+    async with AsyncSession(engine, expire_on_commit=False) as ret:
+        yield ret
+    await engine.dispose()
+
+
+def _find_seq_scans(node: dict, large_tables: set[str]) -> List[str]:
+    ret = []
+    if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in large_tables:
+        ret.append(node["Relation Name"])
+    for child in node.get("Plans", []):
+        ret.extend(_find_seq_scans(child, large_tables))
+    return ret
+
+
+class QueryPlanChecker:
+
+    def __init__(self, name: str, session: QueryPlanSession, db: AsyncSession):
+        self._name = name
+        self._session = session
+        self._db = db
+
+    # runs the repository call recording its queries, and then explains each of them with the same parameters.
+    # Queries of a call are checked together, since the amount of queries a repository method runs is part of its cost
+    async def __call__(self, call: Awaitable[Any]) -> Any:
+        statements = []
+
+        def record_statement(conn, cursor, statement: str, parameters: Any, context, executemany: bool):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+
+        engine = cast(AsyncEngine, self._db.bind)
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        try:
+            ret = await call
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+        assert statements, f"{self._name} didn't run any query"
+        result = await self._explain(statements)
+        self._session.results[self._name] = result
+        if not SAVE:
+            self._check(result)
+        return ret
+
+    async def _explain(self, statements: List[tuple[str, Any]]) -> QueryPlanResult:
+        ret = QueryPlanResult(cost=0, time_ms=0)
+        report = []
+        plans = []
+        conn = await self._db.connection()
+        for statement, parameters in statements:
+            plan = (await conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)).scalar_one()[0]
+            text_plan = (await conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)).scalars().all()
+            ret.cost += plan["Plan"]["Total Cost"]
+            ret.time_ms += plan["Execution Time"]
+            ret.seq_scans.extend(t for t in _find_seq_scans(plan["Plan"], self._session.large_tables) if t not in ret.seq_scans)
+            plans.append(plan)
+            report.append(f"{statement}\n\n-- parameters: {parameters}\n\n" + "\n".join(text_plan))
+        ret.cost = round(ret.cost, 2)
+        ret.time_ms = round(ret.time_ms, 3)
+        ret.seq_scans.sort()
+        OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+        (OUTPUT_PATH / f"{self._name}.txt").write_text("\n\n\n".join(report) + "\n")
+        (OUTPUT_PATH / f"{self._name}.json").write_text(json.dumps(plans, indent=2) + "\n")
+        return ret
+
+    def _check(self, result: QueryPlanResult):
+        budget = self._session.budgets.get(self._name)
+        assert budget, f"{self._name} has no budget, generate it with QUERY_PLANS_SAVE"
+        new_seq_scans = [t for t in result.seq_scans if t not in budget["seq_scans"]]
+        assert not new_seq_scans, f"{self._name} runs sequential scans on {new_seq_scans}, check {OUTPUT_PATH / self._name}.txt"
+        max_cost = budget["cost"] * (1 + COST_TOLERANCE)
+        assert result.cost <= max_cost, f"{self._name} cost {result.cost} exceeds budget {budget['cost']}, check {OUTPUT_PATH / self._name}.txt"
+        max_time = max(budget["time_ms"] * (1 + TIME_TOLERANCE), budget["time_ms"] + MIN_TIME_SLACK_MS)
+        assert result.time_ms <= max_time, f"{self._name} took {result.time_ms}ms exceeding budget {budget['time_ms']}ms, check {OUTPUT_PATH / self._name}.txt"
+
+
+@pytest.fixture
+def query_plan(request: pytest.FixtureRequest, query_plan_session: QueryPlanSession, seeded_db: AsyncSession) -> QueryPlanChecker:
+    return QueryPlanChecker(request.node.name.removeprefix("test_"), query_plan_session, seeded_db)
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+from .common import *
+
+from tero.agents.repos import AgentRepository
+from tero.teams.domain import MY_TEAM_ID
+from tero.threads.repos import ThreadRepository
+from tero.usage.repos import UsageRepository
+from tero.users.repos import UserRepository
+
+
+# dashboards are checked for the user, for a regular team and for the global team, since each one filters data differently
+TEAMS = ["my_team", "team", "global_team"]
+PAGE_SIZE = 20
+
+
+# the most active user is used, since it has the most data to filter and its queries are the slowest ones
+async def _find_most_active_user(db: AsyncSession) -> User:
+    user_id = (await db.exec(select(Thread.user_id).group_by(col(Thread.user_id)).order_by(func.count().desc()).limit(1))).one()
+    return cast(User, await UserRepository(db).find_by_id(user_id))
+
+
+async def _find_team_id(team: str, db: AsyncSession) -> int:
+    if team == "my_team":
+        return MY_TEAM_ID
+    if team == "global_team":
+        return GLOBAL_TEAM_ID
+    return (await db.exec(select(TeamRole.team_id).where(TeamRole.status == TeamRoleStatus.ACCEPTED, TeamRole.team_id != GLOBAL_TEAM_ID)
+                          .group_by(col(TeamRole.team_id)).order_by(func.count().desc()).limit(1))).one()
+
+
+def _last_month() -> tuple[datetime, datetime]:
+    to_date = datetime.now(timezone.utc)
+    return to_date - timedelta(days=30), to_date
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_impact_summary(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_impact_summary(*_last_month(), await _find_team_id(team, seeded_db), user.id))
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_impact_top_agents(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_impact_top_agents(*_last_month(), await _find_team_id(team, seeded_db), None,
+                                                                      PAGE_SIZE, 0, user.id, None))
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_impact_top_users(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_impact_top_users(*_last_month(), await _find_team_id(team, seeded_db), None,
+                                                                     PAGE_SIZE, 0, user.id, None))
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_usage_summary(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_usage_summary(*_last_month(), await _find_team_id(team, seeded_db), user.id))
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_usage_top_agents(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_usage_top_agents(*_last_month(), await _find_team_id(team, seeded_db), None,
+                                                                     PAGE_SIZE, 0, user.id, None))
+
+
+@pytest.mark.parametrize("team", TEAMS)
+async def test_usage_top_users(team: str, seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).get_usage_top_users(*_last_month(), await _find_team_id(team, seeded_db), None,
+                                                                    PAGE_SIZE, 0, user.id, None))
+
+
+async def test_current_month_user_usage(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(UsageRepository(seeded_db).find_current_month_user_usage_usd(user.id))
+
+
+async def test_newest_agents(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(AgentRepository(seeded_db).find_newest(user, PAGE_SIZE, 0))
+
+
+async def test_top_used_agents(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(AgentRepository(seeded_db).find_top_used(user, PAGE_SIZE, 0))
+
+
+async def test_agents_by_text(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(AgentRepository(seeded_db).find_by_text("sales", user, PAGE_SIZE, 0))
+
+
+async def test_threads(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(ThreadRepository(seeded_db).find_by_text(None, user.id, PAGE_SIZE, None))
+
+
+async def test_threads_by_text(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    await query_plan(ThreadRepository(seeded_db).find_by_text("budget", user.id, PAGE_SIZE, None))
+
+
+async def test_empty_thread(seeded_db: AsyncSession, query_plan: QueryPlanChecker):
+    user = await _find_most_active_user(seeded_db)
+    agent_id = (await seeded_db.exec(select(Thread.agent_id).where(Thread.user_id == user.id).order_by(col(Thread.id)).limit(1))).one()
+    await query_plan(ThreadRepository(seeded_db).find_empty_thread(agent_id, user.id))
@@ -0,0 +1,271 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from io import BytesIO
+import multiprocessing
+import socket
+import threading
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI, HTTPException, UploadFile
+from PIL import Image
+from sqlalchemy import inspect
+from starlette.datastructures import Headers
+import uvicorn
+
+from .common import *
+
+from tero.ai_models.fake_provider import FakeChatModel
+from tero.files.domain import File, FileExtraction
+from tero.files.fake_doc_intelligence import FakeDocIntelligence, build_fake_doc_intelligence_app
+from tero.files.file_processor import BaseFileProcessor, BasicPdfFileProcessor, ImageFileProcessor, PlainTextFileProcessor
+from tero.files.file_quota import CurrentQuota, FileQuota, QuotaExceededError
+from tero.files.parser import extract_file_text
+from tero.files.repos import FileRepository
+from tero.files.pdf_processor import PAGES_CHUNK_SIZE, EnhancedPDFProcessor
+from tero.files.upload import UPLOAD_CHUNK_SIZE, UploadSizeLimitMiddleware, spool_upload
+from tero.usage.domain import Usage, UsageType
+
+
+PAGE_COUNT = 120
+
+
+@pytest.fixture(name="executor", scope="module")
+def executor_fixture() -> Generator[ProcessPoolExecutor, None, None]:
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield executor
+
+
+def _build_pdf_file() -> File:
+    return File(id=1, name="manual.pdf", content_type="application/pdf",
+                content=build_pdf([f"Page {i} of the manual with some content" for i in range(1, PAGE_COUNT + 1)]))
+
+
+def _build_file_quota(available_tokens: Optional[int] = None, user_quota: float = 1) -> FileQuota:
+    ret = FileQuota(Usage(user_id=1, agent_id=1, model_id=None, type=UsageType.PDF_PARSING), None, CurrentQuota(0, user_quota))
+    if available_tokens:
+        ret.model = FakeChatModel(model_name="gpt-4o-mini")
+        ret.available_tokens = available_tokens
+    return ret
+
+
+class _ThreadRecordingChatModel(FakeChatModel):
+    token_counting_threads: set[int] = set()
+
+    def get_num_tokens(self, text: str) -> int:
+        self.token_counting_threads.add(threading.get_ident())
+        return super().get_num_tokens(text)
+
+
+def _build_thread_recording_file_quota() -> tuple[FileQuota, _ThreadRecordingChatModel]:
+    ret = _build_file_quota(available_tokens=100000)
+    model = _ThreadRecordingChatModel(model_name="gpt-4o-mini")
+    ret.model = model
+    return ret, model
+
+
+async def test_extract_pdf_in_pool(executor: ProcessPoolExecutor):
+    file = _build_pdf_file()
+    processor = BasicPdfFileProcessor()
+    text = await processor.extract_text_async(file, _build_file_quota(), executor)
+    assert text == processor.extract_text(file, _build_file_quota())
+    assert text.startswith("## Page 1\nPage 1 of the manual with some content\n\n## Page 2\n")
+    assert text.endswith(f"## Page {PAGE_COUNT}\nPage {PAGE_COUNT} of the manual with some content")
+
+
+async def test_extract_pdf_in_pool_token_limit(executor: ProcessPoolExecutor):
+    file = _build_pdf_file()
+    processor = BasicPdfFileProcessor()
+    text = await processor.extract_text_async(file, _build_file_quota(available_tokens=1000), executor)
+    assert text == processor.extract_text(file, _build_file_quota(available_tokens=1000))
+    assert 0 < text.count("## Page ") < PAGE_COUNT
+
+
+async def test_extract_spooled_pdf_in_pool(executor: ProcessPoolExecutor):
+    file = _build_pdf_file()
+    async with spool_upload(UploadFile(BytesIO(file.content), filename=file.name, headers=Headers({"content-type": "application/pdf"})), "uploaded-file") as upload:
+        text = await BasicPdfFileProcessor().extract_text_async(file, _build_file_quota(), executor, upload.path)
+    assert text == BasicPdfFileProcessor().extract_text(file, _build_file_quota())
+
+
+async def test_extract_pdf_in_pool_counts_tokens_outside_event_loop(executor: ProcessPoolExecutor):
+    file_quota, model = _build_thread_recording_file_quota()
+    await BasicPdfFileProcessor().extract_text_async(_build_pdf_file(), file_quota, executor)
+    assert model.token_counting_threads and threading.get_ident() not in model.token_counting_threads
+
+
+async def test_extract_pdf_in_pool_quota_exceeded(executor: ProcessPoolExecutor):
+    with pytest.raises(QuotaExceededError):
+        await BasicPdfFileProcessor().extract_text_async(_build_pdf_file(), _build_file_quota(user_quota=-1), executor)
+
+
+@pytest.fixture(name="doc_intelligence")
+def doc_intelligence_fixture() -> FakeDocIntelligence:
+    return FakeDocIntelligence(analysis_ms=200)
+
+
+@pytest_asyncio.fixture(name="doc_intelligence_endpoint")
+async def doc_intelligence_endpoint_fixture(doc_intelligence: FakeDocIntelligence) -> AsyncGenerator[str, None]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(build_fake_doc_intelligence_app(doc_intelligence), host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    await serving
+
+
+async def test_extract_enhanced_pdf_concurrently(doc_intelligence: FakeDocIntelligence, doc_intelligence_endpoint: str):
+    file_quota = _build_file_quota()
+    text = await EnhancedPDFProcessor(doc_intelligence_endpoint, "fake", max_concurrency=2).extract_content_async(_build_pdf_file(), file_quota)
+    assert text == BasicPdfFileProcessor().extract_text(_build_pdf_file(), _build_file_quota())
+    assert doc_intelligence.max_running == 2
+    assert file_quota.pdf_parsing_usage.quantity == doc_intelligence.analyzed_pages == PAGE_COUNT
+
+
+async def test_extract_enhanced_pdf_token_limit(doc_intelligence: FakeDocIntelligence, doc_intelligence_endpoint: str):
+    file_quota = _build_file_quota(available_tokens=300)
+    text = await EnhancedPDFProcessor(doc_intelligence_endpoint, "fake", max_concurrency=1).extract_content_async(_build_pdf_file(), file_quota)
+    assert text.count("## Page ") == PAGES_CHUNK_SIZE
+    assert file_quota.pdf_parsing_usage.quantity == doc_intelligence.analyzed_pages < PAGE_COUNT
+
+
+async def test_extract_enhanced_pdf_counts_tokens_outside_event_loop(doc_intelligence_endpoint: str):
+    file_quota, model = _build_thread_recording_file_quota()
+    await EnhancedPDFProcessor(doc_intelligence_endpoint, "fake", max_concurrency=2).extract_content_async(_build_pdf_file(), file_quota)
+    assert model.token_counting_threads and threading.get_ident() not in model.token_counting_threads
+
+
+async def test_extract_enhanced_pdf_quota_exceeded(doc_intelligence: FakeDocIntelligence, doc_intelligence_endpoint: str):
+    file_quota = _build_file_quota(user_quota=0.4)
+    with pytest.raises(QuotaExceededError):
+        await EnhancedPDFProcessor(doc_intelligence_endpoint, "fake", max_concurrency=1).extract_content_async(_build_pdf_file(), file_quota)
+    assert file_quota.pdf_parsing_usage.quantity == doc_intelligence.analyzed_pages
+
+
+async def test_extract_enhanced_pdf_concurrently_quota_exceeded(doc_intelligence: FakeDocIntelligence, doc_intelligence_endpoint: str):
+    # the quota allows analyzing only one chunk, so concurrent chunks must see the pages reserved by the first one
+    file_quota = _build_file_quota(user_quota=0.4)
+    with pytest.raises(QuotaExceededError):
+        await EnhancedPDFProcessor(doc_intelligence_endpoint, "fake", max_concurrency=3).extract_content_async(_build_pdf_file(), file_quota)
+    assert file_quota.pdf_parsing_usage.quantity == doc_intelligence.analyzed_pages == PAGES_CHUNK_SIZE
+
+
+async def test_cached_extraction(session: AsyncSession):
+    file = _build_pdf_file()
+    text = await extract_file_text(file, _build_file_quota(), session)
+    extraction = (await session.exec(select(FileExtraction))).one()
+    assert extraction.processor == "BasicPdfFileProcessor"
+    assert extraction.processed_content == text
+    # changing the cached content allows checking that the file is not extracted again
+    extraction.processed_content = "cached content"
+    await session.commit()
+    assert await extract_file_text(_build_pdf_file(), _build_file_quota(), session) == "cached content"
+
+
+async def test_cached_extraction_over_token_limit(session: AsyncSession):
+    text = await extract_file_text(_build_pdf_file(), _build_file_quota(), session)
+    truncated_text = await extract_file_text(_build_pdf_file(), _build_file_quota(available_tokens=300), session)
+    assert 0 < truncated_text.count("## Page ") < PAGE_COUNT
+    assert (await session.exec(select(FileExtraction.processed_content))).one() == text
+
+
+async def test_truncated_extraction_not_cached(session: AsyncSession):
+    await extract_file_text(_build_pdf_file(), _build_file_quota(available_tokens=300), session)
+    assert not (await session.exec(select(FileExtraction))).all()
+
+
+async def test_spool_upload():
+    content = "Línea de texto en español\n".encode("latin-1") * (UPLOAD_CHUNK_SIZE // 10)
+    async with spool_upload(UploadFile(BytesIO(content), headers=Headers({"content-type": "text/plain"})), "uploaded-file") as upload:
+        assert upload.name == "uploaded-file"
+        assert upload.size == len(content)
+        assert upload.content_hash == hashlib.sha256(content).hexdigest()
+        assert upload.content_type == "text/plain; charset=iso-8859-1"
+        assert await upload.read() == content
+    assert not os.path.exists(upload.path)
+
+
+async def test_detached_spool_upload():
+    async with spool_upload(UploadFile(BytesIO(b"Sample text")), "uploaded-file") as upload:
+        upload.detach()
+    assert os.path.exists(upload.path)
+    await upload.remove()
+    assert not os.path.exists(upload.path)
+
+
+def _build_png() -> bytes:
+    ret = BytesIO()
+    Image.new("RGB", (10, 10)).save(ret, format="PNG")
+    return ret.getvalue()
+
+
+@pytest.mark.parametrize("processor,name,content_type,content", [
+    (PlainTextFileProcessor(), "sample.txt", "text/plain; charset=iso-8859-1", "Línea de texto en español\r\n".encode("latin-1")),
+    (BasicPdfFileProcessor(), "manual.pdf", "application/pdf", build_pdf(["Page 1 of the manual", "Page 2 of the manual"])),
+    (ImageFileProcessor(), "image.png", "image/png", _build_png()),
+])
+async def test_extract_text_from_spool(processor: BaseFileProcessor, name: str, content_type: str, content: bytes):
+    async with spool_upload(UploadFile(BytesIO(content), filename=name, headers=Headers({"content-type": content_type})), "uploaded-file") as upload:
+        # files of spooled uploads have no content while being processed
+        text = await processor.extract_text_async(File(id=1, name=name, content_type=content_type), _build_file_quota(), None, upload.path)
+    assert text == await processor.extract_text_async(File(id=1, name=name, content_type=content_type, content=content), _build_file_quota(), None)
+
+
+async def test_add_file_with_content_from_spool(session: AsyncSession):
+    content = b"Sample text"
+    async with spool_upload(UploadFile(BytesIO(content), filename="sample.txt", headers=Headers({"content-type": "text/plain"})), "uploaded-file") as upload:
+        file = await FileRepository(session).add_with_content_from(File(name=upload.name, content_type=upload.content_type, user_id=USER_ID), upload.path)
+    # the stored content is not kept in memory by the added file
+    assert "content" in inspect(file).unloaded
+    assert (await session.exec(select(File.content).where(File.id == file.id))).one() == content
+
+
+def _build_upload_app() -> UploadSizeLimitMiddleware:
+    app = FastAPI()
+
+    @app.post("/files")
+    async def upload(file: UploadFile) -> int:
+        return len(await file.read())
+
+    return UploadSizeLimitMiddleware(app)
+
+
+def _build_multipart_body(content: bytes) -> tuple[str, bytes]:
+    boundary = "tero-boundary"
+    return (f"multipart/form-data; boundary={boundary}",
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="sample.txt"\r\nContent-Type: text/plain\r\n\r\n'.encode()
+            + content + f"\r\n--{boundary}--\r\n".encode())
+
+
+@pytest.mark.parametrize("content_size,expected_status", [
+    (UPLOAD_CHUNK_SIZE // 2, status.HTTP_200_OK),
+    (UPLOAD_CHUNK_SIZE * 2, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE),
+])
+async def test_upload_size_limit(content_size: int, expected_status: int, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "upload_max_size_mb", 1)
+    content_type, body = _build_multipart_body(b"a" * content_size)
+    async with AsyncClient(transport=ASGITransport(app=_build_upload_app()), base_url="http://test") as client:
+        resp = await client.post("/files", content=body, headers={"Content-Type": content_type})
+        assert resp.status_code == expected_status
+
+
+async def test_upload_size_limit_without_content_length(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "upload_max_size_mb", 1)
+    content_type, body = _build_multipart_body(b"a" * UPLOAD_CHUNK_SIZE * 2)
+    received_chunks = 0
+
+    # chunked requests don't declare their size, so the limit is checked while receiving them
+    async def stream_body() -> AsyncIterator[bytes]:
+        nonlocal received_chunks
+        for start in range(0, len(body), UPLOAD_CHUNK_SIZE // 4):
+            received_chunks += 1
+            yield body[start:start + UPLOAD_CHUNK_SIZE // 4]
+
+    async with AsyncClient(transport=ASGITransport(app=_build_upload_app()), base_url="http://test") as client:
+        resp = await client.post("/files", content=stream_body(), headers={"Content-Type": content_type})
+        assert resp.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        assert resp.json() == {"detail": "fileTooLarge"}
+    assert received_chunks < len(body) // (UPLOAD_CHUNK_SIZE // 4)
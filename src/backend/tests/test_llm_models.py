@@ -1,11 +1,18 @@
-import pytest
+import asyncio
+from typing import Any, cast
 from unittest.mock import patch
 
+from langchain_core.messages import HumanMessage, ToolMessage
+from langchain_openai.chat_models.base import BaseChatOpenAI
+import pytest
+
 from .common import *
 
+from tero.ai_models import ai_factory
 from tero.ai_models.ai_factory import providers
 from tero.ai_models.aws_provider import AWSProvider
 from tero.ai_models.domain import LlmModel, LlmModelType, LlmModelVendor
+from tero.ai_models.fake_provider import FakeModelError, FakeProvider, FakeResponse, FakeToolCall
 from tero.ai_models.google_provider import GoogleProvider
 
 
@@ -44,4 +51,59 @@ async def test_claude_sonnet_4_not_available(client: AsyncClient, ai_models: Lis
 @patch("tero.ai_models.ai_factory.providers", [p for p in providers if not isinstance(p, GoogleProvider)])
 async def test_gemini_2_5_pro_not_available(client: AsyncClient, ai_models: List[LlmModel]):
     resp = await client.get(f"{BASE_PATH}/models")
-    assert_response(resp, [model for model in ai_models if model.id not in ["gemini-2.5-flash", "gemini-2.5-pro"]])
\ No newline at end of file
+    assert_response(resp, [model for model in ai_models if model.id not in ["gemini-2.5-flash", "gemini-2.5-pro"]])
+
+def test_chat_models_share_clients_and_apply_call_settings():
+    provider = ai_factory.get_provider("gpt-4o-mini")
+    chat_model = cast(BaseChatOpenAI, provider.build_chat_model("gpt-4o-mini", 0.2))
+    streaming_chat_model = cast(BaseChatOpenAI, provider.build_streaming_chat_model("gpt-4o-mini", 0.7))
+    assert chat_model.root_async_client is streaming_chat_model.root_async_client
+    assert (chat_model.temperature, chat_model.streaming) == (0.2, False)
+    assert (streaming_chat_model.temperature, streaming_chat_model.streaming) == (0.7, True)
+
+
+async def test_fake_provider_streams_scripted_responses(monkeypatch: pytest.MonkeyPatch):
+    _use_fast_fake_models(monkeypatch)
+    provider = FakeProvider(["gpt-4o-mini"], [
+        FakeResponse(match="time", tool_calls=[FakeToolCall(name="clock")]),
+        FakeResponse(match="fail", error="Service unavailable"),
+        FakeResponse(match=r"\d+:\d+", content="It is 10:00"),
+    ])
+    with patch("tero.ai_models.ai_factory.providers", [provider] + providers):
+        chat_model = ai_factory.build_streaming_chat_model("gpt-4o-mini", 0.2)
+    tool_model = chat_model.bind_tools([{"type": "function", "function": {"name": "clock", "description": "Gets current time", "parameters": {}}}])
+
+    response = await tool_model.ainvoke([HumanMessage("What time is it?")])
+    assert [tc["name"] for tc in response.tool_calls] == ["clock"]
+
+    chunks = [chunk.content async for chunk in tool_model.astream([HumanMessage("What time is it?"), response,
+                                                                     ToolMessage("10:00", tool_call_id=response.tool_calls[0]["id"])])]
+    assert "".join(chunks) == "It is 10:00"
+
+    response = await chat_model.ainvoke([HumanMessage("Hello")])
+    assert response.content == (await chat_model.ainvoke([HumanMessage("Hello")])).content
+    assert response.usage_metadata == {"input_tokens": 2, "output_tokens": 5, "total_tokens": 7}
+
+    with pytest.raises(FakeModelError):
+        await chat_model.ainvoke([HumanMessage("Please fail")])
+
+
+def _use_fast_fake_models(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "fake_model_ttft_ms", 1)
+    monkeypatch.setattr(env, "fake_model_tokens_per_second", 10000)
+    monkeypatch.setattr(env, "fake_model_response_tokens", 5)
+
+
+def test_google_chat_models_share_async_clients_per_event_loop(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "google_api_key", "fake")
+    provider = GoogleProvider()
+
+    async def build_async_client() -> Any:
+        return cast(Any, provider.build_streaming_chat_model("gemini-2.5-flash")).async_client_running
+
+    async def build_async_clients() -> tuple[Any, Any]:
+        return await build_async_client(), await build_async_client()
+
+    client, same_loop_client = asyncio.run(build_async_clients())
+    assert client is not None and client is same_loop_client
+    assert asyncio.run(build_async_client()) is not client
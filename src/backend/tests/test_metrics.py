@@ -0,0 +1,86 @@
+from langchain_core.messages import HumanMessage
+
+from .common import *
+
+from tero.ai_models.fake_provider import FakeProvider, FakeResponse
+from tero.core.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+async def test_render_metrics():
+    registry = MetricsRegistry()
+    counter = Counter("test_calls_total", "Test calls", ["name"], registry=registry)
+    Gauge("test_active", "Active tests", registry=registry, function=lambda: 3)
+    histogram = Histogram("test_duration_seconds", "Test duration", ["name"], registry=registry, buckets=(0.1, 1))
+    counter.inc(name="a \"quoted\" name")
+    counter.inc(2, name="a \"quoted\" name")
+    histogram.observe(0.05, name="test")
+    histogram.observe(0.5, name="test")
+    histogram.observe(5, name="test")
+    assert registry.render() == """# HELP test_calls_total Test calls
+# TYPE test_calls_total counter
+test_calls_total{name="a \\"quoted\\" name"} 3
+# HELP test_active Active tests
+# TYPE test_active gauge
+test_active 3
+# HELP test_duration_seconds Test duration
+# TYPE test_duration_seconds histogram
+test_duration_seconds_bucket{name="test",le="0.1"} 1
+test_duration_seconds_bucket{name="test",le="1"} 2
+test_duration_seconds_bucket{name="test",le="+Inf"} 3
+test_duration_seconds_sum{name="test"} 5.55
+test_duration_seconds_count{name="test"} 3
+"""
+
+
+async def test_histogram_bucket_counts():
+    histogram = Histogram("test_duration_seconds", "Test duration", ["name"], registry=MetricsRegistry(), buckets=(0.1, 1))
+    assert histogram.bucket_counts(name="test") == [0, 0, 0]
+    for value in [0.05, 0.5, 0.6, 5]:
+        histogram.observe(value, name="test")
+    assert histogram.bucket_counts(name="test") == [1, 2, 1]
+
+
+async def test_metrics_missing_labels():
+    counter = Counter("test_calls_total", "Test calls", ["name"], registry=MetricsRegistry())
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+@pytest.fixture
+def metrics_enabled(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "metrics_enabled", True)
+    monkeypatch.setattr(env, "server_workers", 1)
+
+
+async def test_metrics_endpoint(client: AsyncClient, metrics_enabled: None):
+    resp = await client.get(THREADS_PATH)
+    resp.raise_for_status()
+    resp = await client.get("/metrics")
+    resp.raise_for_status()
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert f'tero_http_request_duration_seconds_count{{method="GET",route="{THREADS_PATH}",status="200"}}' in resp.text
+    assert "tero_db_pool_checked_out " in resp.text
+    assert "tero_db_pool_checkout_seconds_count " in resp.text
+    assert "tero_answer_streams_active 0" in resp.text
+
+
+async def test_llm_metrics(client: AsyncClient, metrics_enabled: None, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "fake_model_ttft_ms", 1)
+    monkeypatch.setattr(env, "fake_model_tokens_per_second", 10000)
+    model = FakeProvider(["metrics-model"], [FakeResponse(content="Hello world")]).build_streaming_chat_model("metrics-model")
+    async for _ in model.astream([HumanMessage("Hello")]):
+        pass
+    resp = await client.get("/metrics")
+    resp.raise_for_status()
+    assert 'tero_llm_time_to_first_token_seconds_count{model="metrics-model",provider="fake"} 1' in resp.text
+    assert 'tero_llm_duration_seconds_count{model="metrics-model",provider="fake",status="success"} 1' in resp.text
+
+
+async def test_metrics_not_exposed(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "metrics_enabled", False)
+    resp = await client.get("/metrics")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    monkeypatch.setattr(env, "metrics_enabled", True)
+    monkeypatch.setattr(env, "server_workers", 2)
+    resp = await client.get("/metrics")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
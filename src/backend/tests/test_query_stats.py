@@ -0,0 +1,63 @@
+from starlette.responses import PlainTextResponse
+
+from .common import *
+
+from tero.core.repos import QueryStatsMiddleware, create_untracked_task, fingerprint
+from tero.threads.api import THREAD_MESSAGES_PATH
+from tero.threads.repos import ThreadMessageRepository
+
+
+async def test_fingerprint():
+    assert fingerprint("SELECT thread.id FROM thread\nWHERE thread.id IN (%(id_1_1)s::INTEGER, %(id_1_2)s::INTEGER) AND thread.name = 'test' LIMIT 10") == \
+        fingerprint("SELECT thread.id FROM thread WHERE thread.id IN (%(id_1_1)s::INTEGER) AND thread.name = %(name_1)s::VARCHAR LIMIT 5") == \
+        "SELECT thread.id FROM thread WHERE thread.id IN (?) AND thread.name = ? LIMIT ?"
+
+
+async def test_track_repeated_queries(session: AsyncSession):
+    repo = ThreadMessageRepository(session)
+    with track_queries() as stats:
+        for message_id in range(1, 4):
+            await repo.find_by_id(message_id)
+    # each message is found with one query and its files with another one
+    assert stats.count == 6
+    assert [s.count for s in stats.find_repeated(threshold=3).values()] == [3, 3]
+    assert not stats.find_repeated(threshold=4)
+
+
+async def test_untracked_task_queries(session: AsyncSession):
+    repo = ThreadMessageRepository(session)
+    with track_queries() as stats:
+        await create_untracked_task(repo.find_by_id(1))
+        assert stats.count == 0
+        await asyncio.create_task(repo.find_by_id(1))
+    assert stats.count == 2
+
+
+async def test_find_thread_messages_query_budget(client: AsyncClient):
+    with assert_max_queries(10):
+        resp = await client.get(THREAD_MESSAGES_PATH.format(thread_id=THREAD_ID))
+        resp.raise_for_status()
+
+
+async def test_query_stats_headers(client: AsyncClient):
+    async with AsyncClient(transport=ASGITransport(app=QueryStatsMiddleware(app, add_headers=True)), base_url="http://test") as stats_client:
+        resp = await stats_client.get(THREAD_MESSAGES_PATH.format(thread_id=THREAD_ID))
+    resp.raise_for_status()
+    assert int(resp.headers["X-DB-Query-Count"]) > 0
+    assert float(resp.headers["X-DB-Query-Time-Ms"]) > 0
+    assert resp.headers["X-DB-Repeated-Queries"] == "0"
+
+
+async def test_log_repeated_queries(session: AsyncSession, caplog: pytest.LogCaptureFixture):
+    async def find_messages(scope, receive, send):
+        repo = ThreadMessageRepository(session)
+        for message_id in range(1, env.db_repeated_query_threshold + 1):
+            await repo.find_by_id(message_id)
+        await PlainTextResponse("ok")(scope, receive, send)
+
+    async with AsyncClient(transport=ASGITransport(app=QueryStatsMiddleware(find_messages)), base_url="http://test") as stats_client:
+        with caplog.at_level(logging.WARNING, logger="tero.core.repos"):
+            resp = await stats_client.get("/messages")
+    resp.raise_for_status()
+    assert any(f"run {env.db_repeated_query_threshold} times" in r.getMessage() and "GET /messages" in r.getMessage()
+               for r in caplog.records)
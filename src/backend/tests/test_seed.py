@@ -0,0 +1,35 @@
+import random
+
+from .common import *
+
+from tero.bench.seed import USERS_PER_SCALE, _ZipfChooser, seed_data
+from tero.usage.domain import Usage, UsageType
+
+
+SCALE = 0.02
+
+
+async def test_seed_data(session: AsyncSession):
+    counts = await seed_data(session, scale=SCALE, seed=1)
+    assert counts["user"] == USERS_PER_SCALE * SCALE
+    assert counts["thread_message"] > counts["thread"] > counts["user"]
+    assert counts["usage"] > counts["thread_message"] / 2
+    branched_parents = (await session.exec(select(ThreadMessage.parent_id).where(col(ThreadMessage.parent_id).isnot(None))
+                                           .group_by(col(ThreadMessage.parent_id)).having(func.count() > 1))).all()
+    assert branched_parents
+    # sequences are updated, so the application can keep adding rows after seeding
+    session.add(Usage(user_id=USER_ID, agent_id=AGENT_ID, model_id="gpt-4o", type=UsageType.PROMPT_TOKENS))
+    await session.commit()
+
+
+async def test_seed_data_already_seeded(session: AsyncSession):
+    await seed_data(session, scale=SCALE)
+    with pytest.raises(ValueError):
+        await seed_data(session, scale=SCALE)
+
+
+def test_zipf_chooser_empty_items():
+    chooser = _ZipfChooser([])
+    assert not chooser
+    with pytest.raises(ValueError):
+        chooser.choose(random.Random(1))
@@ -642,7 +642,7 @@ async def test_run_test_suite_with_all_test_cases(client: AsyncClient, last_thre
                     test_case_id=TEST_CASE_2_THREAD_ID,
                     result_id=result_id_2,
                     input="Which is the capital of Uruguay? Output just the name",
-                    response_chunks=["Monte", "video"],
+                    response_chunks=["Montevideo"],
                     status=TestCaseResultStatus.SUCCESS,
                     user_message_id=last_message_id + 3,
                     agent_message_id=last_message_id + 4,
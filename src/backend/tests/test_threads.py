@@ -1,19 +1,32 @@
 from datetime import timezone
+import inspect
 import threading
 import time
-from typing import Any, Callable
+from typing import Any, Callable, cast
 import re
 
 from sse_starlette import ServerSentEvent
 from sqlalchemy import select
+from langchain_core.tools import BaseTool, StructuredTool
+from langgraph.prebuilt import ToolNode
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 from .common import *
 
-from tero.files.domain import FileMetadata, FileProcessor
+from tero.files.domain import File, FileMetadata, FileProcessor
+from tero.ai_models import ai_factory
+from tero.ai_models.domain import LlmModel, LlmModelType, LlmModelVendor
+from tero.ai_models.fake_provider import FakeChatModel
+from tero.core.sse import ChunkCoalescer
+from tero.threads.answer_streams import AnswerStream
 from tero.threads.api import THREADS_PATH, THREAD_PATH, THREAD_MESSAGES_PATH, THREAD_MESSAGE_PATH, THREAD_FILE_PATH
-from tero.threads.domain import ThreadListItem, ThreadMessageOrigin, ThreadMessagePublic
+from tero.threads.engine import AgentEngine, _RequestToolNode, agent_graph_cache
+from tero.threads.domain import ThreadListItem, ThreadMessageOrigin, ThreadMessagePublic, ThreadMessageFile
+from tero.threads.repos import ThreadMessageRepository
+from tero.threads.stream_registry import PostgresStreamRegistry
+from tero.threads.time_saved_estimation import MinutesSavedEstimator, _EstimationRequest
 from tero.files.domain import FileMetadataWithContent
-from tero.tools.core import AgentActionEvent, AgentAction
+from tero.tools.core import AgentActionEvent, AgentAction, AgentTool
 from tero.usage.domain import Usage, UsageType
 
 
@@ -167,6 +180,121 @@ async def test_add_thread_message(last_message_id: int, client: AsyncClient):
         await _assert_response(resp, "1", last_message_id + 1)
 
 
+@freeze_time(CURRENT_TIME)
+async def test_add_thread_message_generates_thread_name(client: AsyncClient):
+    async with add_message_to_thread(client, THREAD_ID, "Which is the first natural number? Only provide the number") as resp:
+        events = [line async for line in resp.aiter_lines() if line.startswith("event: ")]
+    assert "event: threadName" in events
+    assert events.index("event: threadName") < events.index("event: metadata")
+    resp = await _find_thread(THREAD_ID, client)
+    resp.raise_for_status()
+    assert resp.json()["name"] != "Thread 1"
+
+
+async def test_add_thread_message_reuses_agent_graph(client: AsyncClient):
+    agent_graph_cache.clear()
+    await _add_message_to_thread(THREAD_ID, "Which is the first natural number? Only provide the number", client)
+    await _add_message_to_thread(THREAD_ID, "Which is the second one? Only provide the number", client)
+    assert len(agent_graph_cache) == 1
+
+
+def _build_agent_engine() -> AgentEngine:
+    return AgentEngine(Agent(id=AGENT_ID, user_id=USER_ID, model_id="gpt-4o-mini", last_update=CURRENT_TIME,
+                             model=LlmModel(id="gpt-4o-mini", name="GPT-4o Mini", description="", model_type=LlmModelType.CHAT, model_vendor=LlmModelVendor.OPENAI,
+                                            token_limit=64000, output_token_limit=2048, prompt_1k_token_usd=0, completion_1k_token_usd=0)), USER_ID)
+
+
+class _VersionedAgentTool:
+    id = "docs"
+    config: dict = {}
+
+    def __init__(self, description: str):
+        self.description = description
+
+    def get_langchain_tools_version(self) -> str:
+        return self.description
+
+    def build_langchain_tool(self) -> BaseTool:
+        return StructuredTool.from_function(lambda query: query, name="docs", description=self.description)
+
+
+def test_agent_graph_rebuilt_on_tool_description_change(monkeypatch: pytest.MonkeyPatch):
+    agent_graph_cache.clear()
+    engine = _build_agent_engine()
+    llm = FakeChatModel(model_name="gpt-4o-mini")
+    converted_tools: list[list[BaseTool]] = []
+    build_tools_json = AgentEngine._build_tools_json
+    monkeypatch.setattr(AgentEngine, "_build_tools_json", staticmethod(lambda tools: converted_tools.append(tools) or build_tools_json(tools)))
+
+    def get_agent_graph(description: str) -> Any:
+        tool = _VersionedAgentTool(description)
+        return engine._get_agent_graph(llm, [cast(AgentTool, tool)], [tool.build_langchain_tool()])
+
+    graph = get_agent_graph("Search in manual.pdf")
+    assert get_agent_graph("Search in manual.pdf") is graph
+    # cached graphs are found without converting tools schemas
+    assert len(converted_tools) == 1
+    assert get_agent_graph("Search in manual.pdf and faq.pdf") is not graph
+
+
+# _RequestToolNode overrides this private method to invoke the tools of each request, so this detects incompatible changes
+def test_request_tool_node_overrides_tool_node_afunc():
+    assert list(inspect.signature(ToolNode._afunc).parameters) == ["self", "input", "config", "store"]
+    assert inspect.signature(ToolNode._afunc).parameters["store"].kind == inspect.Parameter.KEYWORD_ONLY
+    assert "_afunc" in _RequestToolNode.__dict__ and inspect.iscoroutinefunction(ToolNode._afunc)
+
+
+def test_count_tokens_reuses_token_counter(monkeypatch: pytest.MonkeyPatch):
+    built_models: list[FakeChatModel] = []
+
+    def build_chat_model(model_id: str) -> FakeChatModel:
+        built_models.append(FakeChatModel(model_name=model_id))
+        return built_models[-1]
+
+    monkeypatch.setattr(ai_factory, "build_chat_model", build_chat_model)
+    engine = _build_agent_engine()
+    messages = [ThreadMessage(id=i, thread_id=THREAD_ID, text=text, origin=ThreadMessageOrigin.USER) for i, text in enumerate(["Hello", "How are you?"], start=1)]
+    for message in messages:
+        engine.count_tokens(message)
+    assert len(built_models) == 1
+    assert all(message.token_counts and message.token_counts["FakeChatModel"] > 0 for message in messages)
+
+
+@freeze_time(CURRENT_TIME)
+async def test_resume_answer_stream(client: AsyncClient):
+    async with add_message_to_thread(client, THREAD_ID, "Which is the first natural number? Only provide the number") as resp:
+        events = (await resp.aread()).decode().split("\r\n\r\n")
+    resp = await client.get(THREAD_PATH.format(thread_id=THREAD_ID) + "/answer-stream", headers={"Last-Event-ID": "1"})
+    resp.raise_for_status()
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.text.split("\r\n\r\n") == events[1:]
+
+
+async def test_coalesce_answer_stream_chunks():
+    stream = AnswerStream(coalescer=ChunkCoalescer(window_seconds=60, max_chars=10))
+    for text in ["Hello", " ", "world", "!"]:
+        stream.publish(ServerSentEvent(data=text))
+    stream.publish(ServerSentEvent(event="metadata", data="{}"))
+    stream.finish()
+    events = [e async for e in stream.subscribe()]
+    assert events == [
+        ServerSentEvent(id="1", data="Hello world").encode(),
+        ServerSentEvent(id="2", data="!").encode(),
+        ServerSentEvent(id="3", event="metadata", data="{}").encode()
+    ]
+
+
+async def test_resume_answer_stream_with_missed_events():
+    stream = AnswerStream(buffer_size=2, coalescer=ChunkCoalescer(window_seconds=0))
+    for text in ["Hello", " ", "world"]:
+        stream.publish(ServerSentEvent(data=text))
+    stream.finish()
+    events = [e async for e in stream.subscribe()]
+    assert events == [ServerSentEvent(event="partialAnswer", id="3", data=json.dumps({"text": "Hello world"})).encode()]
+    events = [e async for e in stream.subscribe(2)]
+    assert events == [ServerSentEvent(id="3", data="world").encode()]
+
+
 async def _assert_response(resp: Response, response: str, user_message_id: int, minutes_saved: Optional[int] = None, stopped = False, 
                     send_pre_model_status: bool = True, status_updates: List[AgentActionEvent] = [], user_files: List[FileMetadata] = []):
     buffer, events = [], []
@@ -180,12 +308,20 @@ async def _assert_response(resp: Response, response: str, user_message_id: int,
     async for chunk in resp.aiter_bytes():
         decoded_chunk = chunk.decode()
         for event in decoded_chunk.split(separator):
+            # event ids are only relevant to resume streams
+            event = re.sub(r'^id: \d+\r\n', '', event)
             if event.startswith("data: "):
                 buffer.append(event[6:])
             else:
                 flush_buffer()
-                if event.startswith("event: metadata") and minutes_saved is None:
-                    event = re.sub(r'"minutesSaved":\s*\d+,\s*', '', event)
+                # minutes saved are estimated in background and sent in a later event
+                if event.startswith("event: metadata"):
+                    event = re.sub(r'"minutesSaved":\s*(\d+|null),\s*', '', event)
+                if event.startswith("event: minutesSaved") and minutes_saved is None:
+                    continue
+                # thread names are generated by the LLM and checked in specific tests
+                if event.startswith("event: threadName"):
+                    continue
                 if event: events.append(f"{event}{separator}".encode())
     
     flush_buffer()
@@ -219,9 +355,16 @@ async def _assert_response(resp: Response, response: str, user_message_id: int,
             data=str(json.dumps({
                 "answerMessageId": user_message_id + 1,
                 "files": [],
-                **({"minutesSaved": minutes_saved} if minutes_saved is not None else {}),
                 "stopped": stopped
             }))).encode())
+    if minutes_saved is not None:
+        expected_events.append(
+            ServerSentEvent(
+                event="minutesSaved",
+                data=str(json.dumps({
+                    "answerMessageId": user_message_id + 1,
+                    "minutesSaved": minutes_saved
+                }))).encode())
     assert events == expected_events
 
 
@@ -244,6 +387,55 @@ async def test_add_thread_message_stopped_response(last_message_id: int, client:
         stop_thread.join(timeout=2)
 
 
+async def test_stop_stream_registered_in_other_process(session: AsyncSession):
+    streaming_registry = PostgresStreamRegistry(cast(AsyncEngine, session.bind))
+    other_registry = PostgresStreamRegistry(cast(AsyncEngine, session.bind))
+    try:
+        assert not await other_registry.stop(THREAD_ID)
+        stop_event = await streaming_registry.register(THREAD_ID)
+        assert await other_registry.stop(THREAD_ID)
+        await asyncio.wait_for(stop_event.wait(), timeout=5)
+        await streaming_registry.unregister(THREAD_ID, stop_event)
+        assert not await other_registry.stop(THREAD_ID)
+    finally:
+        await streaming_registry.close()
+        await other_registry.close()
+
+
+async def test_stop_thread_with_several_streams_registered_in_other_process(session: AsyncSession):
+    streaming_registry = PostgresStreamRegistry(cast(AsyncEngine, session.bind))
+    other_registry = PostgresStreamRegistry(cast(AsyncEngine, session.bind))
+    try:
+        stop_event = await streaming_registry.register(THREAD_ID)
+        other_stop_event = await streaming_registry.register(THREAD_ID)
+        await streaming_registry.unregister(THREAD_ID, stop_event)
+        assert await other_registry.stop(THREAD_ID)
+        await asyncio.wait_for(other_stop_event.wait(), timeout=5)
+        await streaming_registry.unregister(THREAD_ID, other_stop_event)
+        assert not await other_registry.stop(THREAD_ID)
+    finally:
+        await streaming_registry.close()
+        await other_registry.close()
+
+
+async def test_register_stream_of_thread_streaming_in_other_process(session: AsyncSession):
+    registries = [PostgresStreamRegistry(cast(AsyncEngine, session.bind)) for _ in range(3)]
+    streaming_registry, other_streaming_registry, stopping_registry = registries
+    try:
+        stop_event = await streaming_registry.register(THREAD_ID)
+        # registering must not wait for the lock of the other process
+        other_stop_event = await asyncio.wait_for(other_streaming_registry.register(THREAD_ID), timeout=1)
+        await streaming_registry.unregister(THREAD_ID, stop_event)
+        await asyncio.sleep(PostgresStreamRegistry._LOCK_RETRY_SECONDS * 2)
+        assert await stopping_registry.stop(THREAD_ID)
+        await asyncio.wait_for(other_stop_event.wait(), timeout=5)
+        await other_streaming_registry.unregister(THREAD_ID, other_stop_event)
+        assert not await stopping_registry.stop(THREAD_ID)
+    finally:
+        for registry in registries:
+            await registry.close()
+
+
 @freeze_time(CURRENT_TIME)
 async def test_add_thread_message_with_reasoning_model(last_message_id: int, client: AsyncClient):
     async with add_message_to_thread(client, OTHER_THREAD_ID,
@@ -380,6 +572,38 @@ async def test_edit_thread_message(last_message_id: int, messages: List[ThreadMe
     assert_response(res, [*messages])
 
 
+DEEP_BRANCH_DEPTH = 120
+
+
+async def test_find_previous_messages_in_deep_branch(session: AsyncSession):
+    branch = await _add_synthetic_branch(THREAD_ID, DEEP_BRANCH_DEPTH, session)
+    # one query for the whole branch plus the ones batch loading message files
+    with assert_max_queries(3) as stats:
+        ret = await ThreadMessageRepository(session).find_previous_messages(branch[-1])
+    logger.info(f"Found {len(ret)} previous messages in {stats.time_ms:.2f} ms using {stats.count} queries")
+    assert [m.id for m in ret] == [m.id for m in branch[:-1]]
+    assert [f.file.processed_content for f in ret[0].files] == ["Synthetic file"]
+
+
+async def _add_synthetic_branch(thread_id: int, depth: int, session: AsyncSession) -> List[ThreadMessage]:
+    ret: List[ThreadMessage] = []
+    parent_id = None
+    for i in range(depth):
+        message = ThreadMessage(thread_id=thread_id, text=f"Synthetic message {i}", parent_id=parent_id,
+                                origin=ThreadMessageOrigin.USER if i % 2 == 0 else ThreadMessageOrigin.AGENT)
+        session.add(message)
+        await session.flush()
+        ret.append(message)
+        parent_id = message.id
+    file = File(name="synthetic.txt", content_type="text/plain", user_id=USER_ID, content=b"Synthetic file",
+                processed_content="Synthetic file", status=FileStatus.PROCESSED)
+    session.add(file)
+    await session.flush()
+    session.add(ThreadMessageFile(thread_message_id=ret[0].id, file_id=file.id))
+    await session.commit()
+    return ret
+
+
 async def test_find_messages_from_invalid_thread(client: AsyncClient):
     resp = await _find_thread_messages(OTHER_USER_THREAD_ID, client)
     assert resp.status_code == status.HTTP_404_NOT_FOUND
@@ -423,6 +647,13 @@ def _build_sample_txt_thread_message_file(file_id: int) -> FileMetadata:
         file_processor=FileProcessor.ENHANCED)
 
 
+async def test_add_thread_message_with_too_large_attachment(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(env, "upload_max_size_mb", 0)
+    async with add_message_to_thread(client, THREAD_ID, "Output only the exact content of the uploaded file",
+                                        files=[solve_asset_path("sample.txt", __file__)]) as resp:
+        assert resp.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
 async def test_add_thread_message_with_file_id_from_another_thread(client: AsyncClient):
     file_id = await _add_thread_file(OTHER_THREAD_ID, client)
     async with add_message_to_thread(client, THREAD_ID, "Output only the exact content of the uploaded file",
@@ -516,3 +747,20 @@ async def test_download_thread_file_from_another_thread(client: AsyncClient):
     file_id = await _add_thread_file(OTHER_THREAD_ID, client)
     resp = await _download_thread_file(THREAD_ID, file_id, client)
     assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_minutes_saved_estimator_drains_pending_estimations():
+    processed: List[int] = []
+
+    class SlowEstimator(MinutesSavedEstimator):
+        async def _process_group(self, requests: List[_EstimationRequest]):
+            await asyncio.sleep(0.2)
+            processed.extend(r.answer_id for r in requests)
+
+    estimator = SlowEstimator(max_batch_size=1, batch_window_seconds=0.01)
+    thread = Thread(id=THREAD_ID, agent_id=AGENT_ID, user_id=USER_ID)
+    for answer_id in [1, 2]:
+        estimator.submit(ThreadMessage(id=answer_id, thread_id=THREAD_ID, text="answer", origin=ThreadMessageOrigin.AGENT, parent_id=answer_id),
+                         "question", thread, [], USER_ID, cast(Any, None))
+    await estimator.drain(5)
+    assert processed == [1, 2]
@@ -1,7 +1,8 @@
 import logging
-from typing import Generator
+from typing import Generator, cast
 
 from sqlmodel import select
+from langchain_core.tools import StructuredTool
 from testcontainers.generic import ServerContainer
 from testcontainers.core.container import DockerContainer
 from testcontainers.core.network import Network
@@ -80,6 +81,17 @@ async def test_docs_tool_with_removed_file(client: AsyncClient):
     assert "7:35" not in answer
 
 
+def test_mcp_tool_fixes_schemas_without_changing_pooled_tools():
+    async def echo(items: list) -> list:
+        return items
+    pooled_tool = StructuredTool(name="echo", description="Echoes items", coroutine=echo,
+                                 args_schema={"type": "object", "properties": {"items": {"type": "array", "items": {}}}})
+    [tool] = McpTool()._fix_tools_schemas([pooled_tool])
+    assert tool is not pooled_tool
+    assert cast(dict, tool.args_schema)["properties"]["items"]["items"] == {"type": "string"}
+    assert cast(dict, pooled_tool.args_schema)["properties"]["items"]["items"] == {}
+
+
 async def test_web_tool_search_usage(client: AsyncClient, session: AsyncSession):
     await configure_agent_tool(AGENT_ID, WEB_TOOL_ID, {}, client)
 
@@ -1,10 +1,13 @@
-from typing import Callable
+import time
+from typing import Callable, cast
 
 from .common import *
 
 from tero.users.api import CURRENT_USER_PATH, USERS_PATH
 from tero.users.domain import UserProfile, UserListItem
+from tero.users.repos import CachedUser, UserRepository, user_cache
 from tero.teams.domain import PublicTeamRole, Role, TeamRoleStatus
+from tero.teams.repos import TeamRepository
 
 
 async def test_get_user_profile(client: AsyncClient, teams:list[Team]):
@@ -22,4 +25,31 @@ async def test_get_users(client: AsyncClient, users: List[UserListItem]):
 async def test_get_users_unauthorized(client: AsyncClient, override_user: Callable[[int], None]):
     override_user(5)
     resp = await client.get(USERS_PATH)
-    assert resp.status_code == 401
\ No newline at end of file
+    assert resp.status_code == 401
+
+async def test_user_cache_is_cleared_on_team_role_changes(session: AsyncSession, teams: list[Team]):
+    user = cast(User, await UserRepository(session).find_by_id(USER_ID))
+    user_cache.put("token", user)
+    assert user_cache.get("token") is not None
+    await TeamRepository(session).save_team_role(TeamRole(user_id=USER_ID, team_id=teams[0].id, role=Role.TEAM_MEMBER, status=TeamRoleStatus.ACCEPTED))
+    assert user_cache.get("token") is None
+
+
+async def test_user_cache_respects_token_expiration(session: AsyncSession):
+    user = cast(User, await UserRepository(session).find_by_id(USER_ID))
+    user_cache.put("token", user, time.time() - 1)
+    assert user_cache.get("token") is None
+
+
+async def test_cached_user_is_attached_to_each_session(session: AsyncSession, teams: list[Team]):
+    user = cast(User, await UserRepository(session).find_by_id(USER_ID))
+    user_cache.put("token", user)
+    cached = cast(CachedUser, user_cache.get("token"))
+    async with AsyncSession(session.bind, expire_on_commit=False) as other_session:
+        attached = await UserRepository(other_session).attach_cached(cached)
+        other_attached = await UserRepository(other_session).attach_cached(cached)
+        assert attached is other_attached
+        assert attached is not user
+        assert attached in other_session and user not in other_session
+        assert attached.username == user.username and attached.monthly_usd_limit == user.monthly_usd_limit
+        assert attached.is_member_of(teams[1].id) and not attached.is_member_of(3)
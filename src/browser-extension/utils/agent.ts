@@ -1,7 +1,7 @@
 import { browser, Browser } from 'wxt/browser';
 import { AuthService } from "./auth"
 import type { AuthConfig } from "./auth"
-import { fetchJson, fetchStreamJson, ServerSentEvent } from "./http"
+import { fetchJson, fetchStreamJson, HttpServiceError, ServerSentEvent } from "./http"
 import { AgentFlow } from "./flow"
 import { addAgent, findAgentById, ExistingAgentError } from "./agent-repository"
 import { AgentPrompt } from "../../common/src/utils/domain"
@@ -41,6 +41,9 @@ export abstract class AgentSource {
 
 const TRANSCRIPTS_CAPABILITY = 'transcripts'
 const STOP_CAPABILITY = 'stop'
+// answer streams are resumed when the connection is lost, retrying with a growing delay
+const ANSWER_STREAM_MAX_RECONNECTIONS = 5
+const ANSWER_STREAM_RECONNECTION_DELAY_MS = 1000
 
 export abstract class Agent {
   url: string;
@@ -92,6 +95,8 @@ export abstract class Agent {
           yield {message: part.data};
         } else if (event === 'messageId') {
           yield {messageId: parseInt(part.data)};
+        } else if (event === 'partialAnswer') {
+          yield {partialAnswer: JSON.parse(part.data).text};
         } else {
           yield { [`${part.event}`]: JSON.parse(part.data) };
         }
@@ -170,6 +175,8 @@ export abstract class Agent {
 export interface MessagePart {
   messageId?: number;
   message?: string;
+  // whole answer generated so far, sent when resuming a stream whose missed events are no longer available
+  partialAnswer?: string;
   flow?: AgentFlow;
   complete?: boolean;
   metadata?: {
@@ -350,7 +357,38 @@ export class TeroAgent extends Agent {
       formData.append("parentMessageId", parentMessageId.toString());
     }
     const ret = await fetchStreamJson(url, await Agent.buildHttpRequest("POST", formData, authService));
-    yield* this.processStreamResponse(ret);
+    yield* this.processStreamResponse(this.resumeOnConnectionLoss(ret, sessionId, authService));
+  }
+
+  // answers keep being generated when the connection is lost, so we reconnect and resume the stream from the last received event
+  private async *resumeOnConnectionLoss(stream: AsyncIterable<any>, sessionId: string, authService?: AuthService): AsyncIterable<any> {
+    let lastEventId: string | undefined;
+    let reconnections = 0;
+    while (true) {
+      try {
+        for await (const part of stream) {
+          if (part instanceof ServerSentEvent && part.id) {
+            lastEventId = part.id;
+          }
+          reconnections = 0;
+          yield part;
+        }
+        return;
+      } catch (e) {
+        // errors sent by the server can't be resumed
+        if (e instanceof HttpServiceError || reconnections >= ANSWER_STREAM_MAX_RECONNECTIONS) {
+          throw e;
+        }
+        reconnections++;
+        console.warn(`Connection lost while reading answer of thread ${sessionId}, reconnecting`, e);
+        await new Promise(resolve => setTimeout(resolve, reconnections * ANSWER_STREAM_RECONNECTION_DELAY_MS));
+        const request = await Agent.buildHttpRequest("GET", undefined, authService);
+        if (lastEventId) {
+          (request.headers as Record<string, string>)["Last-Event-ID"] = lastEventId;
+        }
+        stream = fetchStreamJson(`${this.sessionUrl(sessionId)}/answer-stream`, request);
+      }
+    }
   }
 
   protected sessionUrl(sessionId: any): string {
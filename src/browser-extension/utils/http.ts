@@ -45,12 +45,16 @@ export async function* fetchStreamJson(url: string, options?: RequestInit): Asyn
 
 async function* fetchSSEStream(resp: Response, url: string, options?: RequestInit): AsyncIterable<ServerSentEvent> {
   let reader = resp.body!.getReader()
+  let decoder = new TextDecoder("utf-8")
+  // events may be split among received chunks, so the last incomplete event is kept until the rest is received
+  let pending = ""
   let done = false
   while (!done) {
     let result = await reader.read()
     done = result.done
-    let events = ServerSentEvent.fromBytes(result.value!)
-    for (const event of events) {
+    let events = (pending + decoder.decode(result.value, { stream: !done })).split(/\r\n\r\n/)
+    pending = done ? "" : events.pop()!
+    for (const event of events.map(e => ServerSentEvent.parseEvent(e))) {
       if (event.event === "error") {
         console.warn(`Problem while reading stream response from ${options?.method ? options.method : 'GET'} ${url}`, event)
         throw new HttpServiceError()
@@ -65,27 +69,23 @@ async function* fetchSSEStream(resp: Response, url: string, options?: RequestIni
 export class ServerSentEvent {
   event?: string
   data: string
+  id?: string
 
-  constructor(data: string, event?: string) {
+  constructor(data: string, event?: string, id?: string) {
     this.data = data
     this.event = event
+    this.id = id
   }
 
-  public static fromBytes(bs: Uint8Array): ServerSentEvent[] {
-    let text = new TextDecoder("utf-8").decode(bs)
-    let events = text.split(/\r\n\r\n/)
-    return events.map(e => ServerSentEvent.parseEvent(e))
-  }
-
-  private static parseEvent(event: string): ServerSentEvent {
+  public static parseEvent(event: string): ServerSentEvent {
     let parts = event.split(/\r\n/)
-    let eventType
+    // events may start with an id line, used by the server to resume streams
     let eventPrefix = "event: "
-    if (parts[0].startsWith(eventPrefix)) {
-      eventType = parts[0].substring(eventPrefix.length)
-    }
+    let eventType = parts.find(p => p.startsWith(eventPrefix))?.substring(eventPrefix.length)
+    let idPrefix = "id: "
+    let id = parts.find(p => p.startsWith(idPrefix))?.substring(idPrefix.length)
     let dataPrefix = "data: "
     let data = parts.filter(p => p.startsWith(dataPrefix)).map(p => p.substring(dataPrefix.length)).join("\n")
-    return new ServerSentEvent(data, eventType)
+    return new ServerSentEvent(data, eventType, id)
   }
 }
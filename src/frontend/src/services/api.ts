@@ -612,6 +612,9 @@ export class TestCaseThreadMessageUpdate {
 }
 
 let config: Manifest | null = null
+// answer streams are resumed when the connection is lost, retrying with a growing delay
+const ANSWER_STREAM_MAX_RECONNECTIONS = 5
+const ANSWER_STREAM_RECONNECTION_DELAY_MS = 1000
 
 export const findManifest = async (): Promise<Manifest> => {
   if (!config) {
@@ -639,8 +642,8 @@ export class ApiService {
     return await response.json()
   }
 
-  private async fetch(path: string, method: string = 'GET', body: object | undefined = undefined, authEnabled: boolean = true) {
-    const headers: Record<string, string> = {}
+  private async fetch(path: string, method: string = 'GET', body: object | undefined = undefined, authEnabled: boolean = true, extraHeaders: Record<string, string> = {}) {
+    const headers: Record<string, string> = { ...extraHeaders }
     if (authEnabled) {
       headers['Authorization'] = await this.getUserAuth()
     }
@@ -1019,39 +1022,77 @@ export class ApiService {
 
     const contentType = resp.headers.get('content-type')
     if (contentType?.startsWith('text/event-stream')) {
-      const ret = await this.fetchSSEStream(resp, url)
-      for await (const part of ret) {
-        if (part.event == 'userMessage') {
-          yield { userMessage: part.data }
-        } else if (part.event == 'message') {
-          yield { answerText: part.data }
-        } else if (part.event == 'metadata') {
-          yield {
-            metadata: {
-              answerMessageId: part.data.answerMessageId,
-              files: part.data.files,
-              minutesSaved: part.data.minutesSaved,
-              stopped: part.data.stopped
-            }
-          }
-        } else if (part.event == 'status') {
-          yield {
-            status: {
-              action: part.data.action,
-              toolName: part.data.toolName,
-              step: part.data.step,
-              description: part.data.description,
-              args: part.data.args,
-              result: part.data.result
-            }
+      yield* this.readAnswerStream(threadId, resp, url)
+    } else {
+      yield resp.json()
+    }
+  }
+
+  // answers keep being generated by the server when the connection is lost, so we reconnect and resume the stream from the last received event
+  private async *readAnswerStream(threadId: number, resp: Response, url: string): AsyncIterable<ThreadMessagePart> {
+    let lastEventId: string | undefined
+    let reconnections = 0
+    while (true) {
+      try {
+        for await (const part of this.fetchSSEStream(resp, url)) {
+          lastEventId = part.id ?? lastEventId
+          reconnections = 0
+          const ret = this.parseThreadMessagePart(part)
+          if (ret) {
+            yield ret
           }
         }
+        return
+      } catch (e) {
+        // http errors are sent by the server, so there is nothing to resume
+        if (e instanceof HttpError || reconnections >= ANSWER_STREAM_MAX_RECONNECTIONS) {
+          throw e
+        }
+        reconnections++
+        console.warn(`Connection lost while reading answer of thread ${threadId}, reconnecting`, e)
+        await new Promise((resolve) => setTimeout(resolve, reconnections * ANSWER_STREAM_RECONNECTION_DELAY_MS))
+        url = `/threads/${threadId}/answer-stream`
+        resp = await this.fetch(url, 'GET', undefined, true, lastEventId ? { 'Last-Event-ID': lastEventId } : {})
       }
-    } else {
-      yield resp.json()
     }
   }
 
+  private parseThreadMessagePart(part: SSEPayload<any>): ThreadMessagePart | undefined {
+    if (part.event == 'userMessage') {
+      return { userMessage: part.data }
+    } else if (part.event == 'message') {
+      return { answerText: part.data }
+    } else if (part.event == 'partialAnswer') {
+      // sent when resuming a stream whose missed events are no longer available, with the whole answer generated so far
+      return { partialAnswer: part.data.text }
+    } else if (part.event == 'metadata') {
+      return {
+        metadata: {
+          answerMessageId: part.data.answerMessageId,
+          files: part.data.files,
+          minutesSaved: part.data.minutesSaved,
+          stopped: part.data.stopped
+        }
+      }
+    } else if (part.event == 'threadName') {
+      return { threadName: part.data.name }
+    } else if (part.event == 'minutesSaved') {
+      return { minutesSaved: part.data.minutesSaved }
+    } else if (part.event == 'status') {
+      return {
+        status: {
+          action: part.data.action,
+          toolName: part.data.toolName,
+          step: part.data.step,
+          description: part.data.description,
+          args: part.data.args,
+          result: part.data.result
+        }
+      }
+    }
+    return undefined
+  }
+
   private addFileToForm(file: File, formData: FormData, name: string) {
     // on windows it is not properly solving the mime type of markdown files
     if (file.name.toLowerCase().endsWith('.md')) {
@@ -1064,6 +1105,9 @@ export class ApiService {
 
   private async *fetchSSEStream<T=any>(resp: Response, url: string): AsyncIterable<SSEPayload<T>> {
     const reader = resp.body!.getReader()
+    const decoder = new TextDecoder('utf-8')
+    // events may be split among received chunks, so the last incomplete event is kept until the rest is received
+    let pending = ''
     let done = false
 
     while (!done) {
@@ -1071,8 +1115,9 @@ export class ApiService {
       done = readerDone
       if (!value) return
 
-      const events = ServerSentEvent.fromBytes(value)
-      for (const ev of events) {
+      const events = (pending + decoder.decode(value, { stream: true })).split(/\r\n\r\n/)
+      pending = events.pop()!
+      for (const ev of events.map((e) => ServerSentEvent.parseEvent(e))) {
         if (ev.event === 'error') {
           console.warn(`Error event sent by server in response to ${url}`, ev)
           throw new HttpError(resp.status, ev.data)
@@ -1080,7 +1125,8 @@ export class ApiService {
 
         yield {
           event: ev.event || 'message',
-          data: ev.event ? (JSON.parse(ev.data) as T) : (ev.data as T)
+          data: ev.event ? (JSON.parse(ev.data) as T) : (ev.data as T),
+          id: ev.id
         }
       }
     }
@@ -1169,12 +1215,15 @@ export class ApiService {
 export class ThreadMessagePart{
   userMessage?: { id: number, files: UploadedFile[] }
   answerText?: string
+  partialAnswer?: string
+  threadName?: string
   metadata?: {
     answerMessageId?: number
     files: UploadedFile[],
     minutesSaved?: number
     stopped?: boolean
   }
+  minutesSaved?: number
   status?: {
     action: string
     toolName?: string
@@ -1190,35 +1239,32 @@ type SSEPayload<T> = {
   event: string;
   /** parsed data payload */
   data: T;
+  /** the event id, used to resume streams */
+  id?: string;
 };
 
 class ServerSentEvent {
   event?: string
   data: string
+  id?: string
 
-  constructor(data: string, event?: string) {
+  constructor(data: string, event?: string, id?: string) {
     this.data = data
     this.event = event
+    this.id = id
   }
 
-  public static fromBytes(bs: Uint8Array): ServerSentEvent[] {
-    const text = new TextDecoder('utf-8').decode(bs)
-    const events = text.split(/\r\n\r\n/)
-    return events.map((e) => ServerSentEvent.parseEvent(e))
-  }
-
-  private static parseEvent(event: string): ServerSentEvent {
+  public static parseEvent(event: string): ServerSentEvent {
     const parts = event.split(/\r\n/)
-    let eventType
     const eventPrefix = 'event: '
-    if (parts[0].startsWith(eventPrefix)) {
-      eventType = parts[0].substring(eventPrefix.length)
-    }
+    const eventType = parts.find((p) => p.startsWith(eventPrefix))?.substring(eventPrefix.length)
+    const idPrefix = 'id: '
+    const id = parts.find((p) => p.startsWith(idPrefix))?.substring(idPrefix.length)
     const dataPrefix = 'data: '
     const data = parts
       .filter((p) => p.startsWith(dataPrefix))
       .map((p) => p.substring(dataPrefix.length))
       .join('\n')
-    return new ServerSentEvent(data, eventType)
+    return new ServerSentEvent(data, eventType, id)
   }
 }